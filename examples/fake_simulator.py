@@ -0,0 +1,396 @@
+"""
+用于本地调试的参考仿真端。
+
+按照与真实场景相同的协议连接 SceneAPI 监听的端口，发送合成的地图、车辆状态和摄像头图像，
+并接收控制命令。可以在没有仿真环境的机器上验证算法流程和各项可选协议特性。
+
+先启动使用 SceneAPI 的程序（例如 main.py），再运行::
+
+    python fake_simulator.py --ticks 300 --rate 30
+"""
+
+import argparse
+import json
+import math
+import socket
+import struct
+import tempfile
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+from metacar import wire
+from metacar.compression import Codec, available_codecs, codec_by_id
+from metacar.models import Code3, ProtocolFeature
+from metacar.shm import FrameRing
+
+_COMPRESSED_FLAG = 0x80000000
+_COMPRESSED_HEADER = struct.Struct("!BI")
+
+
+class FramedConnection:
+    """与 :class:`metacar.sockets.RawSocket` 对应的客户端，使用 4 字节长度前缀分包。"""
+
+    def __init__(self, host: str, port: int, retry_interval: float = 0.2):
+        self.codec: Codec | None = None  #: 发送时使用的压缩算法
+        self.compress_threshold = 1024
+        while True:
+            try:
+                self._sock = socket.create_connection((host, port))
+                break
+            except ConnectionRefusedError:
+                time.sleep(retry_interval)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, data: bytes):
+        if self.codec is not None and len(data) >= self.compress_threshold:
+            compressed = self.codec.compress(data)
+            header = _COMPRESSED_HEADER.pack(self.codec.id, len(data))
+            length = (len(header) + len(compressed)) | _COMPRESSED_FLAG
+            self._sock.sendall(struct.pack("!I", length) + header + compressed)
+        else:
+            self._sock.sendall(struct.pack("!I", len(data)) + data)
+
+    def _recv_exact(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("连接已关闭")
+            data.extend(chunk)
+        return bytes(data)
+
+    def recv(self) -> bytes:
+        (length,) = struct.unpack("!I", self._recv_exact(4))
+        if not length & _COMPRESSED_FLAG:
+            return self._recv_exact(length)
+        data = self._recv_exact(length & ~_COMPRESSED_FLAG)
+        codec_id, raw_length = _COMPRESSED_HEADER.unpack_from(data)
+        return codec_by_id(codec_id).decompress(
+            memoryview(data)[_COMPRESSED_HEADER.size :], raw_length
+        )
+
+    def close(self):
+        self._sock.close()
+
+
+def _vector(x: float, y: float, z: float = 0.0) -> dict:
+    return {"x": x, "y": y, "z": z}
+
+
+class FakeSimulator:
+    """合成数据的仿真端：主车沿一条直路匀速行驶，周围有若干障碍物。"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        model_port: int = 5061,
+        streaming_port: int = 5063,
+        features: list[str] | None = None,
+        cameras: int = 2,
+        image_size: tuple[int, int] = (640, 480),
+        obstacles: int = 10,
+        map_dir: str | None = None,
+        session_token: str | None = None,
+    ):
+        """
+        :param host: SceneAPI 监听的地址。
+        :param model_port: JSON 消息端口。
+        :param streaming_port: 视频流端口。
+        :param features: 声明支持的协议特性，默认为全部特性（未安装 lz4 时不声明 lz4 压缩）。
+        :param cameras: 主车摄像头数量。
+        :param image_size: 图像大小 (宽, 高)。
+        :param obstacles: 障碍物数量。
+        :param map_dir: 地图文件的目录，默认使用临时目录。
+        :param session_token: 会话令牌，指定时写入 code1 并作为视频流连接的第一条消息，
+            用于 :class:`~metacar.server.MultiSceneServer` 配对连接。
+        """
+        self._host = host
+        self._model_port = model_port
+        self._streaming_port = streaming_port
+        if features is None:
+            codecs = {codec.feature for codec in available_codecs().values()}
+            features = [
+                feature.value
+                for feature in ProtocolFeature
+                if feature in codecs
+                or feature
+                not in (
+                    ProtocolFeature.ZLIB_COMPRESSION,
+                    ProtocolFeature.LZ4_COMPRESSION,
+                )
+            ]
+        self._features = list(features)
+        self._cameras = cameras
+        self._image_size = image_size
+        self._obstacles = obstacles
+        self._map_dir = Path(map_dir or tempfile.mkdtemp(prefix="metacar-map-"))
+        self._session_token = session_token
+        self._enabled_features: list[str] = []
+        self._frame_ring: FrameRing | None = None
+        self.last_control: dict | None = None  #: 最近一次收到的车辆控制
+        self._write_map()
+
+    def _write_map(self):
+        """生成一条 200 米长的双车道直路。"""
+        route = [_vector(x, 0.0) for x in range(0, 200, 5)]
+        lanes = []
+        for idx, center_y in enumerate((-1.75, 1.75)):
+            lanes.append(
+                {
+                    "id": f"lane{idx}",
+                    "LeftBorder": {
+                        "borderType": 3 if idx == 0 else 2,
+                        "pathPoint": [
+                            _vector(x, center_y + 1.75) for x in range(0, 200, 5)
+                        ],
+                    },
+                    "RightBorder": {
+                        "borderType": 2 if idx == 0 else 6,
+                        "pathPoint": [
+                            _vector(x, center_y - 1.75) for x in range(0, 200, 5)
+                        ],
+                    },
+                    "leftLane": "" if idx == 1 else "lane1",
+                    "rightLane": "" if idx == 0 else "lane0",
+                    "width": 3.5,
+                    "pathPoint": [_vector(x, center_y) for x in range(0, 200, 5)],
+                }
+            )
+        roads = [
+            {
+                "id": "road0",
+                "beginPos": _vector(0, 0),
+                "endPos": _vector(195, 0),
+                "drivingType": 1,
+                "trafficSign": 0,
+                "stopLine": [_vector(195, -3.5), _vector(195, 3.5)],
+                "predecessor": [],
+                "successor": [],
+                "laneData": lanes,
+            }
+        ]
+        (self._map_dir / "route.json").write_text(json.dumps(route))
+        (self._map_dir / "map.json").write_text(json.dumps(roads))
+
+    def _code1(self) -> dict:
+        code1 = {
+            "code": 1,
+            "MapInfo": {
+                "path": str(self._map_dir),
+                "route": "route.json",
+                "map": "map.json",
+                "SubSceneInfo": [
+                    {
+                        "SubSceneName": "fake",
+                        "StartPoint": _vector(0, 0),
+                        "EndPoint": _vector(195, 0),
+                    }
+                ],
+            },
+            "Features": self._features,
+        }
+        if self._session_token is not None:
+            code1["SessionToken"] = self._session_token
+        return code1
+
+    def _camera_infos(self) -> list[dict]:
+        width, height = self._image_size
+        focal = width / 2
+        return [
+            {
+                "Id": f"cam{idx}",
+                "Position": _vector(1.5, 0, 1.4),
+                "Angle": {"orix": 0, "oriy": 0, "oriz": 360 / self._cameras * idx},
+                "Fov": 90,
+                "IntrinsicMatrix": [focal, 0, width / 2, 0, focal, height / 2, 0, 0, 1],
+                "ImageW": width,
+                "ImageH": height,
+            }
+            for idx in range(self._cameras)
+        ]
+
+    def _code3(self, tick: int, dt: float) -> dict:
+        speed = 10.0
+        ego_x = (tick * dt * speed) % 190
+        obstacles = [
+            {
+                "id": idx + 1,
+                "type": 6,
+                "posX": ego_x + 10 + idx * 8,
+                "posY": 1.75 if idx % 2 else -1.75,
+                "posZ": 0,
+                "velX": 8.0,
+                "velY": 0,
+                "velZ": 0,
+                "oriX": 0,
+                "oriY": 0,
+                "oriZ": 0,
+                "length": 4.5,
+                "width": 1.8,
+                "height": 1.5,
+                "RedundantValue": None,
+            }
+            for idx in range(self._obstacles)
+        ]
+        message = {
+            "code": 3,
+            "SimCarMsg": {
+                "Trajectory": [
+                    _vector(ego_x + d, -1.75 + 0.1 * math.sin(d / 10))
+                    for d in range(0, 100)
+                ],
+                "PoseGnss": {
+                    "posX": ego_x,
+                    "posY": -1.75,
+                    "posZ": 0,
+                    "velX": speed,
+                    "velY": 0,
+                    "velZ": 0,
+                    "oriX": 0,
+                    "oriY": 0,
+                    "oriZ": 0,
+                },
+                "DataMainVehicle": {
+                    "mainVehicleId": 0,
+                    "speed": speed,
+                    "gear": 1,
+                    "throttle": 0.3,
+                    "brake": 0,
+                    "steering": 0,
+                    "length": 4.6,
+                    "width": 1.9,
+                    "height": 1.5,
+                    "Signal_Light_LeftBlinker": False,
+                    "Signal_Light_RightBlinker": False,
+                    "Signal_Light_DoubleFlash": False,
+                    "Signal_Light_BrakeLight": False,
+                    "Signal_Light_FrontLight": False,
+                },
+                "Sensor": {"egoRGBCams": self._camera_infos(), "v2xCams": []},
+                "ObstacleEntryList": obstacles,
+                "TrafficLightStateLists": [],
+                "SceneStatus": {
+                    "SubSceneName": "fake",
+                    "UsedTime": tick * dt,
+                    "TimeLimit": 600,
+                    "EndPoint": _vector(195, 0),
+                },
+            },
+        }
+        if ProtocolFeature.FRAME_SEQ in self._enabled_features:
+            message["Seq"] = tick
+        return message
+
+    def _encode_code3(self, code3: dict) -> bytes:
+        if ProtocolFeature.BINARY_STATE in self._enabled_features:
+            return wire.encode_code3(Code3.model_validate(code3))
+        return json.dumps(code3).encode("utf-8")
+
+    def _decode_control(self, data: bytes) -> dict:
+        if wire.is_binary(data):
+            vc, _ = wire.decode_code4(data)
+            return vc.model_dump(mode="json", by_alias=True)
+        return json.loads(data)["SimCarMsg"]["VehicleControl"]
+
+    def _render_frame(self, tick: int, camera_idx: int) -> np.ndarray:
+        width, height = self._image_size
+        image = np.zeros((height, width, 3), np.uint8)
+        image[:, :, camera_idx % 3] = (tick * 4) % 256
+        cv2.putText(
+            image,
+            f"cam{camera_idx} #{tick}",
+            (10, height // 2),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            1,
+            (255, 255, 255),
+            2,
+        )
+        return image
+
+    def _send_frame(self, conn: FramedConnection, tick: int, camera_idx: int):
+        image = self._render_frame(tick, camera_idx)
+        if self._frame_ring is not None:
+            # 共享内存中直接存放未压缩的图像，视频流中只发送描述符
+            data = self._frame_ring.write(image)
+        else:
+            data = cv2.imencode(".jpg", image)[1].tobytes()
+        if ProtocolFeature.FRAME_SEQ in self._enabled_features:
+            camera_id = f"cam{camera_idx}".encode("utf-8")
+            data = struct.pack("!IB", tick, len(camera_id)) + camera_id + data
+        conn.send(data)
+
+    def run(self, ticks: int, rate: float | None = None, wait_control: bool = True):
+        """
+        连接 SceneAPI 并发送指定帧数的数据，最后发送 code5 结束场景。
+
+        :param ticks: 发送的帧数。
+        :param rate: 发送频率（Hz），为 None 时尽快发送。
+        :param wait_control: 是否每帧等待控制命令后再发送下一帧。
+        """
+        model_conn = FramedConnection(self._host, self._model_port)
+        streaming_conn = FramedConnection(self._host, self._streaming_port)
+        try:
+            if self._session_token is not None:
+                streaming_conn.send(self._session_token.encode("utf-8"))
+            model_conn.send(json.dumps(self._code1()).encode("utf-8"))
+            code2 = json.loads(model_conn.recv())
+            self._enabled_features = code2.get("Features", [])
+            print(f"已连接，启用的特性：{self._enabled_features}")
+            for codec in available_codecs().values():
+                if codec.feature in self._enabled_features:
+                    model_conn.codec = codec
+            if ProtocolFeature.SHARED_MEMORY_FRAMES in self._enabled_features:
+                width, height = self._image_size
+                self._frame_ring = FrameRing(
+                    width * height * 3, slots=max(16, self._cameras * 4)
+                )
+            dt = 1 / rate if rate else 0.05
+            for tick in range(ticks):
+                start_time = time.perf_counter()
+                model_conn.send(self._encode_code3(self._code3(tick, dt)))
+                for camera_idx in range(self._cameras):
+                    self._send_frame(streaming_conn, tick, camera_idx)
+                if wait_control:
+                    self.last_control = self._decode_control(model_conn.recv())
+                if rate:
+                    time.sleep(max(0.0, dt - (time.perf_counter() - start_time)))
+            model_conn.send(json.dumps({"code": 5}).encode("utf-8"))
+            # 等待 API 处理完剩余的消息再断开
+            time.sleep(0.5)
+        finally:
+            model_conn.close()
+            streaming_conn.close()
+            if self._frame_ring is not None:
+                self._frame_ring.close()
+                self._frame_ring = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用于本地调试的参考仿真端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ticks", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=None, help="发送频率（Hz）")
+    parser.add_argument("--cameras", type=int, default=2)
+    parser.add_argument("--obstacles", type=int, default=10)
+    parser.add_argument(
+        "--features",
+        nargs="*",
+        default=None,
+        help="声明支持的协议特性，默认为全部特性",
+    )
+    parser.add_argument(
+        "--no-wait", action="store_true", help="不等待控制命令，按固定频率发送"
+    )
+    args = parser.parse_args()
+    simulator = FakeSimulator(
+        host=args.host,
+        features=args.features,
+        cameras=args.cameras,
+        obstacles=args.obstacles,
+    )
+    simulator.run(args.ticks, rate=args.rate, wait_control=not args.no_wait)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,18 +7,20 @@ from tkinter import *
 from tkinter import ttk
 from multiprocessing import Process, Pipe
 from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
 import time
 from enum import Enum, auto
-import math
 from dataclasses import dataclass
 import numpy as np
-from scipy.spatial import KDTree
 from metacar import (
     Vector2,
     SceneStaticData,
     SimCarMsg,
     LineType,
+    GearMode,
 )
+from metacar.obb import OrientedBoxes
+from metacar.wire import state_arrays
 
 
 @dataclass
@@ -30,187 +32,325 @@ class LineInfo:
 
 
 class MsgType(Enum):
-    UPDATE = auto()
     QUIT = auto()
 
 
-def tk_process_func(
-    conn: Connection, scene_static_data: SceneStaticData, refresh_interval: int
-):
-    ROADLINE_COLOR_MAP = {
-        LineType.MIDDLE_LINE: "dark orange",  # 中线
-        LineType.SIDE_LINE: "black",  # 边线
-        LineType.SOLID_LINE: "black",  # 实线
-        LineType.STOP_LINE: "dark red",  # 停车线
-        LineType.ZEBRA_CROSSING: "dark blue",  # 斑马线
-        LineType.DASH_LINE: "grey",  # 虚线
-    }
-
-    def update(msg: SimCarMsg):
-        string_vars[0].set("{:.3f}".format(msg.main_vehicle.throttle))
-        string_vars[1].set("{:.3f}".format(msg.main_vehicle.brake))
-        string_vars[2].set("{:.3f}".format(msg.main_vehicle.steering))
-        string_vars[3].set(msg.main_vehicle.gear.name)
-        string_vars[4].set("{:.3f}".format(msg.main_vehicle.speed))
-        string_vars[5].set("{:.2f}".format(msg.pose_gnss.pos_x))
-        string_vars[6].set("{:.2f}".format(msg.pose_gnss.pos_y))
-        string_vars[7].set("{:.2f}".format(msg.pose_gnss.ori_z))
-        # clear canvas
-        map_canvas.delete("all")
-        canvas_width = map_canvas.winfo_width()
-        canvas_height = map_canvas.winfo_height()
-        main_vehicle_pos = Vector2(msg.pose_gnss.pos_x, msg.pose_gnss.pos_y)
-
-        SCALE = 10
-
-        def convert_pos(pos: Vector2) -> tuple[float, float]:
-            """将场景中的坐标转换为画布上的坐标。"""
-            vec = (pos - main_vehicle_pos) * SCALE
-            return (canvas_width / 2 + vec.x, canvas_height / 2 - vec.y)
-
-        def draw_rectangle(
-            center_pos: Vector2,
-            length: float,
-            width: float,
-            ori_z: float,
-            outline_color: str,
-        ):
-            """绘制带有旋转角度的矩形。"""
-            rotate_rad = -math.radians(ori_z)
-            a = Vector2(length / 2, width / 2)
-            b = Vector2(length / 2, -width / 2)
-            c = Vector2(-length / 2, -width / 2)
-            d = Vector2(-length / 2, width / 2)
-            a, b, c, d = map(
-                lambda v: convert_pos(v.rotate_rad(rotate_rad) + center_pos),
-                (a, b, c, d),
-            )
-            # 绘制无填充的多边形
-            map_canvas.create_polygon(a, b, c, d, fill="", outline=outline_color)
+def snapshot_dtype(max_trajectory_points: int, max_obstacles: int) -> np.dtype:
+    """
+    共享内存中快照的内存布局。
 
-        # 绘制主车
-        draw_rectangle(
-            main_vehicle_pos,
-            msg.main_vehicle.length,
-            msg.main_vehicle.width,
-            msg.pose_gnss.ori_z,
-            "green",
-        )
+    :param max_trajectory_points: 轨迹点数的上限。
+    :param max_obstacles: 障碍物数量的上限。
+    """
+    return np.dtype(
+        [
+            ("seq", "<u8"),  # 写入序号，奇数表示正在写入
+            ("throttle", "<f8"),
+            ("brake", "<f8"),
+            ("steering", "<f8"),
+            ("speed", "<f8"),
+            ("gear", "<i4"),
+            ("trajectory_count", "<u4"),
+            ("obstacle_count", "<u4"),
+            ("_reserved", "<u4"),
+            ("pose", "<f8", (3,)),  # pos_x, pos_y, ori_z
+            ("size", "<f8", (2,)),  # 主车的 length, width
+            ("trajectory", "<f8", (max_trajectory_points, 2)),
+            # 每个障碍物为 pos_x, pos_y, ori_z, length, width
+            ("obstacles", "<f8", (max_obstacles, 5)),
+        ]
+    )
 
-        # 绘制障碍物
-        for obstacle in msg.obstacles:
-            draw_rectangle(
-                Vector2(obstacle.pos_x, obstacle.pos_y),
-                obstacle.length,
-                obstacle.width,
-                obstacle.ori_z,
-                "red",
-            )
 
-        # 绘制行驶路线
-        trajectory_points = [convert_pos(pt.to_vector2()) for pt in msg.trajectory]
-        if len(trajectory_points) > 1:
-            map_canvas.create_line(trajectory_points, fill="blue")
-
-        # 绘制车道线
-        radius = math.hypot(canvas_width, canvas_height) / 2 / SCALE
-        min_idx = [-1] * len(line_list)
-        max_idx = [-1] * len(line_list)
-        point_idxs = kdtree.query_ball_point(
-            (main_vehicle_pos.x, main_vehicle_pos.y), radius
+class SnapshotSlot:
+    """
+    共享内存中只保存最新一帧的快照。
+
+    写入方每次覆盖整个快照，写入前后各把序号加一，读取方复制快照后检查序号，
+    序号为奇数或复制前后不一致时说明读到了写了一半的数据，直接丢弃，等下一次刷新再读。
+    写入和读取都不会阻塞对方，写入的耗时只与障碍物和轨迹数组的大小有关。
+    """
+
+    def __init__(
+        self,
+        max_trajectory_points: int = 4096,
+        max_obstacles: int = 1024,
+        name: str | None = None,
+    ):
+        """
+        :param max_trajectory_points: 轨迹点数的上限，超过时均匀抽取。
+        :param max_obstacles: 障碍物数量的上限，超过的部分不显示。
+        :param name: 已有共享内存的名称，指定时映射该共享内存，否则创建新的共享内存。
+        """
+        self._dtype = snapshot_dtype(max_trajectory_points, max_obstacles)
+        if name is None:
+            self._shm = SharedMemory(create=True, size=self._dtype.itemsize)
+            self._owner = True
+        else:
+            self._shm = SharedMemory(name=name)
+            self._owner = False
+        self._slot = np.ndarray((), self._dtype, buffer=self._shm.buf)
+        if self._owner:
+            self._slot["seq"] = 0
+        self._last_seq = 0
+
+    @property
+    def name(self) -> str:
+        """共享内存名称。"""
+        return self._shm.name
+
+    @property
+    def capacity(self) -> tuple[int, int]:
+        """元组 (轨迹点数的上限, 障碍物数量的上限)。"""
+        return (
+            self._dtype["trajectory"].shape[0],
+            self._dtype["obstacles"].shape[0],
         )
-        for point_idx in point_idxs:
-            rid, pid = point_info[point_idx]
-            if min_idx[rid] == -1:
-                min_idx[rid] = pid
-                max_idx[rid] = pid
-            else:
-                min_idx[rid] = min(min_idx[rid], pid)
-                max_idx[rid] = max(max_idx[rid], pid)
-        for line_idx, line in enumerate(line_list):
-            cur_min_idx = min_idx[line_idx]
-            cur_max_idx = max_idx[line_idx]
-            if cur_min_idx == -1:
-                continue
-            if line.type == LineType.ZEBRA_CROSSING:
-                points = [convert_pos(Vector2(pt.x, pt.y)) for pt in line.points]
-                map_canvas.create_polygon(
-                    points, fill="", outline=ROADLINE_COLOR_MAP[line.type]
+
+    def write(self, msg: SimCarMsg):
+        """写入一帧数据，覆盖上一帧。"""
+        arrays = state_arrays(msg)
+        max_points, max_obstacles = self.capacity
+        trajectory = arrays.trajectory
+        if len(trajectory) > max_points:
+            trajectory = trajectory[:: -(-len(trajectory) // max_points)]
+        obstacles = arrays.obstacles[:max_obstacles]
+        vehicle = msg.main_vehicle
+        slot = self._slot
+        seq = int(slot["seq"]) + 1
+        slot["seq"] = seq
+        slot["throttle"] = vehicle.throttle
+        slot["brake"] = vehicle.brake
+        slot["steering"] = vehicle.steering
+        slot["speed"] = vehicle.speed
+        slot["gear"] = vehicle.gear.value
+        slot["pose"] = arrays.pose[[0, 1, 8]]
+        slot["size"] = (vehicle.length, vehicle.width)
+        slot["trajectory_count"] = len(trajectory)
+        slot["trajectory"][: len(trajectory)] = trajectory[:, :2]
+        slot["obstacle_count"] = len(obstacles)
+        boxes = slot["obstacles"]
+        for column, field in enumerate(("pos_x", "pos_y", "ori_z", "length", "width")):
+            boxes[: len(obstacles), column] = obstacles[field]
+        slot["seq"] = seq + 1
+
+    def read(self) -> np.ndarray | None:
+        """
+        读取最新一帧的快照。
+
+        :return: 快照的副本，没有新数据或读到写了一半的数据时返回 None。
+        """
+        seq = int(self._slot["seq"])
+        if seq % 2 or seq == self._last_seq:
+            return None
+        snapshot = self._slot.copy()
+        if int(self._slot["seq"]) != seq:
+            return None
+        self._last_seq = seq
+        return snapshot
+
+    def close(self):
+        """解除映射，创建者同时释放共享内存。"""
+        del self._slot
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+ROADLINE_COLOR_MAP = {
+    LineType.MIDDLE_LINE: "dark orange",  # 中线
+    LineType.SIDE_LINE: "black",  # 边线
+    LineType.SOLID_LINE: "black",  # 实线
+    LineType.STOP_LINE: "dark red",  # 停车线
+    LineType.ZEBRA_CROSSING: "dark blue",  # 斑马线
+    LineType.DASH_LINE: "grey",  # 虚线
+}
+
+
+class MapRenderer:
+    """
+    保留模式的地图绘制。
+
+    车道线、建筑物等静态图形只在创建时绘制一次，使用带缩放的场景坐标并打上 ``static`` 标签，
+    主车移动时用一次 ``canvas.move("static", ...)`` 整体平移。
+    主车、障碍物和行驶路线的图形放在对象池中复用，每帧只对坐标发生变化的图形调用 ``canvas.coords``，
+    多余的障碍物图形隐藏而不删除。
+    """
+
+    SCALE = 10  #: 每米对应的像素数
+
+    def __init__(self, canvas: Canvas, scene_static_data: SceneStaticData):
+        """
+        :param canvas: 绘制用的画布。
+        :param scene_static_data: 场景静态数据，用于绘制车道线和建筑物。
+        """
+        self._canvas = canvas
+        # 静态图形当前的平移量，画布坐标 = 缩放后的场景坐标 + 平移量
+        self._offset = (0.0, 0.0)
+        self._coords: dict[int, list[float]] = {}
+        self._hidden: set[int] = set()
+        self._create_static(scene_static_data)
+        self._ego = canvas.create_polygon(0, 0, 0, 0, 0, 0, fill="", outline="green")
+        self._trajectory = canvas.create_line(0, 0, 0, 0, fill="blue")
+        self._set_hidden(self._trajectory, True)
+        self._obstacles: list[int] = []
+
+    def _scaled(self, points: np.ndarray) -> list[float]:
+        """将形状为 (..., 2) 的场景坐标转换为缩放后的坐标序列，Y 轴朝下。"""
+        return (points * (self.SCALE, -self.SCALE)).ravel().tolist()
+
+    def _create_static(self, scene_static_data: SceneStaticData):
+        """创建车道线和建筑物的图形。"""
+        canvas = self._canvas
+        lines: list[LineInfo] = []
+        for road in scene_static_data.roads:
+            if road.stop_line:
+                lines.append(LineInfo(LineType.STOP_LINE, road.stop_line))
+            for lane in road.lanes:
+                lines.append(
+                    LineInfo(lane.left_border.type, lane.left_border.path_points)
                 )
+                lines.append(
+                    LineInfo(lane.right_border.type, lane.right_border.path_points)
+                )
+        for line in lines:
+            if len(line.points) < 2:
                 continue
-            if cur_min_idx > 0:
-                cur_min_idx -= 1
-            if cur_max_idx < len(line.points) - 1:
-                cur_max_idx += 1
-            points = [
-                convert_pos(Vector2(pt.x, pt.y))
-                for pt in line.points[cur_min_idx : cur_max_idx + 1]
-            ]
-            map_canvas.create_line(points, fill=ROADLINE_COLOR_MAP[line.type])
+            coords = self._scaled(np.array([(pt.x, pt.y) for pt in line.points]))
+            color = ROADLINE_COLOR_MAP[line.type]
+            if line.type == LineType.ZEBRA_CROSSING:
+                canvas.create_polygon(coords, fill="", outline=color, tags="static")
+            else:
+                canvas.create_line(coords, fill=color, tags="static")
 
         # 判断是否是 VLA 场景
         if scene_static_data.vla_extension:
-            # 绘制建筑物
-            for building in scene_static_data.vla_extension.buildings:
-                # 绘制建筑物边框
-                pos = Vector2(building.pos_x, building.pos_y)
-                draw_rectangle(
-                    pos,
-                    building.length,
-                    building.width,
-                    building.ori_z,
-                    "blue",
+            buildings = scene_static_data.vla_extension.buildings
+            boxes = np.array(
+                [(b.pos_x, b.pos_y, b.ori_z, b.length, b.width) for b in buildings]
+            ).reshape(-1, 5)
+            # 绘制建筑物边框
+            for polygon in OrientedBoxes.from_arrays(*boxes.T).corners():
+                canvas.create_polygon(
+                    self._scaled(polygon), fill="", outline="blue", tags="static"
                 )
-                # 在建筑物中心显示名称
-                center_pos = convert_pos(pos)
-                map_canvas.create_text(
-                    center_pos[0],
-                    center_pos[1],
+            # 在建筑物中心显示名称
+            for building in buildings:
+                canvas.create_text(
+                    building.pos_x * self.SCALE,
+                    -building.pos_y * self.SCALE,
                     text=building.name,
                     fill="blue",
+                    tags="static",
                 )
 
+    def _set_hidden(self, item: int, hidden: bool):
+        if hidden != (item in self._hidden):
+            self._canvas.itemconfigure(item, state="hidden" if hidden else "normal")
+            if hidden:
+                self._hidden.add(item)
+            else:
+                self._hidden.discard(item)
+
+    def _set_coords(self, item: int, coords: list[float]):
+        """只在坐标变化时更新图形。"""
+        if self._coords.get(item) != coords:
+            self._canvas.coords(item, coords)
+            self._coords[item] = coords
+        self._set_hidden(item, False)
+
+    def render(self, snapshot: np.ndarray):
+        """
+        按快照更新画布，主车位于画布中心。
+
+        :param snapshot: :meth:`SnapshotSlot.read` 的结果。
+        """
+        canvas = self._canvas
+        pos_x, pos_y, ori_z = snapshot["pose"].tolist()
+        offset = (
+            canvas.winfo_width() / 2 - pos_x * self.SCALE,
+            canvas.winfo_height() / 2 + pos_y * self.SCALE,
+        )
+        if offset != self._offset:
+            canvas.move(
+                "static", offset[0] - self._offset[0], offset[1] - self._offset[1]
+            )
+            self._offset = offset
+
+        def convert_points(points: np.ndarray) -> list[float]:
+            """将形状为 (..., 2) 的场景坐标转换为画布坐标序列。"""
+            canvas_points = points * (self.SCALE, -self.SCALE) + offset
+            return canvas_points.ravel().tolist()
+
+        # 绘制主车
+        ego = OrientedBoxes.from_arrays(pos_x, pos_y, ori_z, *snapshot["size"])
+        self._set_coords(self._ego, convert_points(ego.corners()[0]))
+
+        # 绘制障碍物，每行为 pos_x, pos_y, ori_z, length, width
+        boxes = snapshot["obstacles"][: snapshot["obstacle_count"]]
+        while len(self._obstacles) < len(boxes):
+            item = canvas.create_polygon(0, 0, 0, 0, 0, 0, fill="", outline="red")
+            self._obstacles.append(item)
+        corners = OrientedBoxes.from_arrays(*boxes.T).corners()
+        for item, polygon in zip(self._obstacles, corners):
+            self._set_coords(item, convert_points(polygon))
+        for item in self._obstacles[len(boxes) :]:
+            self._set_hidden(item, True)
+
+        # 绘制行驶路线
+        trajectory = snapshot["trajectory"][: snapshot["trajectory_count"]]
+        if len(trajectory) > 1:
+            self._set_coords(self._trajectory, convert_points(trajectory))
+        else:
+            self._set_hidden(self._trajectory, True)
+
+
+def tk_process_func(
+    conn: Connection,
+    scene_static_data: SceneStaticData,
+    refresh_interval: int,
+    snapshot_name: str,
+    snapshot_capacity: tuple[int, int],
+):
+    def update(snapshot: np.ndarray):
+        pos_x, pos_y, ori_z = snapshot["pose"].tolist()
+        values = (
+            "{:.3f}".format(snapshot["throttle"]),
+            "{:.3f}".format(snapshot["brake"]),
+            "{:.3f}".format(snapshot["steering"]),
+            GearMode(int(snapshot["gear"])).name,
+            "{:.3f}".format(snapshot["speed"]),
+            "{:.2f}".format(pos_x),
+            "{:.2f}".format(pos_y),
+            "{:.2f}".format(ori_z),
+        )
+        for idx, value in enumerate(values):
+            # 数值没有变化时不触发标签的重绘
+            if value != label_values[idx]:
+                string_vars[idx].set(value)
+                label_values[idx] = value
+        renderer.render(snapshot)
+
     def check_message():
         """检查管道，如果有消息则处理。"""
         start_time = time.time()
 
+        snapshot = snapshot_slot.read()
+        if snapshot is not None:
+            update(snapshot)
         if conn.poll():
             message = conn.recv()
             match message["type"]:
-                case MsgType.UPDATE:
-                    update(message["msg"])
                 case MsgType.QUIT:
                     root.destroy()
+                    return
 
         # 计算下一次调用 check_message 的时间
         elapsed_time = time.time() - start_time
         next_interval = max(0, refresh_interval - int(elapsed_time * 1000))
         root.after(next_interval, check_message)
 
-    # 先把所有需要绘制的车道线提取出来
-    line_list: list[LineInfo] = []
-    for road in scene_static_data.roads:
-        if road.stop_line:
-            line_list.append(LineInfo(LineType.STOP_LINE, road.stop_line))
-        for lane in road.lanes:
-            line_list.append(
-                LineInfo(lane.left_border.type, lane.left_border.path_points)
-            )
-            line_list.append(
-                LineInfo(lane.right_border.type, lane.right_border.path_points)
-            )
-
-    # 建 kdtree
-    tmp_line_points: list[tuple[float, float]] = []
-    point_info: list[tuple[int, int]] = []
-    for line_idx, line in enumerate(line_list):
-        for point_idx, point in enumerate(line.points):
-            tmp_line_points.append((point.x, point.y))
-            point_info.append((line_idx, point_idx))
-    # 将 tmp_points 转换为 numpy 数组，并 reshape 为 (N, 2) 的形状，避免数组为空时建树失败
-    line_points = np.array(tmp_line_points, dtype=float).reshape(-1, 2)
-    del tmp_line_points
-    kdtree = KDTree(line_points)
+    snapshot_slot = SnapshotSlot(*snapshot_capacity, name=snapshot_name)
 
     root = Tk()
     root.title("仪表盘")
@@ -225,6 +365,7 @@ def tk_process_func(
     # 仪表盘的各个组件
     labels = ["油门", "刹车", "方向盘", "档位", "速度", "x坐标", "y坐标", "航向角"]
     string_vars = [StringVar() for _ in range(len(labels))]
+    label_values = [""] * len(labels)
 
     for row, (label_str, string_var) in enumerate(zip(labels, string_vars)):
         ttk.Label(mainframe, text=label_str).grid(column=0, row=row, sticky=E)
@@ -240,6 +381,7 @@ def tk_process_func(
         background="white",
     )
     map_canvas.grid(column=2, row=0, rowspan=len(labels), sticky="NSEW")
+    renderer = MapRenderer(map_canvas, scene_static_data)
 
     # 窗口大小改变时，将空间分配给画布
     mainframe.grid_columnconfigure(2, weight=1)
@@ -252,38 +394,55 @@ def tk_process_func(
     root.after_idle(check_message)
     conn.send("ready")
     root.mainloop()
+    snapshot_slot.close()
 
 
 class Dashboard:
     """
     显示车辆信息的仪表盘。
-    使用多进程实现，使用 multiprocessing.Pipe 作为进程间通信的方式。
+    使用多进程实现，每帧的数据通过共享内存中的 :class:`SnapshotSlot` 传递，
+    multiprocessing.Pipe 只用于初始化和退出。
     """
 
-    def __init__(self, scene_static_data: SceneStaticData, refresh_interval: int = 20):
+    def __init__(
+        self,
+        scene_static_data: SceneStaticData,
+        refresh_interval: int = 20,
+        max_trajectory_points: int = 4096,
+        max_obstacles: int = 1024,
+    ):
         """
         初始化仪表盘。
         :param scene_static_data: 场景静态数据，用于绘制车道线。
-        :param refresh_interval: 刷新间隔，单位毫秒，一定要比 update 方法的调用频率高。
+        :param refresh_interval: 刷新间隔，单位毫秒。界面只显示最新一帧，刷新慢于 update 时中间的帧会被跳过。
+        :param max_trajectory_points: 显示的轨迹点数的上限。
+        :param max_obstacles: 显示的障碍物数量的上限。
         """
+        self._snapshot = SnapshotSlot(max_trajectory_points, max_obstacles)
         self._conn, child_conn = Pipe()
         self._tk_process = Process(
             target=tk_process_func,
-            args=(child_conn, scene_static_data, refresh_interval),
+            args=(
+                child_conn,
+                scene_static_data,
+                refresh_interval,
+                self._snapshot.name,
+                self._snapshot.capacity,
+            ),
         )
         self._tk_process.start()
-        # 等待仪表盘初始化完成（包括创建窗口、创建 kdtree 等）
+        # 等待仪表盘初始化完成（包括创建窗口、绘制静态图形等）
         ready = self._conn.recv()
         if ready != "ready":
             raise RuntimeError("仪表盘初始化失败")
 
     def update(self, msg: SimCarMsg):
-        """更新仪表盘的方法。"""
-        if self._tk_process.is_alive():
-            self._conn.send({"type": MsgType.UPDATE, "msg": msg})
+        """更新仪表盘的方法，只覆盖共享内存中的快照，不会阻塞。"""
+        self._snapshot.write(msg)
 
     def quit(self):
         """退出仪表盘的方法。"""
         if self._tk_process.is_alive():
             self._conn.send({"type": MsgType.QUIT})
         self._tk_process.join()
+        self._snapshot.close()
@@ -0,0 +1,73 @@
+"""
+测量 ``import metacar`` 及常见用法的导入耗时。
+
+每条导入语句在新的解释器进程中执行多次，输出耗时的中位数和最小值（不含解释器本身的启动时间），
+以及导入后是否加载了 OpenCV、pydantic 等较重的依赖。
+
+用法::
+
+    python examples/import_benchmark.py [-n 重复次数]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = [
+    "import metacar",
+    "from metacar import Vector2, Vector3",
+    "from metacar import LineType, GearMode",
+    "from metacar import SimCarMsg",
+    "from metacar import SceneAPI",
+    "from metacar import SceneAPI; SceneAPI()",
+]
+
+HEAVY_MODULES = ["cv2", "pydantic", "numpy", "http.server"]
+
+# 在子进程中执行的代码，输出导入耗时和已加载的重量级依赖
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in {heavy!r} if m in sys.modules]]))
+"""
+
+
+def measure(statement: str, repeat: int) -> tuple[list[float], list[str]]:
+    """
+    在新的解释器进程中重复执行导入语句。
+
+    :param statement: 导入语句。
+    :param repeat: 重复次数。
+    :return: 元组 (每次的耗时, 导入后加载的重量级依赖)。
+    """
+    code = _PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True, text=True
+        ).stdout
+        elapsed, loaded = json.loads(output.strip().splitlines()[-1])
+        times.append(elapsed)
+    return times, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量 metacar 的导入耗时")
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="重复次数")
+    args = parser.parse_args()
+    print(f"{'导入语句':<44}{'中位数(ms)':>12}{'最小值(ms)':>12}  已加载的依赖")
+    for statement in STATEMENTS:
+        times, loaded = measure(statement, args.repeat)
+        print(
+            f"{statement:<48}{statistics.median(times) * 1000:>12.1f}"
+            f"{min(times) * 1000:>12.1f}  {', '.join(loaded) or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
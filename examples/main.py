@@ -1,7 +1,9 @@
 import logging
 import keyboard
 import math
-from metacar import SceneAPI, GearMode, VehicleControl, Vector3, SimCarMsg
+import numpy as np
+from metacar import SceneAPI, GearMode, VehicleControl, SimCarMsg
+from metacar.trajectory import Trajectory
 
 # 是否使用 GUI 界面
 USE_GUI = True
@@ -65,17 +67,15 @@ def calc_throttle_brake(
 
 
 # Stanley 算法
-def calc_steering(
-    pos: Vector3, yaw: float, speed: float, trajectory: list[Vector3]
-) -> float:
+def calc_steering(msg: SimCarMsg, trajectory: Trajectory) -> float:
     K = 0.5
-    for traj_pos in trajectory:
-        if math.dist(traj_pos, pos) > K * speed:
-            target_pos = traj_pos
-            break
-    else:
-        target_pos = trajectory[-1]
-    theta = (target_pos - pos).yaw_rad()
+    pose = msg.pose_gnss
+    offset = trajectory.points - (pose.pos_x, pose.pos_y, pose.pos_z)
+    # 第一个与主车距离超过 K * speed 的轨迹点，都不超过时取最后一个点
+    far = np.flatnonzero(np.linalg.norm(offset, axis=1) > K * msg.main_vehicle.speed)
+    target = far[0] if len(far) else -1
+    theta = math.atan2(offset[target, 1], offset[target, 0])
+    yaw = -math.radians(pose.ori_z)
     steering_angle = (theta - yaw) % (2 * math.pi)
     if steering_angle > math.pi:
         steering_angle -= 2 * math.pi
@@ -83,21 +83,15 @@ def calc_steering(
     return max(min(steering, 1), -1)
 
 
-def get_vehicle_control_from_algorithm(msg: SimCarMsg) -> VehicleControl:
+def get_vehicle_control_from_algorithm(
+    msg: SimCarMsg, trajectory: Trajectory | None
+) -> VehicleControl:
     vc = VehicleControl()
     vc.gear = GearMode.DRIVE
     # 目前只支持固定速度
     vc.throttle, vc.brake = calc_throttle_brake(msg.main_vehicle.speed, 15)
-    vc.steering = calc_steering(
-        Vector3(
-            msg.pose_gnss.pos_x,
-            msg.pose_gnss.pos_y,
-            msg.pose_gnss.pos_z,
-        ),
-        -math.radians(msg.pose_gnss.ori_z),
-        msg.main_vehicle.speed,
-        msg.trajectory,
-    )
+    if trajectory is not None:
+        vc.steering = calc_steering(msg, trajectory)
     return vc
 
 
@@ -125,7 +119,11 @@ def main():
         if use_keyboard:
             vehicle_control = get_vehicle_control_from_keyboard()
         else:
-            vehicle_control = get_vehicle_control_from_algorithm(sim_car_msg)
+            # 轨迹没有变化时复用上一帧的计算结果
+            trajectory = api.trajectory(sim_car_msg) if sim_car_msg.trajectory else None
+            vehicle_control = get_vehicle_control_from_algorithm(
+                sim_car_msg, trajectory
+            )
         api.set_vehicle_control(vehicle_control)
         if USE_GUI:
             dashboard.update(sim_car_msg)
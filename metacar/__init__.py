@@ -1,40 +1,51 @@
+"""
+``import metacar`` 只加载本文件，:data:`__all__` 中的名称在首次访问时才导入所在的子模块。
+
+只使用 :class:`Vector2`、枚举等轻量名称的程序不需要加载 OpenCV 和全部数据模型，
+缩短大量短生命周期进程的启动时间。导入耗时可以用 ``examples/import_benchmark.py`` 测量。
+"""
+
 __version__ = "0.4.0"
 
-from .sceneapi import SceneAPI
-from .geometry import Vector2, Vector3
-from .models import (
-    VLAExtension,
-    VLATextOutput,
-    VLAExtensionOutput,
-    FunctionZoneViolation,
-    FunctionZoneResult,
-    ParkingResult,
-    BuildingInfo,
-    RegionType,
-    RegionInfo,
-    SubSceneInfo,
-    LineType,
-    BorderInfo,
-    LaneInfo,
-    DrivingType,
-    TrafficSignType,
-    RoadInfo,
-    SceneStaticData,
-    PoseGnss,
-    GearMode,
-    MainVehicleInfo,
-    CameraInfo,
-    SensorInfo,
-    ObstacleType,
-    ObstacleInfo,
-    TrafficLightState,
-    TrafficLightInfo,
-    TrafficLightGroupInfo,
-    SceneStatus,
-    SimCarMsg,
-    VehicleControl,
-    CameraFrame,
-)
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .sceneapi import SceneAPI
+    from .geometry import Vector2, Vector3
+    from .models import (
+        VLAExtension,
+        VLATextOutput,
+        VLAExtensionOutput,
+        FunctionZoneViolation,
+        FunctionZoneResult,
+        ParkingResult,
+        BuildingInfo,
+        RegionType,
+        RegionInfo,
+        SubSceneInfo,
+        LineType,
+        BorderInfo,
+        LaneInfo,
+        DrivingType,
+        TrafficSignType,
+        RoadInfo,
+        SceneStaticData,
+        PoseGnss,
+        GearMode,
+        MainVehicleInfo,
+        CameraInfo,
+        SensorInfo,
+        ObstacleType,
+        ObstacleInfo,
+        TrafficLightState,
+        TrafficLightInfo,
+        TrafficLightGroupInfo,
+        SceneStatus,
+        SimCarMsg,
+        VehicleControl,
+        CameraFrame,
+    )
 
 __all__ = [
     "__version__",
@@ -76,3 +87,42 @@ __all__ = [
     "VehicleControl",
     "CameraFrame",
 ]
+
+
+# 名称 -> 所在的子模块，未列出的名称都在 models 中
+_LAZY_MODULES = {
+    "SceneAPI": ".sceneapi",
+    "Vector2": ".geometry",
+    "Vector3": ".geometry",
+    # 枚举不依赖 pydantic，直接从 enums 导入，models 中的是同一个对象
+    "RegionType": ".enums",
+    "LineType": ".enums",
+    "DrivingType": ".enums",
+    "TrafficSignType": ".enums",
+    "GearMode": ".enums",
+    "ObstacleType": ".enums",
+    "TrafficLightState": ".enums",
+}
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        module = importlib.import_module(_LAZY_MODULES.get(name, ".models"), __name__)
+        value = getattr(module, name)
+    else:
+        # 兼容 ``import metacar`` 之后直接访问子模块的用法，例如 ``metacar.wire``
+        try:
+            value = importlib.import_module(f".{name}", __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f"{__name__}.{name}":
+                raise
+            raise AttributeError(
+                f"module {__name__!r} has no attribute {name!r}"
+            ) from None
+    # 缓存到模块的全局变量中，之后的访问不再经过 __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
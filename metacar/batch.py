@@ -0,0 +1,187 @@
+"""
+把一帧所有摄像头的图像写入一个预分配的批量张量中，供神经网络推理使用。
+
+默认情况下每个摄像头的图像是单独分配的数组，组成批量还需要 ``np.stack`` 再复制一遍所有像素。
+创建 :class:`~metacar.SceneAPI` 时传入 :class:`FrameBatcher` 后，每帧的图像写入同一块连续内存中，
+并通过 :attr:`CameraFrames.batch <metacar.models.CameraFrames.batch>` 获取。
+
+``cv2.imdecode`` 不支持输出到指定数组，每张图像仍会先解码到 OpenCV 分配的临时数组，再复制一次到张量中，
+节省的是 ``np.stack`` 的复制以及每帧分配批量张量的开销，而不是解码本身的复制。
+"""
+
+import logging
+import time
+from typing import Callable, Literal, Sequence
+import numpy as np
+from . import metrics
+from .framepool import FrameLease, FramePool
+from .models import CameraFrame, CameraFrames, CameraInfo
+from .shm import is_descriptor
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBatch:
+    """一帧所有摄像头的图像组成的批量张量。"""
+
+    __slots__ = ("tensor", "camera_ids", "_lease")
+
+    def __init__(self, tensor: np.ndarray, camera_ids: list[str], lease: FrameLease):
+        self.tensor = tensor  #: 批量张量，形状为 (N, H, W, 3) 或 (N, 3, H, W)
+        self.camera_ids = camera_ids  #: 张量第一维对应的摄像头 ID
+        self._lease = lease
+
+    def retain(self) -> "FrameBatch":
+        """需要在之后的帧中继续使用张量时调用，并在用完后调用 :meth:`release`。"""
+        self._lease.retain()
+        return self
+
+    def release(self):
+        """释放一次引用。"""
+        self._lease.release()
+
+
+class FrameBatcher:
+    """
+    批量张量的格式配置，以及张量的缓冲池。
+
+    输出为 ``NHWC``、``uint8``、BGR 且不归一化时，解码结果直接复制到张量中，不需要额外的转换；
+    其他格式先复制到复用的暂存区，再一次性转换到张量中，归一化在张量上原地完成。
+    """
+
+    def __init__(
+        self,
+        layout: Literal["NHWC", "NCHW"] = "NHWC",
+        dtype: np.dtype = np.uint8,
+        size: tuple[int, int] | None = None,
+        rgb: bool = False,
+        scale: float = 1.0,
+        mean: Sequence[float] | None = None,
+        std: Sequence[float] | None = None,
+        depth: int = 4,
+    ):
+        """
+        :param layout: 张量布局，``"NHWC"`` 或 ``"NCHW"``。
+        :param dtype: 张量类型，归一化时必须为浮点类型。
+        :param size: 输出图像大小 (宽, 高)，默认使用第一个摄像头的图像大小，大小不一致的图像会被缩放。
+        :param rgb: 是否转换为 RGB 通道顺序，默认为 OpenCV 的 BGR。
+        :param scale: 像素值的缩放系数，例如 ``1 / 255``。
+        :param mean: 缩放后每个通道减去的均值，通道顺序与输出一致。
+        :param std: 减去均值后每个通道除以的标准差，通道顺序与输出一致。
+        :param depth: 缓冲池中张量的数量，应不少于跨帧持有的帧数 + 1（``latest_only`` 模式下 + 3）。
+        :raises ValueError: 当参数不合法时抛出。
+        """
+        if layout not in ("NHWC", "NCHW"):
+            raise ValueError(f"不支持的张量布局：{layout}")
+        self._dtype = np.dtype(dtype)
+        normalize = scale != 1.0 or mean is not None or std is not None
+        if normalize and self._dtype.kind != "f":
+            raise ValueError("归一化时张量类型必须为浮点类型")
+        self._layout = layout
+        self._size = size
+        self._rgb = rgb
+        self._scale = scale
+        # 预先调整为可以与张量广播的形状
+        channel_shape = (3, 1, 1) if layout == "NCHW" else (3,)
+        self._mean = (
+            None
+            if mean is None
+            else np.asarray(mean, self._dtype).reshape(channel_shape)
+        )
+        self._std = (
+            None if std is None else np.asarray(std, self._dtype).reshape(channel_shape)
+        )
+        self._direct = (
+            layout == "NHWC" and self._dtype == np.uint8 and not rgb and not normalize
+        )
+        self._pool = FramePool(depth)
+
+    def assemble(
+        self,
+        camera_infos: list[CameraInfo],
+        raw_images: list[bytes | memoryview],
+        decode: Callable[..., np.ndarray],
+    ) -> CameraFrames:
+        """
+        把一帧的图像解码到批量张量中。
+
+        :param camera_infos: 各图像对应的摄像头信息。
+        :param raw_images: 各图像的编码数据，与 ``camera_infos`` 一一对应。
+        :param decode: 解码函数，签名与 :meth:`metacar.sockets.StreamingSocket.decode_frame` 相同。
+        :return: 图像列表，其中每个图像都是暂存区（不需要转换时即张量）的视图，
+            :attr:`~metacar.models.CameraFrames.batch` 为批量张量。
+        """
+        count = len(camera_infos)
+        if self._size is not None:
+            width, height = self._size
+        elif camera_infos:
+            width, height = camera_infos[0].image_width, camera_infos[0].image_height
+        else:
+            width = height = 0
+        tensor_shape = (
+            (count, height, width, 3)
+            if self._layout == "NHWC"
+            else (count, 3, height, width)
+        )
+        tensor_lease = self._pool.acquire_array("batch", tensor_shape, self._dtype)
+        if self._direct:
+            staging_lease = tensor_lease.retain()
+        else:
+            staging_lease = self._pool.acquire_array(
+                "staging", (count, height, width, 3)
+            )
+        staging = staging_lease.array
+        for idx, (camera_info, raw_image) in enumerate(zip(camera_infos, raw_images)):
+            target = staging[idx]
+            # 解码函数把临时的解码结果复制到 target 中，大小不一致时返回解码结果
+            frame = decode(raw_image, out=target)
+            if frame is target:
+                continue
+            if frame is None:
+                logger.warning(f"摄像头 {camera_info.id} 的图像解码失败")
+                target.fill(0)
+            elif frame.shape[:2] == (height, width):
+                np.copyto(target, frame)
+            else:
+                import cv2  # 延迟导入，大小一致时不需要加载 OpenCV
+
+                cv2.resize(frame, (width, height), dst=target)
+        if not self._direct:
+            start_time = time.perf_counter()
+            self._convert(staging, tensor_lease.array)
+            metrics.DECODE_SECONDS.observe(time.perf_counter() - start_time, ("batch",))
+        frames = CameraFrames(
+            CameraFrame(
+                id=camera_info.id,
+                frame=staging[idx],
+                lease=staging_lease,
+                raw=None if is_descriptor(raw_image) else raw_image,
+            )
+            for idx, (camera_info, raw_image) in enumerate(
+                zip(camera_infos, raw_images)
+            )
+        )
+        # 每个图像持有一次暂存区的引用，创建时的引用转交给第一个图像
+        for _ in range(count - 1):
+            staging_lease.retain()
+        if not count:
+            staging_lease.release()
+        frames.batch = FrameBatch(
+            tensor_lease.array,
+            [camera_info.id for camera_info in camera_infos],
+            tensor_lease,
+        )
+        return frames
+
+    def _convert(self, staging: np.ndarray, tensor: np.ndarray):
+        """把暂存区中的 BGR 图像转换为张量的布局和类型，并原地归一化。"""
+        source = staging[..., ::-1] if self._rgb else staging
+        if self._layout == "NCHW":
+            source = source.transpose(0, 3, 1, 2)
+        np.copyto(tensor, source, casting="unsafe")
+        if self._scale != 1.0:
+            tensor *= self._scale
+        if self._mean is not None:
+            tensor -= self._mean
+        if self._std is not None:
+            tensor /= self._std
@@ -0,0 +1,368 @@
+"""
+以主车为中心的鸟瞰图（BEV）栅格化。
+
+:class:`BEVRasterizer` 把车道、停止线、斑马线、路线、推荐轨迹以及障碍物和主车的有向包围盒
+绘制为多通道的 ``uint8`` 数组，形状为 (通道数, 高, 宽)，每个通道的取值为 0 或 255，
+通道顺序见 :attr:`BEVRasterizer.channels`。
+
+图像的上方为车头方向，左侧为车辆左侧，主车位于水平方向的中间、竖直方向由 ``ego_row`` 指定的位置。
+
+静态图层（车道、道路线、路线）与主车位置无关，按固定大小的瓦片在场景坐标系中预先绘制，
+每个像素的 8 个比特分别对应一个静态图层，每帧只需要对缓存的瓦片做一次最近邻的仿射变换再拆分比特。
+动态图层（推荐轨迹、障碍物、主车）每帧用 OpenCV 直接绘制，障碍物的角点由 :mod:`metacar.obb` 批量计算。
+"""
+
+import math
+from collections import OrderedDict
+import cv2
+import numpy as np
+from .models import LineType, SceneStaticData, SimCarMsg
+from .obb import OrientedBoxes
+from .wire import state_arrays
+
+#: 静态图层，在瓦片中以比特的形式存放，顺序即比特的顺序
+STATIC_CHANNELS = (
+    "drivable",  # 车道的可行驶区域
+    "middle_lines",  # 中线
+    "solid_lines",  # 侧线和实线
+    "dash_lines",  # 虚线
+    "stop_lines",  # 停止线
+    "zebra_crossings",  # 斑马线
+    "route",  # 场景静态信息中的路线
+)
+#: 动态图层，每帧重新绘制
+DYNAMIC_CHANNELS = (
+    "trajectory",  # 推荐轨迹
+    "obstacles",  # 障碍物
+    "ego",  # 主车
+)
+
+_LINE_CHANNELS = {
+    LineType.MIDDLE_LINE: "middle_lines",
+    LineType.SIDE_LINE: "solid_lines",
+    LineType.SOLID_LINE: "solid_lines",
+    LineType.STOP_LINE: "stop_lines",
+    LineType.ZEBRA_CROSSING: "zebra_crossings",
+    LineType.DASH_LINE: "dash_lines",
+}
+_FILLED_CHANNELS = ("drivable", "zebra_crossings")
+# cv2 绘制时使用的定点小数位数
+_SHIFT = 4
+_ONE = 1 << _SHIFT
+
+
+def _fixed(points: np.ndarray) -> np.ndarray:
+    """把像素坐标转换为 cv2 绘制使用的定点数。"""
+    return np.round(points * _ONE).astype(np.int32)
+
+
+class BEVRasterizer:
+    """
+    鸟瞰图栅格化器，每个场景构造一次，每帧调用 :meth:`render`。
+
+    示例::
+
+        bev = BEVRasterizer(api.get_scene_static_data(), size=(256, 256), resolution=0.25)
+        for sim_car_msg, frames in api.main_loop():
+            image = bev.render(sim_car_msg)  # (10, 256, 256) uint8
+    """
+
+    def __init__(
+        self,
+        static_data: SceneStaticData,
+        size: tuple[int, int] = (256, 256),
+        resolution: float = 0.25,
+        ego_row: float = 0.5,
+        line_width: float = 0.3,
+        tile_size: int = 512,
+        max_tiles: int = 64,
+    ):
+        """
+        :param static_data: 场景静态信息，用于绘制静态图层。
+        :param size: 输出图像的大小 (高, 宽)，单位像素。
+        :param resolution: 每个像素对应的边长，单位米。
+        :param ego_row: 主车在竖直方向上的位置，0 为图像顶部，1 为底部。
+        :param line_width: 道路线、路线和轨迹的线宽，单位米，至少为 1 个像素。
+        :param tile_size: 静态图层瓦片的边长，单位像素，应不小于输出图像的对角线长度。
+        :param max_tiles: 缓存的瓦片数量上限。
+        """
+        self._height, self._width = size
+        self._resolution = resolution
+        self._center = (self._width / 2 - 0.5, self._height * ego_row - 0.5)
+        self._thickness = max(1, round(line_width / resolution))
+        self._tile_size = tile_size
+        self._max_tiles = max_tiles
+        self._tiles: OrderedDict[tuple[int, int], np.ndarray] = OrderedDict()
+        self._mosaic: tuple[tuple[int, int, int, int], np.ndarray] | None = None
+        self._geometry = self._collect_geometry(static_data)
+
+    @property
+    def channels(self) -> tuple[str, ...]:
+        """输出图像各通道的名称。"""
+        return STATIC_CHANNELS + DYNAMIC_CHANNELS
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        """输出图像的形状 (通道数, 高, 宽)。"""
+        return len(self.channels), self._height, self._width
+
+    @property
+    def resolution(self) -> float:
+        """每个像素对应的边长，单位米。"""
+        return self._resolution
+
+    def channel(self, name: str) -> int:
+        """按名称获取通道的下标。"""
+        return self.channels.index(name)
+
+    def _world_to_global(self, points: np.ndarray) -> np.ndarray:
+        """场景坐标转换为全局像素坐标，Y 轴朝下，整数坐标为像素中心。"""
+        return np.stack(
+            [
+                points[..., 0] / self._resolution - 0.5,
+                -points[..., 1] / self._resolution - 0.5,
+            ],
+            axis=-1,
+        )
+
+    def _collect_geometry(self, static_data: SceneStaticData):
+        """
+        把静态图形转换为全局像素坐标。
+
+        :return: 列表，每项为 (比特, 是否填充, 像素坐标, 包围盒)。
+        """
+        shapes: list[tuple[str, bool, list]] = []
+        for road in static_data.roads:
+            if len(road.stop_line) >= 2:
+                shapes.append(("stop_lines", False, road.stop_line))
+            for lane in road.lanes:
+                left = lane.left_border.path_points
+                right = lane.right_border.path_points
+                if len(left) >= 2 and len(right) >= 2:
+                    shapes.append(("drivable", True, left + right[::-1]))
+                for border in (lane.left_border, lane.right_border):
+                    if len(border.path_points) < 2:
+                        continue
+                    channel = _LINE_CHANNELS[border.type]
+                    shapes.append(
+                        (channel, channel in _FILLED_CHANNELS, border.path_points)
+                    )
+        if len(static_data.route) >= 2:
+            shapes.append(("route", False, static_data.route))
+        margin = self._thickness
+        geometry = []
+        for channel, filled, points in shapes:
+            pixels = self._world_to_global(np.array([(p.x, p.y) for p in points]))
+            bounds = np.concatenate(
+                [pixels.min(axis=0) - margin, pixels.max(axis=0) + margin]
+            )
+            geometry.append((STATIC_CHANNELS.index(channel), filled, pixels, bounds))
+        return geometry
+
+    def _tile(self, tile_x: int, tile_y: int) -> np.ndarray:
+        """获取一个瓦片，不在缓存中时绘制。"""
+        key = (tile_x, tile_y)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+        size = self._tile_size
+        origin = np.array([tile_x * size, tile_y * size], dtype=np.float64)
+        planes = np.zeros((len(STATIC_CHANNELS), size, size), dtype=np.uint8)
+        for bit, filled, pixels, bounds in self._geometry:
+            if (
+                bounds[2] < origin[0]
+                or bounds[3] < origin[1]
+                or bounds[0] >= origin[0] + size
+                or bounds[1] >= origin[1] + size
+            ):
+                continue
+            points = _fixed(pixels - origin)
+            if filled:
+                cv2.fillPoly(planes[bit], [points], 1, cv2.LINE_8, _SHIFT)
+            else:
+                cv2.polylines(
+                    planes[bit], [points], False, 1, self._thickness, cv2.LINE_8, _SHIFT
+                )
+        tile = np.zeros((size, size), dtype=np.uint8)
+        for bit, plane in enumerate(planes):
+            tile |= plane << bit
+        self._tiles[key] = tile
+        while len(self._tiles) > self._max_tiles:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def _static_source(self, corners: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        拼接覆盖输出范围的瓦片，瓦片范围不变时复用上一次的拼接结果。
+
+        :param corners: 输出图像四个角在全局像素坐标中的位置，形状为 (4, 2)。
+        :return: 元组 (拼接后的图像, 其左上角的全局像素坐标)。
+        """
+        size = self._tile_size
+        x0, y0 = np.floor(corners.min(axis=0) / size).astype(int).tolist()
+        x1, y1 = np.floor(corners.max(axis=0) / size).astype(int).tolist()
+        key = (x0, y0, x1, y1)
+        if self._mosaic is None or self._mosaic[0] != key:
+            if x0 == x1 and y0 == y1:
+                mosaic = self._tile(x0, y0)
+            else:
+                mosaic = np.block(
+                    [
+                        [self._tile(x, y) for x in range(x0, x1 + 1)]
+                        for y in range(y0, y1 + 1)
+                    ]
+                )
+            self._mosaic = (key, mosaic)
+        return self._mosaic[1], np.array([x0 * size, y0 * size], dtype=np.float64)
+
+    def to_pixels(
+        self, points: np.ndarray, pos_x: float, pos_y: float, yaw: float
+    ) -> np.ndarray:
+        """
+        把场景坐标转换为输出图像的像素坐标。
+
+        :param points: 形状为 (..., 2) 的场景坐标。
+        :param pos_x: 主车位置 X。
+        :param pos_y: 主车位置 Y。
+        :param yaw: 主车航向（单位：弧度，逆时针为正）。
+        :return: 形状为 (..., 2) 的像素坐标 (列, 行)，整数坐标为像素中心。
+        """
+        cos, sin = math.cos(yaw), math.sin(yaw)
+        dx = points[..., 0] - pos_x
+        dy = points[..., 1] - pos_y
+        forward = dx * cos + dy * sin
+        left = dy * cos - dx * sin
+        return np.stack(
+            [
+                self._center[0] - left / self._resolution,
+                self._center[1] - forward / self._resolution,
+            ],
+            axis=-1,
+        )
+
+    def render(self, msg: SimCarMsg, out: np.ndarray | None = None) -> np.ndarray:
+        """
+        绘制一帧鸟瞰图。
+
+        :param msg: 仿真动态信息，通过 :func:`metacar.wire.state_arrays` 读取位姿、轨迹和障碍物。
+        :param out: 用于存放结果的数组，形状为 :attr:`shape`，类型为 uint8，默认新建。
+        :return: 鸟瞰图，形状为 (通道数, 高, 宽)。
+        """
+        arrays = state_arrays(msg)
+        pos_x, pos_y = arrays.pose[0], arrays.pose[1]
+        ori_z = arrays.pose[8]
+        vehicle = msg.main_vehicle
+        return self.render_arrays(
+            float(pos_x),
+            float(pos_y),
+            -math.radians(ori_z),
+            OrientedBoxes.from_obstacle_array(arrays.obstacles),
+            arrays.trajectory[:, :2],
+            (vehicle.length, vehicle.width),
+            out,
+        )
+
+    def render_arrays(
+        self,
+        pos_x: float,
+        pos_y: float,
+        yaw: float,
+        obstacles: OrientedBoxes,
+        trajectory: np.ndarray,
+        ego_size: tuple[float, float],
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """
+        由数组绘制一帧鸟瞰图。
+
+        :param pos_x: 主车位置 X。
+        :param pos_y: 主车位置 Y。
+        :param yaw: 主车航向（单位：弧度，逆时针为正）。
+        :param obstacles: 障碍物的有向包围盒。
+        :param trajectory: 推荐轨迹，形状为 (n, 2)。
+        :param ego_size: 主车的 (长度, 宽度)。
+        :param out: 用于存放结果的数组，默认新建。
+        :return: 鸟瞰图，形状为 (通道数, 高, 宽)。
+        """
+        if out is None:
+            out = np.empty(self.shape, dtype=np.uint8)
+        self._render_static(pos_x, pos_y, yaw, out)
+        dynamic = out[len(STATIC_CHANNELS) :]
+        dynamic.fill(0)
+        trajectory_plane, obstacle_plane, ego_plane = dynamic
+        if len(trajectory) >= 2:
+            points = _fixed(self.to_pixels(trajectory, pos_x, pos_y, yaw))
+            cv2.polylines(
+                trajectory_plane,
+                [points],
+                False,
+                255,
+                self._thickness,
+                cv2.LINE_8,
+                _SHIFT,
+            )
+        if len(obstacles):
+            corners = self.to_pixels(obstacles.corners(), pos_x, pos_y, yaw)
+            # 跳过完全在图像外的障碍物
+            visible = (
+                (corners[..., 0].max(axis=1) >= 0)
+                & (corners[..., 0].min(axis=1) < self._width)
+                & (corners[..., 1].max(axis=1) >= 0)
+                & (corners[..., 1].min(axis=1) < self._height)
+            )
+            if visible.any():
+                cv2.fillPoly(
+                    obstacle_plane,
+                    list(_fixed(corners[visible])),
+                    255,
+                    cv2.LINE_8,
+                    _SHIFT,
+                )
+        ego = OrientedBoxes.from_arrays(pos_x, pos_y, -math.degrees(yaw), *ego_size)
+        corners = self.to_pixels(ego.corners(), pos_x, pos_y, yaw)
+        cv2.fillPoly(ego_plane, list(_fixed(corners)), 255, cv2.LINE_8, _SHIFT)
+        return out
+
+    def _render_static(self, pos_x: float, pos_y: float, yaw: float, out: np.ndarray):
+        """把缓存的静态瓦片变换到输出图像中，再按比特拆分为各个图层。"""
+        if not self._geometry:
+            out[: len(STATIC_CHANNELS)] = 0
+            return
+        res = self._resolution
+        cos, sin = math.cos(yaw), math.sin(yaw)
+        cx, cy = self._center
+        # 输出像素 (列, 行) 到全局像素坐标的仿射变换：
+        # 前方距离 = (cy - 行) * res，左侧距离 = (cx - 列) * res
+        # 场景坐标 = 主车位置 + 前方距离 * (cos, sin) + 左侧距离 * (-sin, cos)
+        # 全局像素 = (场景 X / res - 0.5, -场景 Y / res - 0.5)
+        matrix = np.array(
+            [
+                [sin, -cos, pos_x / res - 0.5 + cos * cy - sin * cx],
+                [cos, sin, -pos_y / res - 0.5 - sin * cy - cos * cx],
+            ]
+        )
+        corners = np.array(
+            [
+                [0, 0],
+                [self._width - 1, 0],
+                [0, self._height - 1],
+                [self._width - 1, self._height - 1],
+            ],
+            dtype=np.float64,
+        )
+        global_corners = corners @ matrix[:, :2].T + matrix[:, 2]
+        source, origin = self._static_source(global_corners)
+        matrix[:, 2] -= origin
+        static = cv2.warpAffine(
+            source,
+            matrix,
+            (self._width, self._height),
+            flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=0,
+        )
+        for bit in range(len(STATIC_CHANNELS)):
+            plane = out[bit]
+            cv2.bitwise_and(static, 1 << bit, dst=plane)
+            cv2.compare(plane, 0, cv2.CMP_GT, dst=plane)
@@ -0,0 +1,204 @@
+"""
+摄像头标定参数的缓存，以及批量的三维点投影。
+
+:class:`~metacar.models.CameraInfo` 中的内参是扁平的列表，位置和角度也需要换算成矩阵后才能使用。
+:class:`CalibrationCache` 为每个摄像头缓存换算好的 3×3 内参矩阵和 4×4 外参矩阵，
+只有摄像头信息变化时才重新计算，:meth:`CameraCalibration.project_world` 可以一次投影任意多个点。
+
+坐标系约定：
+
+* 世界坐标系和车辆坐标系的 x、y 在水平面内，z 向上；车辆坐标系的 x 指向车头，y 指向左侧。
+* 角度的单位为度，与 :attr:`PoseGnss.ori_z <metacar.models.PoseGnss.ori_z>` 相同，从上往下看顺时针为正。
+* 摄像头坐标系与 OpenCV 相同：x 向右，y 向下，z 指向镜头前方。
+"""
+
+import math
+from dataclasses import dataclass
+import numpy as np
+from .models import CameraInfo, PoseGnss
+
+# 角度均为 0 时，车辆坐标系（x 前、y 左、z 上）到摄像头坐标系（x 右、y 下、z 前）的旋转
+_VEHICLE_TO_OPTICAL = np.array(
+    [[0.0, -1.0, 0.0], [0.0, 0.0, -1.0], [1.0, 0.0, 0.0]], dtype=np.float64
+)
+
+
+def rotation_matrix(ori_x: float, ori_y: float, ori_z: float) -> np.ndarray:
+    """
+    由欧拉角计算旋转矩阵，旋转顺序为先绕 x 轴、再绕 y 轴、最后绕 z 轴。
+
+    :param ori_x: 绕 x 轴的角度（单位：度，顺时针为正）。
+    :param ori_y: 绕 y 轴的角度（单位：度，顺时针为正）。
+    :param ori_z: 绕 z 轴的角度（单位：度，顺时针为正）。
+    :return: 3×3 旋转矩阵，把局部坐标转换为父坐标系中的坐标。
+    """
+    rx, ry, rz = (-math.radians(angle) for angle in (ori_x, ori_y, ori_z))
+    cx, sx = math.cos(rx), math.sin(rx)
+    cy, sy = math.cos(ry), math.sin(ry)
+    cz, sz = math.cos(rz), math.sin(rz)
+    rot_x = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    rot_y = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rot_z = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return rot_z @ rot_y @ rot_x
+
+
+def vehicle_to_world(pose: PoseGnss) -> np.ndarray:
+    """
+    计算车辆坐标系到世界坐标系的 4×4 变换矩阵。
+
+    :param pose: 主车位姿。
+    :return: 4×4 齐次变换矩阵。
+    """
+    transform = np.eye(4)
+    transform[:3, :3] = rotation_matrix(pose.ori_x, pose.ori_y, pose.ori_z)
+    transform[:3, 3] = (pose.pos_x, pose.pos_y, pose.pos_z)
+    return transform
+
+
+def world_to_vehicle(pose: PoseGnss) -> np.ndarray:
+    """
+    计算世界坐标系到车辆坐标系的 4×4 变换矩阵。
+
+    :param pose: 主车位姿。
+    :return: 4×4 齐次变换矩阵。
+    """
+    transform = vehicle_to_world(pose)
+    rotation_t = transform[:3, :3].T
+    inverse = np.eye(4)
+    inverse[:3, :3] = rotation_t
+    inverse[:3, 3] = -rotation_t @ transform[:3, 3]
+    return inverse
+
+
+def intrinsic_matrix(camera_info: CameraInfo) -> np.ndarray:
+    """
+    获取摄像头的 3×3 内参矩阵。场景没有提供有效的内参时，根据水平视场角和图像大小计算。
+
+    :param camera_info: 摄像头信息。
+    :return: 3×3 内参矩阵。
+    """
+    values = camera_info.intrinsic_matrix
+    if len(values) == 9 and values[0] > 0 and values[4] > 0:
+        return np.array(values, dtype=np.float64).reshape(3, 3)
+    width, height = camera_info.image_width, camera_info.image_height
+    focal = width / 2 / math.tan(math.radians(camera_info.fov) / 2)
+    return np.array(
+        [[focal, 0.0, width / 2], [0.0, focal, height / 2], [0.0, 0.0, 1.0]]
+    )
+
+
+@dataclass(frozen=True, eq=False)
+class CameraCalibration:
+    """一个摄像头换算好的标定参数。"""
+
+    camera_id: str  #: 摄像头 ID
+    width: int  #: 图像宽度
+    height: int  #: 图像高度
+    intrinsic: np.ndarray  #: 3×3 内参矩阵
+    extrinsic: np.ndarray  #: 4×4 外参矩阵，把车辆坐标系中的点转换到摄像头坐标系
+
+    @classmethod
+    def from_camera_info(cls, camera_info: CameraInfo) -> "CameraCalibration":
+        """
+        由摄像头信息计算标定参数，摄像头的位置和角度是相对于主车的。
+
+        :param camera_info: 摄像头信息。
+        :return: 标定参数。
+        """
+        angle = camera_info.orientation
+        # 摄像头本体到车辆坐标系的旋转，取逆后再转换为 OpenCV 的摄像头坐标系
+        mount = rotation_matrix(angle.ori_x, angle.ori_y, angle.ori_z)
+        rotation = _VEHICLE_TO_OPTICAL @ mount.T
+        position = np.array(
+            [
+                camera_info.position.x,
+                camera_info.position.y,
+                camera_info.position.z,
+            ]
+        )
+        extrinsic = np.eye(4)
+        extrinsic[:3, :3] = rotation
+        extrinsic[:3, 3] = -rotation @ position
+        intrinsic = intrinsic_matrix(camera_info)
+        intrinsic.flags.writeable = False
+        extrinsic.flags.writeable = False
+        return cls(
+            camera_id=camera_info.id,
+            width=camera_info.image_width,
+            height=camera_info.image_height,
+            intrinsic=intrinsic,
+            extrinsic=extrinsic,
+        )
+
+    def project(
+        self, points: np.ndarray, transform: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        把车辆坐标系中的点批量投影到图像上。
+
+        :param points: 形状为 (N, 3) 的点。
+        :param transform: 投影前先对点应用的 4×4 变换（例如世界坐标系到车辆坐标系），默认不变换。
+        :return: 元组 (uv, visible)，uv 形状为 (N, 2)，为像素坐标；
+            visible 形状为 (N,)，表示点在镜头前方且落在图像范围内。
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        matrix = self.extrinsic if transform is None else self.extrinsic @ transform
+        camera_points = points @ matrix[:3, :3].T + matrix[:3, 3]
+        depth = camera_points[:, 2]
+        in_front = depth > 1e-6
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pixels = camera_points @ self.intrinsic.T
+            uv = pixels[:, :2] / pixels[:, 2:3]
+        visible = (
+            in_front
+            & (uv[:, 0] >= 0)
+            & (uv[:, 0] < self.width)
+            & (uv[:, 1] >= 0)
+            & (uv[:, 1] < self.height)
+        )
+        uv[~in_front] = np.nan
+        return uv, visible
+
+    def project_world(
+        self, points: np.ndarray, pose: PoseGnss
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        把世界坐标系中的点批量投影到图像上。
+
+        :param points: 形状为 (N, 3) 的点，例如所有障碍物的角点或车道线上的点。
+        :param pose: 主车位姿。
+        :return: 同 :meth:`project`。
+        """
+        return self.project(points, world_to_vehicle(pose))
+
+
+class CalibrationCache:
+    """按摄像头 ID 缓存标定参数，只有摄像头信息变化时才重新计算。"""
+
+    def __init__(self):
+        self._cameras: dict[str, tuple[CameraInfo, CameraCalibration]] = {}
+        self._last: list[CameraInfo] | None = None
+        self._result: dict[str, CameraCalibration] = {}
+
+    def update(self, camera_infos: list[CameraInfo]) -> dict[str, CameraCalibration]:
+        """
+        获取一组摄像头的标定参数。
+
+        :param camera_infos: 摄像头信息，通常为 ``sim_car_msg.sensor.ego_rgb_cams``。
+        :return: 摄像头 ID 到标定参数的映射，摄像头信息没有变化时返回与上次相同的对象。
+        """
+        if camera_infos is self._last or camera_infos == self._last:
+            self._last = camera_infos
+            return self._result
+        cameras = {}
+        for camera_info in camera_infos:
+            cached = self._cameras.get(camera_info.id)
+            if cached is None or cached[0] != camera_info:
+                cached = (camera_info, CameraCalibration.from_camera_info(camera_info))
+            cameras[camera_info.id] = cached
+        self._cameras = cameras
+        self._last = camera_infos
+        self._result = {
+            camera_id: calibration for camera_id, (_, calibration) in cameras.items()
+        }
+        return self._result
@@ -0,0 +1,109 @@
+"""
+分包层的可选消息压缩。
+
+压缩后的消息在长度前缀中置最高位作为标志，内容为 1 字节压缩算法 ID + 4 字节原始长度（大端序）+ 压缩数据。
+算法在握手时协商，只用于 JSON 通道（5061），视频流中的图像已经是压缩格式，不再压缩。
+"""
+
+import zlib
+
+try:
+    import lz4.block as lz4_block
+except ImportError:  # lz4 是可选依赖
+    lz4_block = None
+
+from .enums import ProtocolFeature
+
+
+class Codec:
+    """压缩算法的基类。"""
+
+    id = 0  #: 写入消息中的算法 ID
+    name = ""  #: 算法名称
+    feature: ProtocolFeature  #: 对应的协议特性
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: memoryview, raw_length: int) -> bytes:
+        """
+        解压一条消息。
+
+        :param data: 压缩数据。
+        :param raw_length: 消息中声明的原始长度。
+        :return: 解压后的数据。
+        :raises ValueError: 当压缩数据损坏或解压后超过声明的长度时抛出。
+        """
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    """标准库 zlib，压缩率较高。"""
+
+    id = 1
+    name = "zlib"
+    feature = ProtocolFeature.ZLIB_COMPRESSION
+
+    def __init__(self, level: int = 1):
+        """
+        :param level: 压缩级别，默认使用最快的级别。
+        """
+        self._level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self._level)
+
+    def decompress(self, data: memoryview, raw_length: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        try:
+            # 限制输出长度，恶意或损坏的数据不会解压出超过声明长度的内容
+            result = decompressor.decompress(data, raw_length)
+        except zlib.error as e:
+            raise ValueError(f"zlib 数据损坏：{e}") from None
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"zlib 数据解压后超过声明的长度 {raw_length}")
+        if not decompressor.eof:
+            raise ValueError("zlib 数据不完整")
+        return result
+
+
+class Lz4Codec(Codec):
+    """lz4 块压缩，速度远快于 zlib，需要安装 lz4。"""
+
+    id = 2
+    name = "lz4"
+    feature = ProtocolFeature.LZ4_COMPRESSION
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4_block.compress(data, store_size=False)
+
+    def decompress(self, data: memoryview, raw_length: int) -> bytes:
+        try:
+            # 输出缓冲区按声明的长度分配，超过该长度的数据视为损坏
+            result = lz4_block.decompress(data, uncompressed_size=raw_length)
+        except lz4_block.LZ4BlockError as e:
+            raise ValueError(f"lz4 数据损坏：{e}") from None
+        if len(result) != raw_length:
+            raise ValueError(
+                f"lz4 数据解压后的长度 {len(result)} 与声明的长度 {raw_length} 不一致"
+            )
+        return result
+
+
+def available_codecs() -> dict[str, Codec]:
+    """当前环境中可用的压缩算法，键为算法名称。"""
+    codecs: dict[str, Codec] = {ZlibCodec.name: ZlibCodec()}
+    if lz4_block is not None:
+        codecs[Lz4Codec.name] = Lz4Codec()
+    return codecs
+
+
+def codec_by_id(codec_id: int) -> Codec:
+    """根据消息中的算法 ID 获取压缩算法。
+
+    :raises ValueError: 当算法不支持或未安装时抛出。
+    """
+    for codec in available_codecs().values():
+        if codec.id == codec_id:
+            return codec
+    raise ValueError(f"不支持的压缩算法 ID：{codec_id}")
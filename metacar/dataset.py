@@ -0,0 +1,472 @@
+"""
+把仿真数据导出为按列存储的训练数据集。
+
+:class:`DatasetWriter` 逐帧接收 :class:`~metacar.models.SimCarMsg`、摄像头图像和发送的
+:class:`~metacar.models.VehicleControl`，每 ``shard_size`` 帧组成一个分片，
+交给进程池写入磁盘，主进程只做数组拷贝。仿真端发送的 JPEG 图像原样保存，
+只有没有编码数据的图像（例如通过共享内存传输的未压缩图像）才在工作进程中编码为 JPEG。
+数据来源可以是实时的 :meth:`SceneAPI.main_loop() <metacar.SceneAPI.main_loop>`，
+也可以是任何产生 (sim_car_msg, frames) 或 (sim_car_msg, frames, control) 的可迭代对象（见 :func:`export`）。
+
+数据集的目录结构::
+
+    dataset/
+        meta.json               各分片的帧数、摄像头 ID 列表等元数据
+        shard-00000/
+            ticks.npy           每帧一条 :data:`TICK_DTYPE` 记录
+            obstacles.npy       所有帧的障碍物，:data:`~metacar.wire.OBSTACLE_DTYPE`，按帧拼接
+            trajectory.npy      所有帧的推荐轨迹，形状为 (n, 3)，按帧拼接
+            frames.bin          所有 JPEG 图像按顺序拼接
+            frames.npy          图像索引，每张图像一条 :data:`FRAME_DTYPE` 记录
+        shard-00001/
+            ...
+
+所有文件都是未压缩的 ``.npy`` 或原始字节，:class:`DatasetReader` 以内存映射的方式读取，
+打开数据集不需要把数据读入内存。分片先写入临时目录再重命名，未写完的分片不会被读到。
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from bisect import bisect_right
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable
+import numpy as np
+from .models import CameraFrame, SimCarMsg, VehicleControl
+from .wire import OBSTACLE_DTYPE, POSE_FIELDS, state_arrays
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+#: 每帧的状态和控制量
+TICK_DTYPE = np.dtype(
+    [
+        ("used_time", "<f8"),
+        *[(name, "<f8") for name in POSE_FIELDS],
+        ("speed", "<f8"),
+        ("throttle", "<f8"),
+        ("brake", "<f8"),
+        ("steering", "<f8"),
+        ("gear", "<i4"),
+        # 发送的控制命令，未提供时为 nan 和 -1
+        ("control_gear", "<i4"),
+        ("control_throttle", "<f8"),
+        ("control_brake", "<f8"),
+        ("control_steering", "<f8"),
+        # 灯光标志位，依次为左转向灯、右转向灯、双闪、前灯
+        ("control_lights", "<u4"),
+        ("_reserved", "<u4"),
+        # 本帧的障碍物和轨迹点在分片数组中的范围
+        ("obstacle_offset", "<i8"),
+        ("obstacle_count", "<i8"),
+        ("trajectory_offset", "<i8"),
+        ("trajectory_count", "<i8"),
+    ]
+)
+
+#: 图像索引，``camera`` 为摄像头在 ``meta.json`` 的 ``cameras`` 列表中的下标
+FRAME_DTYPE = np.dtype(
+    [
+        ("tick", "<i8"),  # 帧在分片中的下标
+        ("camera", "<i4"),
+        ("_reserved", "<i4"),
+        ("offset", "<i8"),  # 在 frames.bin 中的偏移量
+        ("length", "<i8"),  # JPEG 数据的字节数，编码失败时为 0
+    ]
+)
+
+
+# JPEG 数据的起始标记
+_JPEG_MAGIC = b"\xff\xd8"
+
+
+def _write_shard(
+    directory: str,
+    ticks: np.ndarray,
+    obstacles: np.ndarray,
+    trajectory: np.ndarray,
+    frames: list[tuple[int, int, bytes | np.ndarray]],
+    jpeg_quality: int,
+) -> int:
+    """
+    写入一个分片，在工作进程中执行。已经是 JPEG 数据的图像原样写入，未压缩的图像编码后写入。
+
+    :return: 分片的帧数。
+    """
+    final = Path(directory)
+    temp = final.with_name(final.name + ".tmp")
+    if temp.exists():
+        shutil.rmtree(temp)
+    temp.mkdir(parents=True)
+    np.save(temp / "ticks.npy", ticks)
+    np.save(temp / "obstacles.npy", obstacles)
+    np.save(temp / "trajectory.npy", trajectory)
+    index = np.zeros(len(frames), dtype=FRAME_DTYPE)
+    offset = 0
+    with open(temp / "frames.bin", "wb") as f:
+        for idx, (tick, camera, image) in enumerate(frames):
+            if isinstance(image, bytes):
+                data = image
+            else:
+                import cv2  # 只在需要编码图像时加载 OpenCV
+
+                ok, encoded = cv2.imencode(
+                    ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+                )
+                data = encoded.tobytes() if ok else b""
+            length = len(data)
+            if length:
+                f.write(data)
+            index[idx] = (tick, camera, 0, offset, length)
+            offset += length
+    np.save(temp / "frames.npy", index)
+    if final.exists():
+        shutil.rmtree(final)
+    os.replace(temp, final)
+    return len(ticks)
+
+
+class DatasetWriter:
+    """
+    逐帧写入数据集，也可以作为上下文管理器使用，退出时调用 :meth:`close`。
+
+    内存占用的上限约为 (``max_pending`` + 1) 个分片的数据量。仿真端发送的 JPEG 图像以原始数据暂存，
+    只有没有编码数据的图像以未压缩的形式暂存，每张占用 宽 × 高 × 3 字节。
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        shard_size: int = 200,
+        workers: int = 2,
+        max_pending: int | None = None,
+        jpeg_quality: int = 90,
+        start_method: str | None = None,
+        overwrite: bool = False,
+    ):
+        """
+        :param path: 数据集目录，不存在时创建。
+        :param shard_size: 每个分片的帧数。
+        :param workers: 写入分片的工作进程数量，为 0 时在当前进程中同步写入。
+        :param max_pending: 最多同时等待写入的分片数，达到上限时 :meth:`add` 会等待最早的分片写完，默认为 ``workers`` × 2。
+        :param jpeg_quality: 需要编码的图像的 JPEG 编码质量（0~100），原样保存的 JPEG 图像不受影响。
+        :param start_method: 工作进程的启动方式（``"fork"``、``"spawn"`` 等），默认使用平台的默认方式。
+        :param overwrite: 目录中已有数据集时是否删除。
+        :raises FileExistsError: 当目录中已有数据集且 ``overwrite`` 为 False 时抛出。
+        """
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        existing = list(self._path.glob("shard-*"))
+        if (self._path / "meta.json").exists() or existing:
+            if not overwrite:
+                raise FileExistsError(f"{self._path} 中已有数据集")
+            (self._path / "meta.json").unlink(missing_ok=True)
+            for directory in existing:
+                shutil.rmtree(directory)
+        self._shard_size = shard_size
+        self._jpeg_quality = jpeg_quality
+        self._max_pending = max(1, max_pending or workers * 2)
+        self._executor = (
+            ProcessPoolExecutor(workers, multiprocessing.get_context(start_method))
+            if workers > 0
+            else None
+        )
+        self._pending: list[tuple[str, Future]] = []
+        self._shards: list[dict] = []
+        self._cameras: dict[str, int] = {}
+        self._closed = False
+        self._reset_buffer()
+
+    def _reset_buffer(self):
+        self._ticks: list[np.ndarray] = []
+        self._obstacles: list[np.ndarray] = []
+        self._trajectories: list[np.ndarray] = []
+        self._frames: list[tuple[int, int, bytes | np.ndarray]] = []
+        self._obstacle_total = 0
+        self._trajectory_total = 0
+
+    @property
+    def path(self) -> Path:
+        """数据集目录。"""
+        return self._path
+
+    def add(
+        self,
+        msg: SimCarMsg,
+        frames: Iterable[CameraFrame] = (),
+        control: VehicleControl | None = None,
+    ):
+        """
+        添加一帧。
+
+        带有 JPEG 编码数据（:attr:`CameraFrame.raw <metacar.models.CameraFrame.raw>`）的图像保存编码数据，
+        否则复制解码后的图像，之后编码为 JPEG。调用后可以立即释放图像（例如缓冲池中的图像）。
+
+        :param msg: 仿真动态信息。
+        :param frames: 摄像头图像。
+        :param control: 本帧发送的控制命令。
+        """
+        if self._closed:
+            raise RuntimeError("数据集已关闭")
+        arrays = state_arrays(msg)
+        vehicle = msg.main_vehicle
+        tick = np.zeros((), dtype=TICK_DTYPE)
+        tick["used_time"] = msg.scene_status.used_time
+        for name, value in zip(POSE_FIELDS, arrays.pose.tolist()):
+            tick[name] = value
+        tick["speed"] = vehicle.speed
+        tick["throttle"] = vehicle.throttle
+        tick["brake"] = vehicle.brake
+        tick["steering"] = vehicle.steering
+        tick["gear"] = vehicle.gear.value
+        if control is not None:
+            tick["control_throttle"] = control.throttle
+            tick["control_brake"] = control.brake
+            tick["control_steering"] = control.steering
+            tick["control_gear"] = control.gear.value
+            tick["control_lights"] = (
+                control.left_blinker_on
+                | control.right_blinker_on << 1
+                | control.hazard_lights_on << 2
+                | control.headlights_on << 3
+            )
+        else:
+            tick["control_throttle"] = np.nan
+            tick["control_brake"] = np.nan
+            tick["control_steering"] = np.nan
+            tick["control_gear"] = -1
+        tick["obstacle_offset"] = self._obstacle_total
+        tick["obstacle_count"] = len(arrays.obstacles)
+        tick["trajectory_offset"] = self._trajectory_total
+        tick["trajectory_count"] = len(arrays.trajectory)
+        index = len(self._ticks)
+        self._ticks.append(tick)
+        # 二进制格式解码得到的数组是接收缓冲区的视图，需要复制
+        self._obstacles.append(np.array(arrays.obstacles, dtype=OBSTACLE_DTYPE))
+        self._trajectories.append(np.array(arrays.trajectory, dtype="<f8"))
+        self._obstacle_total += len(arrays.obstacles)
+        self._trajectory_total += len(arrays.trajectory)
+        for frame in frames:
+            camera = self._cameras.setdefault(frame.id, len(self._cameras))
+            raw = frame.raw
+            if raw is not None and bytes(raw[:2]) == _JPEG_MAGIC:
+                image = bytes(raw)
+            else:
+                image = np.array(frame.frame)
+            self._frames.append((index, camera, image))
+        if len(self._ticks) >= self._shard_size:
+            self._flush()
+
+    def _flush(self):
+        """把缓冲的帧作为一个分片提交写入。"""
+        if not self._ticks:
+            return
+        name = f"shard-{len(self._shards) + len(self._pending):05d}"
+        args = (
+            str(self._path / name),
+            np.stack(self._ticks),
+            np.concatenate(self._obstacles),
+            np.concatenate(self._trajectories).reshape(-1, 3),
+            self._frames,
+            self._jpeg_quality,
+        )
+        self._reset_buffer()
+        if self._executor is None:
+            self._shards.append({"name": name, "ticks": _write_shard(*args)})
+            return
+        while len(self._pending) >= self._max_pending:
+            self._wait_oldest()
+        self._pending.append((name, self._executor.submit(_write_shard, *args)))
+
+    def _wait_oldest(self):
+        name, future = self._pending.pop(0)
+        self._shards.append({"name": name, "ticks": future.result()})
+
+    def close(self):
+        """写入剩余的帧，等待所有分片写完，并写入元数据。"""
+        if self._closed:
+            return
+        try:
+            self._flush()
+            while self._pending:
+                self._wait_oldest()
+        finally:
+            self._closed = True
+            if self._executor is not None:
+                self._executor.shutdown()
+        meta = {
+            "version": FORMAT_VERSION,
+            "cameras": sorted(self._cameras, key=self._cameras.get),
+            "shards": self._shards,
+        }
+        temp = self._path / "meta.json.tmp"
+        temp.write_text(json.dumps(meta, ensure_ascii=False, indent=2), "utf-8")
+        os.replace(temp, self._path / "meta.json")
+        logger.info(
+            f"数据集已写入 {self._path}，共 {len(self._shards)} 个分片，"
+            f"{sum(shard['ticks'] for shard in self._shards)} 帧"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def export(
+    source: Iterable[tuple],
+    path: str | os.PathLike,
+    **kwargs,
+) -> Path:
+    """
+    把 (sim_car_msg, frames) 或 (sim_car_msg, frames, control) 序列导出为数据集。
+
+    ``api.main_loop()`` 只产生 (sim_car_msg, frames)，其中没有发送的控制命令，
+    此时数据集中的控制量为 nan，需要记录控制量时请产生包含 control 的三元组，
+    或者在主循环中直接调用 :meth:`DatasetWriter.add`。
+
+    :param source: 产生 (sim_car_msg, frames) 或 (sim_car_msg, frames, control) 的可迭代对象。
+    :param path: 数据集目录。
+    :param kwargs: 传给 :class:`DatasetWriter` 的其他参数。
+    :return: 数据集目录。
+    """
+    with DatasetWriter(path, **kwargs) as writer:
+        for item in source:
+            msg, frames, *rest = item
+            writer.add(msg, frames, rest[0] if rest else None)
+    return writer.path
+
+
+class Shard:
+    """以内存映射方式打开的一个分片。"""
+
+    def __init__(self, directory: Path):
+        """
+        :param directory: 分片目录。
+        """
+        self.ticks: np.ndarray = np.load(directory / "ticks.npy", mmap_mode="r")
+        self.obstacles: np.ndarray = np.load(directory / "obstacles.npy", mmap_mode="r")
+        self.trajectory: np.ndarray = np.load(
+            directory / "trajectory.npy", mmap_mode="r"
+        )
+        self.frame_index: np.ndarray = np.load(directory / "frames.npy", mmap_mode="r")
+        path = directory / "frames.bin"
+        self.frame_data: np.ndarray = (
+            np.memmap(path, dtype=np.uint8, mode="r")
+            if path.stat().st_size
+            else np.zeros(0, dtype=np.uint8)
+        )
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def tick_obstacles(self, tick: int) -> np.ndarray:
+        """一帧的障碍物，类型为 :data:`~metacar.wire.OBSTACLE_DTYPE`。"""
+        record = self.ticks[tick]
+        start = int(record["obstacle_offset"])
+        return self.obstacles[start : start + int(record["obstacle_count"])]
+
+    def tick_trajectory(self, tick: int) -> np.ndarray:
+        """一帧的推荐轨迹，形状为 (n, 3)。"""
+        record = self.ticks[tick]
+        start = int(record["trajectory_offset"])
+        return self.trajectory[start : start + int(record["trajectory_count"])]
+
+    def tick_frames(self, tick: int) -> dict[int, np.ndarray]:
+        """一帧的 JPEG 数据，键为摄像头下标，值为 frames.bin 的视图。"""
+        index = self.frame_index
+        start, stop = np.searchsorted(index["tick"], [tick, tick + 1])
+        return {
+            int(camera): self.frame_data[offset : offset + length]
+            for camera, offset, length in zip(
+                index["camera"][start:stop].tolist(),
+                index["offset"][start:stop].tolist(),
+                index["length"][start:stop].tolist(),
+            )
+        }
+
+
+class DatasetReader:
+    """
+    读取 :class:`DatasetWriter` 写入的数据集，帧的下标在所有分片中连续编号。
+
+    示例::
+
+        reader = DatasetReader("dataset")
+        for shard in reader.shards:
+            speeds = shard.ticks["speed"]  # 内存映射，不会读入整个文件
+        image = reader.frame(100, "front")
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        """
+        :param path: 数据集目录。
+        :raises FileNotFoundError: 当数据集未写完（没有 meta.json）时抛出。
+        """
+        self._path = Path(path)
+        meta = json.loads((self._path / "meta.json").read_text("utf-8"))
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"不支持的数据集版本 {meta['version']}")
+        self._cameras: list[str] = meta["cameras"]
+        self._camera_index = {camera: idx for idx, camera in enumerate(self._cameras)}
+        self.shards = [Shard(self._path / shard["name"]) for shard in meta["shards"]]
+        self._starts = np.cumsum([0] + [len(shard) for shard in self.shards]).tolist()
+
+    @property
+    def cameras(self) -> list[str]:
+        """摄像头 ID 列表，下标即图像索引中的 ``camera``。"""
+        return self._cameras
+
+    def __len__(self) -> int:
+        return self._starts[-1]
+
+    def locate(self, index: int) -> tuple[Shard, int]:
+        """
+        把帧的全局下标换算为分片和分片内的下标。
+
+        :raises IndexError: 当下标越界时抛出。
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"帧下标 {index} 越界")
+        shard = bisect_right(self._starts, index) - 1
+        return self.shards[shard], index - self._starts[shard]
+
+    def ticks(self) -> np.ndarray:
+        """所有帧的 :data:`TICK_DTYPE` 记录（拼接后的副本）。"""
+        return np.concatenate([shard.ticks for shard in self.shards])
+
+    def obstacles(self, index: int) -> np.ndarray:
+        """一帧的障碍物。"""
+        shard, tick = self.locate(index)
+        return shard.tick_obstacles(tick)
+
+    def trajectory(self, index: int) -> np.ndarray:
+        """一帧的推荐轨迹。"""
+        shard, tick = self.locate(index)
+        return shard.tick_trajectory(tick)
+
+    def frame(self, index: int, camera_id: str, decode: bool = True):
+        """
+        一帧中某个摄像头的图像。
+
+        :param index: 帧的全局下标。
+        :param camera_id: 摄像头 ID。
+        :param decode: 为 True 时返回解码后的 BGR 图像，否则返回 JPEG 数据。
+        :return: 图像，该帧没有该摄像头的图像时返回 None。
+        """
+        shard, tick = self.locate(index)
+        camera = self._camera_index.get(camera_id)
+        data = shard.tick_frames(tick).get(camera) if camera is not None else None
+        if data is None or len(data) == 0 or not decode:
+            return data
+        import cv2  # 延迟导入，只读取状态数据时不需要加载 OpenCV
+
+        return cv2.imdecode(np.asarray(data), cv2.IMREAD_COLOR)
@@ -0,0 +1,96 @@
+"""
+数据模型中用到的枚举。
+
+枚举只依赖标准库，:mod:`metacar.models` 从这里重新导出。``from metacar import LineType`` 等只使用枚举的程序
+不需要加载 pydantic 和 NumPy。
+"""
+
+from enum import Enum
+
+
+class RegionType(Enum):
+    """区域类型"""
+
+    NORMAL_PARKING = 0  #: 正常停车区
+    RESTRICTED_PARKING = 1  #: 禁停区
+    FUNCTION_ZONE = 2  #: 功能区
+
+
+class LineType(Enum):
+    """道路线类型"""
+
+    MIDDLE_LINE = 1  #: 中线
+    SIDE_LINE = 2  #: 侧线
+    SOLID_LINE = 3  #: 实线
+    STOP_LINE = 4  #: 停止线
+    ZEBRA_CROSSING = 5  #: 斑马线
+    DASH_LINE = 6  #: 虚线
+
+
+class DrivingType(Enum):
+    """行驶类型"""
+
+    MOTOR_VEHICLE_ALLOWED = 1  #: 机动车可行驶
+    NON_MOTOR_VEHICLE_ALLOWED = 2  #: 非机动车可行驶
+    PEDESTRIAN_ALLOWED = 3  #: 行人可行
+
+
+class TrafficSignType(Enum):
+    """交通标志"""
+
+    NO_SIGN = 0  #: 无标志
+    SPEED_LIMIT_SIGN = 1  #: 限速标志
+    STOP_SIGN = 2  #: 停止标志
+    V2X_SIGN = 3  #: V2X 标志
+
+
+class GearMode(Enum):
+    """档位模式"""
+
+    NEUTRAL = 0  #: 空档
+    DRIVE = 1  #: 前进档
+    REVERSE = 2  #: 倒车档
+    PARKING = 3  #: 停车档
+
+
+class ObstacleType(Enum):
+    """障碍物类型"""
+
+    UNKNOWN = 0  #: 未知障碍物
+    PEDESTRIAN = 4  #: 行人
+    CAR = 6  #: 小汽车
+    STATIC = 7  #: 静态障碍物
+    BICYCLE = 8  #: 自行车
+    ROAD_MARK = 12  #: 道路标记
+    TRAFFIC_SIGN = 13  #: 交通标志
+    TRAFFIC_LIGHT = 15  #: 交通信号灯
+    RIDER = 17  #: 骑手
+    TRUCK = 18  #: 卡车
+    BUS = 19  #: 公交车
+    SPECIAL_VEHICLE = 20  #: 特种车辆
+    MOTORCYCLE = 21  #: 摩托车
+    DYNAMIC = 22  #: 动态障碍物
+    SPEED_LIMIT_SIGN = 26  #: 限速标志（限速值以 "SpeedLimit|30"(单位：km/h) 的格式在 :attr:`ObstacleInfo.extra_info <metacar.models.ObstacleInfo.extra_info>` 中给出）
+    BICYCLE_STATIC = 27  #: 静止自行车
+    ROAD_OBSTACLE = 29  #: 道路障碍物
+    PARKING_SLOT = 30  #: 停车位
+
+
+class TrafficLightState(Enum):
+    """交通灯状态"""
+
+    RED = 1  #: 红灯
+    GREEN = 2  #: 绿灯
+    YELLOW = 3  #: 黄灯
+
+
+class ProtocolFeature(str, Enum):
+    """可选的协议特性，场景在 code1 中声明支持的特性，API 在 code2 中选择启用的特性"""
+
+    FRAME_SEQ = "FrameSeq"  #: 每条 code3 带有帧序号，每张图像带有帧序号和摄像头 ID
+    BINARY_STATE = (
+        "BinaryState"  #: code3/code4 使用紧凑的二进制编码，见 :mod:`metacar.wire`
+    )
+    ZLIB_COMPRESSION = "ZlibCompression"  #: JSON 通道上较大的消息使用 zlib 压缩
+    LZ4_COMPRESSION = "Lz4Compression"  #: JSON 通道上较大的消息使用 lz4 压缩
+    SHARED_MEMORY_FRAMES = "SharedMemoryFrames"  #: 图像通过共享内存传输，视频流中只传输描述符，见 :mod:`metacar.shm`
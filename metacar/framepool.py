@@ -0,0 +1,99 @@
+"""
+预分配的数组缓冲池。
+
+按名称维护若干个预先分配的数组，:class:`~metacar.batch.FrameBatcher` 用它存放每帧的批量张量和暂存区，
+避免每帧都分配新的大数组。数组通过引用计数的 :class:`FrameLease` 借出，计数归零后回到缓冲池供之后的帧复用。
+
+``cv2.imdecode`` 不支持输出到指定数组，单张图像的解码结果总是新分配的数组，
+复制到缓冲池中只会多一次复制，因此不使用缓冲池的 :class:`~metacar.SceneAPI` 直接返回解码结果。
+"""
+
+import logging
+import threading
+import numpy as np
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FrameLease:
+    """从缓冲池借出的一个数组，引用计数归零后归还。"""
+
+    __slots__ = ("array", "_pool", "_key", "_pooled", "_refs")
+
+    def __init__(self, array: np.ndarray, pool: "FramePool", key: str, pooled: bool):
+        self.array = array  #: 借出的数组，归还后内容会被之后的帧覆盖
+        self._pool = pool
+        self._key = key
+        self._pooled = pooled
+        self._refs = 1
+
+    def retain(self) -> "FrameLease":
+        """增加一次引用，需要与 :meth:`release` 成对调用。"""
+        with self._pool._lock:
+            if self._refs <= 0:
+                raise RuntimeError("图像缓冲区已归还，不能再次引用")
+            self._refs += 1
+        return self
+
+    def release(self):
+        """释放一次引用，计数归零时归还到缓冲池。"""
+        with self._pool._lock:
+            if self._refs <= 0:
+                raise RuntimeError("图像缓冲区已归还")
+            self._refs -= 1
+            if self._refs == 0 and self._pooled:
+                self._pool._give_back(self._key, self.array)
+
+
+class FramePool:
+    """
+    按名称划分的数组缓冲池。
+
+    每个名称最多预分配 ``depth`` 个数组。所有数组都被借出时会临时分配新的数组，
+    并在指标 ``metacar_frame_pool_misses`` 中计数，此时应增大 ``depth`` 或尽快释放图像。
+    """
+
+    def __init__(self, depth: int = 4):
+        """
+        :param depth: 每个名称预分配的数组数量，应不少于同时持有的帧数 + 1。
+        """
+        self._depth = depth
+        self._lock = threading.Lock()
+        self._specs: dict[str, tuple[tuple[int, ...], np.dtype]] = {}
+        self._free: dict[str, list[np.ndarray]] = {}
+
+    def acquire_array(
+        self, key: str, shape: tuple[int, ...], dtype: np.dtype = np.uint8
+    ) -> FrameLease:
+        """
+        借出一个任意形状和类型的数组，引用计数为 1。
+
+        :param key: 缓冲区的名称，同一名称的数组相互复用。
+        :param shape: 数组形状。
+        :param dtype: 数组类型。
+        :return: 借出的数组。
+        """
+        spec = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            if self._specs.get(key) != spec:
+                # 形状或类型变化，旧的数组不再复用
+                self._specs[key] = spec
+                self._free[key] = [np.empty(*spec) for _ in range(self._depth)]
+            free = self._free[key]
+            if free:
+                return FrameLease(free.pop(), self, key, True)
+        metrics.FRAME_POOL_MISSES.inc(1, (key,))
+        return FrameLease(np.empty(*spec), self, key, False)
+
+    def _give_back(self, key: str, array: np.ndarray):
+        """归还数组，调用时需持有锁。"""
+        free = self._free.get(key)
+        if free is not None and (array.shape, array.dtype) == self._specs[key]:
+            free.append(array)
+
+    def clear(self):
+        """释放所有空闲的数组，已借出的数组归还后不再复用。"""
+        with self._lock:
+            self._specs.clear()
+            self._free.clear()
@@ -0,0 +1,114 @@
+"""
+按道路索引的交通灯。
+
+:attr:`SimCarMsg.traffic_light_groups <metacar.models.SimCarMsg.traffic_light_groups>` 是交通灯组的列表，
+查找主车所在道路的交通灯需要逐组、逐个比较 ``road_id``。:class:`TrafficLightIndex` 维护道路 ID 到交通灯的映射，
+每帧只更新交通灯的状态，结合 :class:`~metacar.roads.RoadIndex` 预先计算的停止线位置，
+主车所在道路的交通灯、到停止线的距离和当前方向的剩余时间都可以直接查到。
+
+交通灯的 ``road_id`` 为其管控的道路，即停止线所在的道路。
+"""
+
+from dataclasses import dataclass
+from .models import TrafficLightGroupInfo, TrafficLightInfo, TrafficLightState
+from .roads import LanePosition, Manoeuvre, RoadIndex
+
+
+@dataclass(frozen=True)
+class TrafficLightStatus:
+    """主车所在车道的交通灯状态。"""
+
+    light: TrafficLightInfo  #: 管控该道路的交通灯
+    state: TrafficLightState  #: 当前通过方式对应的状态
+    remaining_time: float  #: 当前状态的剩余时间
+    stop_line_distance: float | None  #: 沿车道到停止线的距离，道路没有停止线时为 None
+
+
+def light_state(
+    light: TrafficLightInfo, manoeuvre: Manoeuvre
+) -> tuple[TrafficLightState, float]:
+    """
+    获取交通灯在某个方向上的状态。
+
+    :param light: 交通灯。
+    :param manoeuvre: 通过路口的方式。
+    :return: 元组 (state, remaining_time)。
+    """
+    if manoeuvre is Manoeuvre.LEFT:
+        return light.left_state, light.left_remaining_time
+    if manoeuvre is Manoeuvre.RIGHT:
+        return light.right_state, light.right_remaining_time
+    return light.straight_state, light.straight_remaining_time
+
+
+class TrafficLightIndex:
+    """道路 ID 到交通灯的映射，每帧调用 :meth:`update` 更新状态。"""
+
+    def __init__(self, road_index: RoadIndex | None = None):
+        """
+        :param road_index: 道路索引，用于计算到停止线的距离。
+        """
+        self._road_index = road_index
+        self._by_road: dict[str, TrafficLightInfo] = {}
+        self._by_id: dict[str, TrafficLightInfo] = {}
+
+    def update(self, groups: list[TrafficLightGroupInfo]) -> "TrafficLightIndex":
+        """
+        更新交通灯状态，不在本帧中的交通灯会被移除。
+
+        :param groups: 本帧的交通灯组，通常为 ``sim_car_msg.traffic_light_groups``。
+        :return: 自身。
+        """
+        by_id = self._by_id
+        seen = set()
+        for group in groups:
+            for light in group.traffic_lights:
+                seen.add(light.id)
+                previous = by_id.get(light.id)
+                if previous is not None and previous.road_id != light.road_id:
+                    self._by_road.pop(previous.road_id, None)
+                by_id[light.id] = light
+                self._by_road[light.road_id] = light
+        if len(seen) != len(by_id):
+            for light_id in [light_id for light_id in by_id if light_id not in seen]:
+                light = by_id.pop(light_id)
+                if self._by_road.get(light.road_id) is light:
+                    del self._by_road[light.road_id]
+        return self
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    @property
+    def road_index(self) -> RoadIndex | None:
+        """构造时指定的道路索引。"""
+        return self._road_index
+
+    def get(self, light_id: str) -> TrafficLightInfo | None:
+        """按 ID 获取交通灯。"""
+        return self._by_id.get(light_id)
+
+    def governing(self, road_id: str) -> TrafficLightInfo | None:
+        """获取管控某条道路的交通灯，没有时返回 None。"""
+        return self._by_road.get(road_id)
+
+    def status(
+        self, position: LanePosition, manoeuvre: Manoeuvre = Manoeuvre.STRAIGHT
+    ) -> TrafficLightStatus | None:
+        """
+        获取主车所在车道的交通灯状态。
+
+        :param position: 主车位置，见 :meth:`RoadIndex.locate() <metacar.roads.RoadIndex.locate>`。
+        :param manoeuvre: 在路口的通过方式，可以由 :meth:`RoadIndex.turn() <metacar.roads.RoadIndex.turn>` 得到。
+        :return: 交通灯状态，所在道路没有交通灯时返回 None。
+        """
+        light = self._by_road.get(position.road_id)
+        if light is None:
+            return None
+        state, remaining_time = light_state(light, manoeuvre)
+        distance = (
+            self._road_index.stop_line_distance(position)
+            if self._road_index is not None
+            else None
+        )
+        return TrafficLightStatus(light, state, remaining_time, distance)
@@ -0,0 +1,388 @@
+"""
+运行指标统计，以及 Prometheus/OpenMetrics 文本格式的 HTTP 导出。
+
+指标在热路径上只写入当前线程自己的分片（``threading.local``），不加锁；
+只有在导出时才汇总所有线程的分片，因此在收发循环中打点的开销很小。
+线程退出后，它的分片被并入一个公共的基础分片，频繁创建线程时分片数量不会持续增长。
+"""
+
+import bisect
+import logging
+import threading
+import weakref
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+#: 默认的直方图分桶（单位：秒），覆盖 10 微秒到 1 秒
+DEFAULT_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+def _format_labels(labelnames: tuple[str, ...], labelvalues: tuple[str, ...]) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(labelnames, labelvalues)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _ShardHolder:
+    """存放在 ``threading.local`` 中的分片持有者，线程退出时被回收，以此触发分片的合并。"""
+
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self):
+        self.shard: dict = {}
+
+
+class _Metric:
+    """指标基类，负责管理每个线程的分片。"""
+
+    _type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        # 已退出线程的分片合并到这里，只在持有 _shards_lock 时读写
+        self._base: dict = {}
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        """获取当前线程的分片，每个线程只在第一次打点时加一次锁。"""
+        try:
+            return self._local.holder.shard
+        except AttributeError:
+            holder = _ShardHolder()
+            with self._shards_lock:
+                self._shards.append(holder.shard)
+            # 线程退出时 threading.local 释放持有者，随即把分片并入基础分片
+            finalizer = weakref.finalize(holder, self._retire, holder.shard)
+            finalizer.atexit = False
+            self._local.holder = holder
+            return holder.shard
+
+    def _retire(self, shard: dict):
+        """把已退出线程的分片并入基础分片。"""
+        with self._shards_lock:
+            for idx, item in enumerate(self._shards):
+                if item is shard:
+                    del self._shards[idx]
+                    break
+            self._merge(self._base, shard)
+
+    def _merge(self, target: dict, shard: dict):
+        """把一个分片累加到 ``target`` 中，不与 ``shard`` 共享可变对象。"""
+        raise NotImplementedError
+
+    def _snapshots(self) -> list[dict]:
+        base: dict = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+            self._merge(base, self._base)
+        # dict.copy 在 GIL 下是原子的，不会与其他线程的写入冲突
+        return [base] + [shard.copy() for shard in shards]
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self._type}",
+        ]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增的计数器。"""
+
+    _type = "counter"
+
+    def inc(self, amount: float = 1.0, labels: tuple[str, ...] = ()):
+        """增加计数。
+
+        :param amount: 增加量，必须非负。
+        :param labels: 标签值，顺序与 ``labelnames`` 一致。
+        """
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def _merge(self, target: dict, shard: dict):
+        for labels, value in shard.items():
+            target[labels] = target.get(labels, 0.0) + value
+
+    def value(self, labels: tuple[str, ...] = ()) -> float:
+        """汇总所有线程后的当前值。"""
+        return sum(shard.get(labels, 0.0) for shard in self._snapshots())
+
+    def _render_samples(self) -> list[str]:
+        totals: dict[tuple[str, ...], float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0.0) + value
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, labels)} "
+            f"{_format_value(value)}"
+            for labels, value in sorted(totals.items())
+        ]
+
+
+class Histogram(_Metric):
+    """分桶直方图，常用于统计耗时。"""
+
+    _type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: tuple[str, ...] = ()):
+        """记录一次观测值。
+
+        :param value: 观测值。
+        :param labels: 标签值，顺序与 ``labelnames`` 一致。
+        """
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # [各个桶的计数（最后一个是 +Inf）, 总和, 总数]
+            state = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def count(self, labels: tuple[str, ...] = ()) -> int:
+        """汇总所有线程后的观测次数。"""
+        return sum(shard[labels][2] for shard in self._snapshots() if labels in shard)
+
+    def _merge(self, target: dict, shard: dict):
+        for labels, state in shard.items():
+            # 先读总数：observe 最后才增加总数，此时已计入总数的观测一定已经计入了各个桶
+            count = state[2]
+            total = state[1]
+            bucket_counts = list(state[0])
+            merged = target.get(labels)
+            if merged is None:
+                merged = target[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for idx, bucket_count in enumerate(bucket_counts):
+                merged[0][idx] += bucket_count
+            merged[1] += total
+            merged[2] += count
+
+    def _render_samples(self) -> list[str]:
+        totals: dict[tuple[str, ...], list] = {}
+        for shard in self._snapshots():
+            self._merge(totals, shard)
+        lines = []
+        labelnames = self.labelnames + ("le",)
+        for labels, (bucket_counts, total, count) in sorted(totals.items()):
+            # 导出时其他线程仍在写入，桶的计数可能多于总数：累计值不超过总数，+Inf 桶取总数
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative = min(cumulative + bucket_count, count)
+                bucket_labels = labels + (_format_value(bound),)
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(labelnames, bucket_labels)} "
+                    f"{cumulative}"
+                )
+            bucket_labels = labels + (_format_value(float("inf")),)
+            lines.append(
+                f"{self.name}_bucket{_format_labels(labelnames, bucket_labels)} "
+                f"{count}"
+            )
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，负责汇总并输出所有已注册的指标。"""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Iterable[str] = ()
+    ) -> Counter:
+        """创建并注册一个计数器。"""
+        metric = Counter(name, documentation, labelnames)
+        self.register(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """创建并注册一个直方图。"""
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.register(metric)
+        return metric
+
+    def render(self) -> str:
+        """以 OpenMetrics 文本格式输出所有指标。"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+#: 默认的全局注册表，metacar 内部的打点都记录在这里
+REGISTRY = MetricsRegistry()
+
+TICKS = REGISTRY.counter("metacar_ticks", "已处理的仿真帧数")
+RECEIVED_BYTES = REGISTRY.counter(
+    "metacar_received_bytes", "各通道接收的字节数", ("channel",)
+)
+SENT_BYTES = REGISTRY.counter("metacar_sent_bytes", "各通道发送的字节数", ("channel",))
+DECODE_SECONDS = REGISTRY.histogram(
+    "metacar_decode_seconds",
+    "消息解码耗时（state 为 JSON，frame 为图像，batch 为批量张量的转换）",
+    ("kind",),
+)
+CONTROL_SEND_SECONDS = REGISTRY.histogram(
+    "metacar_control_send_seconds", "发送车辆控制命令的耗时"
+)
+DROPPED_FRAMES = REGISTRY.counter(
+    "metacar_dropped_frames", "被丢弃的过期或错位的帧数", ("reason",)
+)
+COMPRESSION_SECONDS = REGISTRY.histogram(
+    "metacar_compression_seconds", "消息压缩和解压的耗时", ("codec", "operation")
+)
+COMPRESSION_INPUT_BYTES = REGISTRY.counter(
+    "metacar_compression_input_bytes",
+    "被压缩消息的原始字节数，与 output 之比即压缩率",
+    ("channel", "direction"),
+)
+COMPRESSION_OUTPUT_BYTES = REGISTRY.counter(
+    "metacar_compression_output_bytes",
+    "被压缩消息压缩后的字节数",
+    ("channel", "direction"),
+)
+FRAME_POOL_MISSES = REGISTRY.counter(
+    "metacar_frame_pool_misses",
+    "图像缓冲池耗尽时临时分配数组的次数，buffer 为摄像头 ID 或批量张量的名称",
+    ("buffer",),
+)
+PROCESSOR_WAIT_SECONDS = REGISTRY.histogram(
+    "metacar_processor_wait_seconds", "图像处理进程池从提交到收集结果的耗时"
+)
+PROCESSOR_LATE_RESULTS = REGISTRY.counter(
+    "metacar_processor_late_results", "超过截止时间后才到达而被丢弃的图像处理结果数"
+)
+TRAJECTORY_CACHE = REGISTRY.counter(
+    "metacar_trajectory_cache",
+    "推荐轨迹的复用情况，result 为 json（跳过 JSON 解析）、hit（未变化）、shift（起点前移）或 rebuild（重新构造）",
+    ("result",),
+)
+RECONNECTS = REGISTRY.counter("metacar_reconnects", "与场景重新建立连接的次数")
+LEVEL_RETRIES = REGISTRY.counter("metacar_level_retries", "重试关卡的次数")
+LEVEL_SKIPS = REGISTRY.counter("metacar_level_skips", "跳过关卡的次数")
+
+
+class MetricsServer:
+    """在后台线程中提供 ``/metrics`` HTTP 接口的导出服务。"""
+
+    def __init__(self, host: str, port: int, registry: MetricsRegistry = REGISTRY):
+        """
+        :param host: 绑定的 IP 地址。
+        :param port: 监听的端口号，为 0 时由系统分配，可通过 :attr:`port` 获取。
+        :param registry: 导出的指标注册表。
+        """
+        # 延迟导入，不启动导出服务时不需要加载 http.server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type",
+                    "application/openmetrics-text; version=1.0.0; charset=utf-8",
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metacar-metrics", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"指标导出服务监听 {host}:{self.port}")
+
+    @property
+    def port(self) -> int:
+        """实际监听的端口号。"""
+        return self._server.server_address[1]
+
+    def close(self):
+        """停止导出服务。"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+def start_http_server(
+    port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY
+) -> MetricsServer:
+    """启动指标导出服务。
+
+    :param port: 监听的端口号。
+    :param host: 绑定的 IP 地址，默认只监听本机。
+    :param registry: 导出的指标注册表。
+    :return: 导出服务，调用 :meth:`MetricsServer.close` 停止。
+    """
+    return MetricsServer(host, port, registry)
@@ -1,12 +1,54 @@
-from typing import Literal
-from pydantic import BaseModel, Field
-from enum import Enum
-import numpy as np
-from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Literal
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, model_serializer
+from dataclasses import dataclass, field
+from .enums import (
+    RegionType,
+    LineType,
+    DrivingType,
+    TrafficSignType,
+    GearMode,
+    ObstacleType,
+    TrafficLightState,
+    ProtocolFeature,
+)
 from .geometry import Vector2, Vector3
 
+if TYPE_CHECKING:
+    # 只用于类型标注，导入 models 时不加载 NumPy
+    import numpy as np
+    from .framepool import FrameLease
 
-class BuildingInfo(BaseModel):
+
+class _Model(BaseModel):
+    """
+    所有数据模型的基类。
+
+    校验器在首次校验或序列化时才构建，``import metacar.models`` 不需要为全部模型生成 schema。
+    """
+
+    model_config = ConfigDict(defer_build=True)
+
+    @classmethod
+    def _from_trusted(cls, values: dict[str, Any], fields_set: set[str] | None = None):
+        """
+        由已经是正确类型的字段值直接构造，跳过校验，用于由数组批量构造模型的热路径。
+
+        :param values: 字段名到值的映射，必须包含所有字段。
+        :param fields_set: 已设置的字段集合，批量构造时可以传入同一个包含所有字段的集合。
+        """
+        obj = cls.__new__(cls)
+        object.__setattr__(obj, "__dict__", values)
+        object.__setattr__(
+            obj,
+            "__pydantic_fields_set__",
+            set(values) if fields_set is None else fields_set,
+        )
+        object.__setattr__(obj, "__pydantic_extra__", None)
+        object.__setattr__(obj, "__pydantic_private__", None)
+        return obj
+
+
+class BuildingInfo(_Model):
     """建筑物信息"""
 
     id: str = Field(description="建筑物 ID")
@@ -22,15 +64,7 @@ class BuildingInfo(BaseModel):
     height: float = Field(description="高度")
 
 
-class RegionType(Enum):
-    """区域类型"""
-
-    NORMAL_PARKING = 0  #: 正常停车区
-    RESTRICTED_PARKING = 1  #: 禁停区
-    FUNCTION_ZONE = 2  #: 功能区
-
-
-class RegionInfo(BaseModel):
+class RegionInfo(_Model):
     """区域信息"""
 
     id: str = Field(description="区域 ID")
@@ -45,7 +79,7 @@ class RegionInfo(BaseModel):
     width: float = Field(description="宽度")
 
 
-class VLAExtension(BaseModel):
+class VLAExtension(_Model):
     """VLA 扩展信息"""
 
     buildings: list[BuildingInfo] = Field(
@@ -54,7 +88,7 @@ class VLAExtension(BaseModel):
     regions: list[RegionInfo] = Field(alias="Regions", description="区域信息")
 
 
-class VLATextOutput(BaseModel):
+class VLATextOutput(_Model):
     """VLA 场景的文本输出"""
 
     ocr_text: str = Field(serialization_alias="OcrText", description="OCR 文本")
@@ -67,7 +101,7 @@ class VLATextOutput(BaseModel):
     )
 
 
-class FunctionZoneViolation(BaseModel):
+class FunctionZoneViolation(_Model):
     """功能区违规信息"""
 
     rule_code: str = Field(serialization_alias="ruleCode", description="规则代码")
@@ -76,13 +110,13 @@ class FunctionZoneViolation(BaseModel):
     )
 
 
-class FunctionZoneResult(BaseModel):
+class FunctionZoneResult(_Model):
     """功能区检测结果"""
 
     violations: list[FunctionZoneViolation] = Field(description="违规列表")
 
 
-class ParkingResult(BaseModel):
+class ParkingResult(_Model):
     """停车区检测结果"""
 
     violating_sticker_ids: list[str] = Field(
@@ -90,7 +124,7 @@ class ParkingResult(BaseModel):
     )
 
 
-class VLAExtensionOutput(BaseModel):
+class VLAExtensionOutput(_Model):
     """VLA 场景的扩展输出"""
 
     text_info: VLATextOutput | None = Field(
@@ -106,7 +140,7 @@ class VLAExtensionOutput(BaseModel):
     )
 
 
-class SubSceneInfo(BaseModel):
+class SubSceneInfo(_Model):
     """子场景信息"""
 
     name: str = Field(alias="SubSceneName", description="子场景名称")
@@ -118,7 +152,7 @@ class SubSceneInfo(BaseModel):
     )
 
 
-class MapConfig(BaseModel):
+class MapConfig(_Model):
     """地图配置"""
 
     path: str = Field(description="地图目录路径")
@@ -129,18 +163,7 @@ class MapConfig(BaseModel):
     )
 
 
-class LineType(Enum):
-    """道路线类型"""
-
-    MIDDLE_LINE = 1  #: 中线
-    SIDE_LINE = 2  #: 侧线
-    SOLID_LINE = 3  #: 实线
-    STOP_LINE = 4  #: 停止线
-    ZEBRA_CROSSING = 5  #: 斑马线
-    DASH_LINE = 6  #: 虚线
-
-
-class BorderInfo(BaseModel):
+class BorderInfo(_Model):
     """车道边界信息"""
 
     type: LineType = Field(alias="borderType", description="边界类型")
@@ -149,7 +172,7 @@ class BorderInfo(BaseModel):
     )
 
 
-class LaneInfo(BaseModel):
+class LaneInfo(_Model):
     """车道信息"""
 
     id: str = Field(description="车道 ID")
@@ -161,24 +184,7 @@ class LaneInfo(BaseModel):
     path_points: list[Vector2] = Field(alias="pathPoint", description="车道中心线")
 
 
-class DrivingType(Enum):
-    """行驶类型"""
-
-    MOTOR_VEHICLE_ALLOWED = 1  #: 机动车可行驶
-    NON_MOTOR_VEHICLE_ALLOWED = 2  #: 非机动车可行驶
-    PEDESTRIAN_ALLOWED = 3  #: 行人可行
-
-
-class TrafficSignType(Enum):
-    """交通标志"""
-
-    NO_SIGN = 0  #: 无标志
-    SPEED_LIMIT_SIGN = 1  #: 限速标志
-    STOP_SIGN = 2  #: 停止标志
-    V2X_SIGN = 3  #: V2X 标志
-
-
-class RoadInfo(BaseModel):
+class RoadInfo(_Model):
     """道路信息，一条道路(Road)由一个或多个车道(Lane)组成"""
 
     id: str = Field(description="道路 ID")
@@ -194,7 +200,7 @@ class RoadInfo(BaseModel):
     lanes: list[LaneInfo] = Field(alias="laneData", description="车道信息")
 
 
-class SceneStaticData(BaseModel):
+class SceneStaticData(_Model):
     """场景静态信息"""
 
     route: list[Vector3] = Field(description="路线（VLA 场景为空列表）")
@@ -205,7 +211,7 @@ class SceneStaticData(BaseModel):
     )
 
 
-class PoseGnss(BaseModel):
+class PoseGnss(_Model):
     """车辆位姿信息"""
 
     pos_x: float = Field(alias="posX", description="位置 X")
@@ -219,16 +225,7 @@ class PoseGnss(BaseModel):
     ori_z: float = Field(alias="oriZ", description="欧拉角 Z（单位：角度）")
 
 
-class GearMode(Enum):
-    """档位模式"""
-
-    NEUTRAL = 0  #: 空档
-    DRIVE = 1  #: 前进档
-    REVERSE = 2  #: 倒车档
-    PARKING = 3  #: 停车档
-
-
-class MainVehicleInfo(BaseModel):
+class MainVehicleInfo(_Model):
     """主车信息"""
 
     id: int = Field(alias="mainVehicleId", description="主车 ID")
@@ -251,7 +248,7 @@ class MainVehicleInfo(BaseModel):
     headlights_on: bool = Field(alias="Signal_Light_FrontLight", description="前灯")
 
 
-class EulerAngle(BaseModel):
+class EulerAngle(_Model):
     """欧拉角"""
 
     # 场景传来的字段严谨一点应该为 oriX, oriY, oriZ，但实际是 orix, oriy, oriz
@@ -261,7 +258,7 @@ class EulerAngle(BaseModel):
     ori_z: float = Field(alias="oriz", description="欧拉角 Z（单位：角度）")
 
 
-class CameraInfo(BaseModel):
+class CameraInfo(_Model):
     """摄像头信息"""
 
     id: str = Field(alias="Id", description="摄像头 ID")
@@ -275,37 +272,14 @@ class CameraInfo(BaseModel):
     image_height: int = Field(alias="ImageH", description="图像高度")
 
 
-class SensorInfo(BaseModel):
+class SensorInfo(_Model):
     """传感器信息"""
 
     ego_rgb_cams: list[CameraInfo] = Field(alias="egoRGBCams", description="主车摄像头")
     v2x_cams: list[CameraInfo] = Field(alias="v2xCams", description="V2X 摄像头")
 
 
-class ObstacleType(Enum):
-    """障碍物类型"""
-
-    UNKNOWN = 0  #: 未知障碍物
-    PEDESTRIAN = 4  #: 行人
-    CAR = 6  #: 小汽车
-    STATIC = 7  #: 静态障碍物
-    BICYCLE = 8  #: 自行车
-    ROAD_MARK = 12  #: 道路标记
-    TRAFFIC_SIGN = 13  #: 交通标志
-    TRAFFIC_LIGHT = 15  #: 交通信号灯
-    RIDER = 17  #: 骑手
-    TRUCK = 18  #: 卡车
-    BUS = 19  #: 公交车
-    SPECIAL_VEHICLE = 20  #: 特种车辆
-    MOTORCYCLE = 21  #: 摩托车
-    DYNAMIC = 22  #: 动态障碍物
-    SPEED_LIMIT_SIGN = 26  #: 限速标志（限速值以 "SpeedLimit|30"(单位：km/h) 的格式在 :attr:`ObstacleInfo.extra_info` 中给出）
-    BICYCLE_STATIC = 27  #: 静止自行车
-    ROAD_OBSTACLE = 29  #: 道路障碍物
-    PARKING_SLOT = 30  #: 停车位
-
-
-class ObstacleInfo(BaseModel):
+class ObstacleInfo(_Model):
     """障碍物信息"""
 
     id: int = Field(description="障碍物 ID")
@@ -325,15 +299,7 @@ class ObstacleInfo(BaseModel):
     extra_info: str | None = Field(alias="RedundantValue", description="额外信息")
 
 
-class TrafficLightState(Enum):
-    """交通灯状态"""
-
-    RED = 1  #: 红灯
-    GREEN = 2  #: 绿灯
-    YELLOW = 3  #: 黄灯
-
-
-class TrafficLightInfo(BaseModel):
+class TrafficLightInfo(_Model):
     """一排交通灯的信息"""
 
     id: str = Field(description="交通灯 ID")
@@ -357,7 +323,7 @@ class TrafficLightInfo(BaseModel):
     )
 
 
-class TrafficLightGroupInfo(BaseModel):
+class TrafficLightGroupInfo(_Model):
     """交通灯组信息，一组交通灯共同表示一个路口的信号灯信息。"""
 
     id: str = Field(description="交通灯组 ID")
@@ -366,7 +332,7 @@ class TrafficLightGroupInfo(BaseModel):
     )
 
 
-class SceneStatus(BaseModel):
+class SceneStatus(_Model):
     """场景状态信息"""
 
     sub_scene_name: str = Field(alias="SubSceneName", description="子场景名称")
@@ -377,8 +343,13 @@ class SceneStatus(BaseModel):
     )
 
 
-class SimCarMsg(BaseModel):
-    """仿真动态信息"""
+class SimCarMsg(_Model):
+    """
+    仿真动态信息
+
+    通过二进制格式接收的消息中，``trajectory`` 和 ``obstacles`` 在首次访问时才由解码得到的数组构造，
+    序列化、pickle、复制和比较之前同样会先构造，对调用方透明。
+    """
 
     trajectory: list[Vector3] = Field(alias="Trajectory", description="推荐轨迹")
     pose_gnss: PoseGnss = Field(alias="PoseGnss", description="GNSS 数据")
@@ -394,8 +365,81 @@ class SimCarMsg(BaseModel):
     )
     scene_status: SceneStatus = Field(alias="SceneStatus", description="场景状态信息")
 
-
-class VehicleControl(BaseModel):
+    # 返回延迟构造的字段，构造完成后为 None
+    _pending: Callable[[], dict[str, Any]] | None = PrivateAttr(default=None)
+
+    @classmethod
+    def _from_lazy(
+        cls, values: dict[str, Any], pending: Callable[[], dict[str, Any]]
+    ) -> "SimCarMsg":
+        """
+        由已经是正确类型的字段值构造，其余字段在首次访问时由 ``pending`` 构造。
+
+        :param values: 字段名到值的映射，不包含延迟构造的字段。
+        :param pending: 返回延迟构造的字段名到值的映射。
+        """
+        obj = cls._from_trusted(values, set(cls.model_fields))
+        object.__setattr__(obj, "__pydantic_private__", {"_pending": pending})
+        return obj
+
+    def _materialize(self):
+        """构造尚未构造的延迟字段。"""
+        private = self.__pydantic_private__
+        pending = private.get("_pending") if private else None
+        if pending is not None:
+            private["_pending"] = None
+            # 已经赋值的字段以赋值为准，并保持字段的声明顺序
+            values = pending()
+            values.update(self.__dict__)
+            object.__setattr__(
+                self,
+                "__dict__",
+                {name: values[name] for name in type(self).model_fields},
+            )
+
+    def __getattr__(self, item: str) -> Any:
+        if item in _LAZY_FIELDS:
+            self._materialize()
+            if item in self.__dict__:
+                return self.__dict__[item]
+        return super().__getattr__(item)
+
+    def __eq__(self, other: Any) -> bool:
+        self._materialize()
+        if isinstance(other, SimCarMsg):
+            other._materialize()
+        return super().__eq__(other)
+
+    def __iter__(self):
+        self._materialize()
+        return super().__iter__()
+
+    def __repr_args__(self):
+        self._materialize()
+        return super().__repr_args__()
+
+    def __getstate__(self) -> dict[Any, Any]:
+        self._materialize()
+        return super().__getstate__()
+
+    def __copy__(self) -> "SimCarMsg":
+        self._materialize()
+        return super().__copy__()
+
+    def __deepcopy__(self, memo: dict[int, Any] | None = None) -> "SimCarMsg":
+        self._materialize()
+        return super().__deepcopy__(memo)
+
+    @model_serializer(mode="wrap")
+    def _serialize_lazy(self, handler):
+        self._materialize()
+        return handler(self)
+
+
+_LAZY_FIELDS = frozenset(("trajectory", "obstacles"))
+
+
+class VehicleControl(_Model):
     """车辆控制信息"""
 
     throttle: float = Field(default=0.0, description="油门（0~1）")
@@ -408,7 +452,7 @@ class VehicleControl(BaseModel):
     headlights_on: bool = Field(default=False, description="前灯")
 
 
-class VehicleControlDTO(BaseModel):
+class VehicleControlDTO(_Model):
     """车辆控制场景接口模型"""
 
     throttle: float = Field(default=0.0, description="油门（0~1）")
@@ -437,7 +481,7 @@ class VehicleControlDTO(BaseModel):
     move_to_end: int = Field(serialization_alias="movetoend", description="跳关")
 
 
-class SimCarMsgOutput(BaseModel):
+class SimCarMsgOutput(_Model):
     """code4 中使用的输出结构"""
 
     vehicle_control: VehicleControlDTO = Field(serialization_alias="VehicleControl")
@@ -447,7 +491,7 @@ class SimCarMsgOutput(BaseModel):
     )
 
 
-class Code1(BaseModel):
+class Code1(_Model):
     """code1 接口模型，接收静态信息"""
 
     code: Literal[1]
@@ -457,29 +501,56 @@ class Code1(BaseModel):
         alias="VLAExtension",
         description="VLA 扩展信息，如果为 None 则表示不是 VLA 场景",
     )
+    features: list[str] = Field(
+        default_factory=list,
+        alias="Features",
+        description="场景支持的协议特性，旧版本场景不发送该字段",
+    )
+    session_token: str | None = Field(
+        default=None,
+        alias="SessionToken",
+        description="会话令牌，发送时视频流连接的第一条消息为同一令牌，用于多仿真端服务器配对连接",
+    )
 
 
-class Code2(BaseModel):
+class Code2(_Model):
     """code2 接口模型，发送API已就绪"""
 
     code: Literal[2]
+    features: list[str] = Field(
+        default_factory=list,
+        serialization_alias="Features",
+        description="API 启用的协议特性",
+    )
 
+    @model_serializer(mode="wrap")
+    def _omit_empty_features(self, handler):
+        # 未启用任何特性时保持与旧版本完全一致的消息内容
+        data = handler(self)
+        if not self.features:
+            data.pop("Features", None)
+            data.pop("features", None)
+        return data
 
-class Code3(BaseModel):
+
+class Code3(_Model):
     """code3 接口模型，接收仿真动态信息"""
 
     code: Literal[3]
     sim_car_msg: SimCarMsg = Field(alias="SimCarMsg")
+    seq: int | None = Field(
+        default=None, alias="Seq", description="帧序号，启用 FrameSeq 特性时给出"
+    )
 
 
-class Code4(BaseModel):
+class Code4(_Model):
     """code4 接口模型，发送控制信息"""
 
     code: Literal[4]
     sim_car_msg: SimCarMsgOutput = Field(serialization_alias="SimCarMsg")
 
 
-class Code5(BaseModel):
+class Code5(_Model):
     """code5 接口模型，接收场景结束信息"""
 
     code: Literal[5]
@@ -490,4 +561,27 @@ class CameraFrame:
     """摄像头图像数据"""
 
     id: str  #: 对应 :attr:`CameraInfo.id`
-    frame: np.ndarray  #: 图像数据
+    frame: "np.ndarray"  #: 图像数据
+    #: 使用 :class:`~metacar.batch.FrameBatcher` 时，图像所在数组的租约，见 :mod:`metacar.framepool`
+    lease: "FrameLease | None" = field(default=None, repr=False, compare=False)
+    #: 视频流中收到的编码数据（例如 JPEG），通过共享内存传输的图像为 None
+    raw: "bytes | memoryview | None" = field(default=None, repr=False, compare=False)
+
+    def retain(self) -> "CameraFrame":
+        """需要在之后的帧中继续使用图像时调用，并在用完后调用 :meth:`release`。"""
+        if self.lease is not None:
+            self.lease.retain()
+        return self
+
+    def release(self):
+        """释放一次引用，图像不在缓冲池中时不做任何事。"""
+        if self.lease is not None:
+            self.lease.release()
+
+
+class CameraFrames(list):
+    """:meth:`SceneAPI.main_loop() <metacar.SceneAPI.main_loop>` 每帧返回的图像列表，元素为 :class:`CameraFrame`"""
+
+    #: 创建 SceneAPI 时指定了 ``frame_batcher`` 时，为所有图像组成的
+    #: :class:`~metacar.batch.FrameBatch`，否则为 None
+    batch: Any = None
@@ -0,0 +1,331 @@
+"""
+二维有向包围盒（OBB）的批量计算。
+
+障碍物、主车和建筑物都可以看作水平面内带朝向的矩形。:class:`OrientedBoxes` 用 NumPy 数组保存一组矩形，
+每帧一次调用即可得到所有矩形的角点、两两之间是否相交（分离轴定理）、与主车的最小距离和碰撞时间，
+不需要在 Python 中逐个旋转角点。
+
+朝向与 :attr:`ObstacleInfo.ori_z <metacar.models.ObstacleInfo.ori_z>` 相同，单位为度，从上往下看顺时针为正。
+"""
+
+from dataclasses import dataclass
+from functools import cached_property
+import numpy as np
+from .models import BuildingInfo, MainVehicleInfo, ObstacleInfo, PoseGnss, RegionInfo
+
+
+@dataclass(frozen=True)
+class OrientedBoxes:
+    """一组水平面内的有向矩形。"""
+
+    center: np.ndarray  #: 中心点，形状为 (N, 2)
+    size: np.ndarray  #: 长度和宽度，形状为 (N, 2)
+    yaw: np.ndarray  #: 朝向，逆时针为正，单位为弧度，形状为 (N,)
+    velocity: np.ndarray  #: 速度，形状为 (N, 2)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        pos_x: np.ndarray,
+        pos_y: np.ndarray,
+        ori_z: np.ndarray,
+        length: np.ndarray,
+        width: np.ndarray,
+        vel_x: np.ndarray | None = None,
+        vel_y: np.ndarray | None = None,
+    ) -> "OrientedBoxes":
+        """
+        由各字段的数组构造。
+
+        :param pos_x: 中心点 X。
+        :param pos_y: 中心点 Y。
+        :param ori_z: 朝向（单位：度，顺时针为正）。
+        :param length: 长度。
+        :param width: 宽度。
+        :param vel_x: 速度 X，默认为 0。
+        :param vel_y: 速度 Y，默认为 0。
+        """
+        center = np.stack([pos_x, pos_y], axis=-1).astype(np.float64).reshape(-1, 2)
+        velocity = np.zeros_like(center)
+        if vel_x is not None and vel_y is not None:
+            velocity[:, 0] = vel_x
+            velocity[:, 1] = vel_y
+        return cls(
+            center=center,
+            size=np.stack([length, width], axis=-1).astype(np.float64).reshape(-1, 2),
+            yaw=-np.radians(np.asarray(ori_z, dtype=np.float64)).reshape(-1),
+            velocity=velocity,
+        )
+
+    @classmethod
+    def from_obstacle_array(cls, obstacles: np.ndarray) -> "OrientedBoxes":
+        """
+        由 :func:`metacar.wire.state_arrays` 返回的障碍物数组构造。
+
+        :param obstacles: 类型为 :data:`~metacar.wire.OBSTACLE_DTYPE` 的数组。
+        """
+        return cls.from_arrays(
+            obstacles["pos_x"],
+            obstacles["pos_y"],
+            obstacles["ori_z"],
+            obstacles["length"],
+            obstacles["width"],
+            obstacles["vel_x"],
+            obstacles["vel_y"],
+        )
+
+    @classmethod
+    def from_obstacles(cls, obstacles: list[ObstacleInfo]) -> "OrientedBoxes":
+        """由障碍物列表构造，障碍物较多时优先使用 :meth:`from_obstacle_array`。"""
+        values = np.array(
+            [
+                (o.pos_x, o.pos_y, o.ori_z, o.length, o.width, o.vel_x, o.vel_y)
+                for o in obstacles
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 7)
+        return cls.from_arrays(*values.T)
+
+    @classmethod
+    def from_buildings(cls, buildings: list[BuildingInfo]) -> "OrientedBoxes":
+        """由建筑物列表构造，建筑物的速度为 0。"""
+        values = np.array(
+            [(b.pos_x, b.pos_y, b.ori_z, b.length, b.width) for b in buildings],
+            dtype=np.float64,
+        ).reshape(-1, 5)
+        return cls.from_arrays(*values.T)
+
+    @classmethod
+    def from_regions(cls, regions: list[RegionInfo]) -> "OrientedBoxes":
+        """由区域列表构造，区域的速度为 0。"""
+        values = np.array(
+            [(r.pos_x, r.pos_y, r.ori_z, r.length, r.width) for r in regions],
+            dtype=np.float64,
+        ).reshape(-1, 5)
+        return cls.from_arrays(*values.T)
+
+    @classmethod
+    def from_main_vehicle(
+        cls, pose: PoseGnss, main_vehicle: MainVehicleInfo
+    ) -> "OrientedBoxes":
+        """由主车的位姿和尺寸构造只包含主车的一个矩形。"""
+        return cls.from_arrays(
+            np.array([pose.pos_x]),
+            np.array([pose.pos_y]),
+            np.array([pose.ori_z]),
+            np.array([main_vehicle.length]),
+            np.array([main_vehicle.width]),
+            np.array([pose.vel_x]),
+            np.array([pose.vel_y]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.center)
+
+    def __getitem__(self, index) -> "OrientedBoxes":
+        """按下标、下标数组或布尔掩码取出部分矩形，结果总是一组矩形。"""
+        index = np.asarray(index)
+        if index.ndim == 0:
+            index = index.reshape(1)
+        return OrientedBoxes(
+            center=self.center[index],
+            size=self.size[index],
+            yaw=self.yaw[index],
+            velocity=self.velocity[index],
+        )
+
+    @cached_property
+    def _trig(self) -> tuple[np.ndarray, np.ndarray]:
+        """朝向的余弦和正弦，只计算一次。"""
+        return np.cos(self.yaw), np.sin(self.yaw)
+
+    @cached_property
+    def _radius(self) -> np.ndarray:
+        """外接圆半径，只计算一次。"""
+        return np.hypot(self.size[:, 0], self.size[:, 1]) / 2
+
+    def axes(self) -> np.ndarray:
+        """
+        每个矩形的两条轴（长度方向和宽度方向）的单位向量。
+
+        :return: 形状为 (N, 2, 2) 的数组，``axes[i, 0]`` 为长度方向，``axes[i, 1]`` 为宽度方向。
+        """
+        cos, sin = self._trig
+        return np.stack([cos, sin, -sin, cos], axis=-1).reshape(-1, 2, 2)
+
+    def corners(self) -> np.ndarray:
+        """
+        每个矩形的四个角点，按逆时针顺序排列，从车头左侧开始。
+
+        :return: 形状为 (N, 4, 2) 的数组。
+        """
+        cos, sin = self._trig
+        half_length = self.size[:, 0:1] / 2 * _CORNER_SIGNS[0]  # (N, 4)
+        half_width = self.size[:, 1:2] / 2 * _CORNER_SIGNS[1]
+        corners = np.empty((len(self), 4, 2))
+        corners[:, :, 0] = (
+            self.center[:, 0:1] + half_length * cos[:, None] - half_width * sin[:, None]
+        )
+        corners[:, :, 1] = (
+            self.center[:, 1:2] + half_length * sin[:, None] + half_width * cos[:, None]
+        )
+        return corners
+
+
+# 四个角点在长度方向和宽度方向上的符号，顺序与 OrientedBoxes.corners 一致
+_CORNER_SIGNS = np.array([[1.0, -1.0, -1.0, 1.0], [1.0, 1.0, -1.0, -1.0]])
+
+
+def _pair_projections(
+    trig_a: tuple[np.ndarray, np.ndarray],
+    trig_b: tuple[np.ndarray, np.ndarray],
+    x: np.ndarray,
+    y: np.ndarray,
+) -> np.ndarray:
+    """
+    把 a 与 b 两两之间的向量 (x, y) 投影到四条分离轴（a 的两条轴、b 的两条轴）上。
+
+    :param trig_a: a 的朝向的余弦和正弦，形状为 (Na, 1)。
+    :param trig_b: b 的朝向的余弦和正弦，形状为 (1, Nb)。
+    :return: 形状为 (4, Na, Nb) 的数组。
+    """
+    cos_a, sin_a = trig_a
+    cos_b, sin_b = trig_b
+    return np.stack(
+        [
+            x * cos_a + y * sin_a,
+            y * cos_a - x * sin_a,
+            x * cos_b + y * sin_b,
+            y * cos_b - x * sin_b,
+        ]
+    )
+
+
+def _separating_intervals(a: OrientedBoxes, b: OrientedBoxes):
+    """
+    计算 a 与 b 两两之间在四条分离轴上的投影。
+
+    :return: 元组 (trig_a, trig_b, offset, radius)，offset 和 radius 的形状均为 (4, Na, Nb)，
+        offset 为中心点之差在轴上的投影，radius 为两个矩形投影半长度之和。
+    """
+    cos_a, sin_a = a._trig
+    cos_b, sin_b = b._trig
+    trig_a = cos_a[:, None], sin_a[:, None]
+    trig_b = cos_b[None, :], sin_b[None, :]
+    dx = b.center[None, :, 0] - a.center[:, None, 0]
+    dy = b.center[None, :, 1] - a.center[:, None, 1]
+    offset = _pair_projections(trig_a, trig_b, dx, dy)
+    # 两个矩形轴之间夹角的余弦和正弦的绝对值
+    c = np.abs(trig_a[0] * trig_b[0] + trig_a[1] * trig_b[1])
+    s = np.abs(trig_a[0] * trig_b[1] - trig_a[1] * trig_b[0])
+    la, wa = a.size[:, None, 0] / 2, a.size[:, None, 1] / 2
+    lb, wb = b.size[None, :, 0] / 2, b.size[None, :, 1] / 2
+    radius = np.stack(
+        [
+            la + lb * c + wb * s,
+            wa + lb * s + wb * c,
+            lb + la * c + wa * s,
+            wb + la * s + wa * c,
+        ]
+    )
+    return trig_a, trig_b, offset, radius
+
+
+def intersects(a: OrientedBoxes, b: OrientedBoxes) -> np.ndarray:
+    """
+    使用分离轴定理判断 a 中每个矩形与 b 中每个矩形是否相交。
+
+    :return: 形状为 (Na, Nb) 的布尔数组。
+    """
+    _, _, offset, radius = _separating_intervals(a, b)
+    return np.all(np.abs(offset) <= radius, axis=0)
+
+
+def _corner_to_box_distance(corners: np.ndarray, boxes: OrientedBoxes) -> np.ndarray:
+    """
+    corners 中每组角点到 boxes 中每个矩形的最小距离，点在矩形内时为 0。
+
+    :param corners: 形状为 (Nc, 4, 2) 的角点。
+    :return: 形状为 (Nb, Nc) 的数组。
+    """
+    cos, sin = boxes._trig
+    cos, sin = cos[:, None, None], sin[:, None, None]
+    dx = corners[None, :, :, 0] - boxes.center[:, 0, None, None]  # (Nb, Nc, 4)
+    dy = corners[None, :, :, 1] - boxes.center[:, 1, None, None]
+    # 转换到矩形的局部坐标系后，超出矩形半长度的部分即为到矩形的距离
+    out_x = np.abs(dx * cos + dy * sin) - boxes.size[:, 0, None, None] / 2
+    out_y = np.abs(dy * cos - dx * sin) - boxes.size[:, 1, None, None] / 2
+    np.maximum(out_x, 0.0, out=out_x)
+    np.maximum(out_y, 0.0, out=out_y)
+    return np.sqrt((out_x * out_x + out_y * out_y).min(axis=-1))
+
+
+def min_distance(
+    a: OrientedBoxes, b: OrientedBoxes, max_distance: float | None = None
+) -> np.ndarray:
+    """
+    a 中每个矩形与 b 中每个矩形之间的最小距离，相交时为 0。
+
+    两个不相交的凸多边形之间的最近点对中至少有一个是顶点，
+    因此只需要计算每个矩形的角点到另一个矩形的距离。
+    外接圆之间的距离是最小距离的下界，外接圆距离超过 ``max_distance`` 的矩形不再计算角点距离，
+    外接圆不相交的矩形对不再做分离轴检测。
+
+    :param max_distance: 只关心该距离以内的矩形时指定，超出的距离为 ``inf``，默认计算所有距离。
+    :return: 形状为 (Na, Nb) 的数组。
+    """
+    delta = b.center[None, :, :] - a.center[:, None, :]
+    gap = (
+        np.sqrt(np.einsum("ijk,ijk->ij", delta, delta))
+        - a._radius[:, None]
+        - b._radius[None, :]
+    )
+    if max_distance is None:
+        candidates, boxes = slice(None), b
+    else:
+        candidates = np.flatnonzero((gap <= max_distance).any(axis=0))
+        boxes = b[candidates]
+    a_to_b = _corner_to_box_distance(a.corners(), boxes)  # (Nb, Na)
+    b_to_a = _corner_to_box_distance(boxes.corners(), a)  # (Na, Nb)
+    near = np.minimum(a_to_b.T, b_to_a)
+    # 外接圆不相交的矩形一定不相交
+    overlapping = np.flatnonzero((gap[:, candidates] <= 0).any(axis=0))
+    if len(overlapping):
+        block = near[:, overlapping]
+        block[intersects(a, boxes[overlapping])] = 0.0
+        near[:, overlapping] = block
+    if max_distance is None:
+        return near
+    near[near > max_distance] = np.inf
+    distance = np.full(gap.shape, np.inf)
+    distance[:, candidates] = near
+    return distance
+
+
+def time_to_collision(
+    a: OrientedBoxes, b: OrientedBoxes, horizon: float = 10.0
+) -> np.ndarray:
+    """
+    假设所有矩形保持当前速度匀速直线运动、朝向不变，计算 a 中每个矩形与 b 中每个矩形的碰撞时间。
+
+    对每条分离轴求出两个矩形投影重叠的时间区间，所有区间的交集的起点即为碰撞时间。
+
+    :param horizon: 最长预测时间，单位秒，超过该时间的碰撞视为不会发生。
+    :return: 形状为 (Na, Nb) 的数组，单位秒，已经相交时为 0，不会碰撞时为 ``inf``。
+    """
+    trig_a, trig_b, offset, radius = _separating_intervals(a, b)
+    vx = b.velocity[None, :, 0] - a.velocity[:, None, 0]
+    vy = b.velocity[None, :, 1] - a.velocity[:, None, 1]
+    speed = _pair_projections(trig_a, trig_b, vx, vy)
+    moving = np.abs(speed) > 1e-9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t1 = (-radius - offset) / speed
+        t2 = (radius - offset) / speed
+    overlapping = np.abs(offset) <= radius
+    # 在某条轴上没有相对运动时，重叠区间为全体时间或空集
+    enter = np.where(moving, np.minimum(t1, t2), np.where(overlapping, -np.inf, np.inf))
+    exit_ = np.where(moving, np.maximum(t1, t2), np.where(overlapping, np.inf, -np.inf))
+    enter = enter.max(axis=0)
+    exit_ = exit_.min(axis=0)
+    hit = (enter <= exit_) & (exit_ >= 0) & (enter <= horizon)
+    return np.where(hit, np.maximum(enter, 0.0), np.inf)
@@ -0,0 +1,241 @@
+"""
+在多个工作进程中并行处理摄像头图像。
+
+受 GIL 限制，在主循环所在的进程中运行的感知算法无法与控制逻辑并行。
+:class:`FrameProcessorPool` 把每帧的图像写入共享内存（见 :mod:`metacar.shm`），
+只把几十字节的描述符发送给工作进程，工作进程直接在共享内存的视图上运行用户提供的函数，
+并把结果发回主进程，图像本身不经过 pickle。
+"""
+
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import time
+from multiprocessing import resource_tracker
+from typing import Any, Callable
+from . import metrics
+from .models import CameraFrame
+from .shm import FrameRing, FrameRingReader
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(func: Callable, tasks, results):
+    """工作进程的主函数，逐个处理描述符对应的图像，直到收到 None。"""
+    # 主进程重新分配共享内存后旧的已被释放，映射新的共享内存时解除旧的映射
+    reader = FrameRingReader(shared_tracker=True, single_segment=True)
+    results.put(None)  # 通知主进程已就绪
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            tick, camera_id, slot, descriptor = task
+            try:
+                frame = reader.read(descriptor)
+                payload = pickle.dumps(func(camera_id, frame), pickle.HIGHEST_PROTOCOL)
+                results.put((tick, camera_id, slot, True, payload))
+            except Exception as e:
+                results.put((tick, camera_id, slot, False, f"{type(e).__name__}: {e}"))
+            finally:
+                frame = None
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+class _TickState:
+    """一帧的提交和结果情况。"""
+
+    __slots__ = ("deadline_at", "submitted", "answered", "results")
+
+    def __init__(self, deadline_at: float):
+        self.deadline_at = deadline_at
+        self.submitted = 0
+        self.answered = 0
+        self.results: dict[str, Any] = {}
+
+
+class FrameProcessorPool:
+    """
+    在工作进程中对每个摄像头的图像运行同一个处理函数。
+
+    处理函数的签名为 ``func(camera_id: str, frame: numpy.ndarray) -> Any``，必须可以被 pickle
+    （即定义在模块顶层），返回值会被 pickle 后发回主进程，应尽量小（例如检测框而不是图像）。
+    传入的 ``frame`` 是共享内存的视图，只在函数执行期间有效。
+
+    每帧有一个截止时间：所有槽都在使用中时，提交会等待到截止时间，仍没有空闲的槽则跳过该图像；
+    收集结果时最多等待到截止时间，之后到达的结果会被丢弃。
+    """
+
+    def __init__(
+        self,
+        func: Callable[[str, Any], Any],
+        workers: int | None = None,
+        slots: int = 16,
+        deadline: float = 0.05,
+        start_method: str | None = None,
+        start_timeout: float = 30.0,
+    ):
+        """
+        :param func: 处理函数。
+        :param workers: 工作进程数量，默认为 CPU 核数 - 1。
+        :param slots: 共享内存中的槽数，即最多同时处理的图像数，应不少于 摄像头数 × 2。
+        :param deadline: 每帧从提交到收集结果的最长时间，单位秒。
+        :param start_method: 工作进程的启动方式（``"fork"``、``"spawn"`` 等），默认使用平台的默认方式。
+        :param start_timeout: 等待工作进程启动的最长时间，单位秒。
+        :raises TimeoutError: 当工作进程未能按时启动时抛出。
+        """
+        workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        context = multiprocessing.get_context(start_method)
+        self._deadline = deadline
+        self._slots = slots
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._ring: FrameRing | None = None
+        self._free_slots = list(range(slots))
+        self._ticks: dict[int, _TickState] = {}
+        self._last_tick = 0
+        self._workers = [
+            context.Process(
+                target=_worker_main,
+                args=(func, self._tasks, self._results),
+                name=f"metacar-frame-worker-{idx}",
+                daemon=True,
+            )
+            for idx in range(workers)
+        ]
+        if os.name == "posix":
+            # 工作进程需要与本进程共用 resource_tracker，必须在启动工作进程之前启动它
+            resource_tracker.ensure_running()
+        for worker in self._workers:
+            worker.start()
+        # 等待所有工作进程就绪，避免启动耗时占用第一帧的截止时间
+        try:
+            for _ in self._workers:
+                self._results.get(timeout=start_timeout)
+        except queue.Empty:
+            self.close()
+            raise TimeoutError("图像处理进程启动超时")
+        logger.info(f"已启动 {workers} 个图像处理进程")
+
+    def _drain(self, timeout: float) -> bool:
+        """
+        接收一个处理结果。
+
+        :param timeout: 最长等待时间，单位秒。
+        :return: 是否收到了结果。
+        """
+        try:
+            if timeout > 0:
+                tick, camera_id, slot, ok, payload = self._results.get(timeout=timeout)
+            else:
+                tick, camera_id, slot, ok, payload = self._results.get_nowait()
+        except queue.Empty:
+            return False
+        self._free_slots.append(slot)
+        state = self._ticks.get(tick)
+        if state is None:
+            metrics.PROCESSOR_LATE_RESULTS.inc()
+            return True
+        state.answered += 1
+        if ok:
+            state.results[camera_id] = pickle.loads(payload)
+        else:
+            logger.warning(f"帧 {tick} 摄像头 {camera_id} 处理失败：{payload}")
+        return True
+
+    def _acquire_slot(self, nbytes: int, deadline_at: float) -> int | None:
+        """获取一个空闲的槽，必要时按图像大小重新分配共享内存，超过截止时间时返回 None。"""
+        if self._ring is None or nbytes > self._ring.slot_size:
+            # 需要更大的槽，等待所有图像处理完后重新分配
+            while len(self._free_slots) < self._slots:
+                if not self._drain(deadline_at - time.perf_counter()):
+                    return None
+            if self._ring is not None:
+                self._ring.close()
+            self._ring = FrameRing(nbytes, self._slots)
+        while not self._free_slots:
+            if not self._drain(deadline_at - time.perf_counter()):
+                return None
+        return self._free_slots.pop()
+
+    def submit(self, frames: list[CameraFrame]) -> int:
+        """
+        提交一帧的所有图像，所有槽都在使用中时等待到截止时间，解码失败的图像会被跳过。
+
+        :param frames: 该帧的图像。
+        :return: 帧编号，用于 :meth:`collect`。
+        """
+        self._last_tick += 1
+        tick = self._last_tick
+        state = self._ticks[tick] = _TickState(time.perf_counter() + self._deadline)
+        for camera_frame in frames:
+            if camera_frame.frame is None:
+                metrics.DROPPED_FRAMES.inc(1, ("invalid",))
+                logger.warning(f"帧 {tick} 摄像头 {camera_frame.id} 图像解码失败，跳过")
+                continue
+            slot = self._acquire_slot(camera_frame.frame.nbytes, state.deadline_at)
+            if slot is None:
+                metrics.DROPPED_FRAMES.inc(1, ("busy",))
+                logger.warning(
+                    f"图像处理进程繁忙，跳过帧 {tick} 摄像头 {camera_frame.id}"
+                )
+                continue
+            descriptor = self._ring.write(camera_frame.frame, slot)
+            self._tasks.put((tick, camera_frame.id, slot, descriptor))
+            state.submitted += 1
+        return tick
+
+    def collect(self, tick: int) -> dict[str, Any]:
+        """
+        收集一帧的处理结果，最多等待到该帧的截止时间。
+
+        收集后，该帧及更早的帧之后到达的结果都会被丢弃。
+
+        :param tick: :meth:`submit` 返回的帧编号。
+        :return: 摄像头 ID 到处理结果的映射，未按时完成或处理失败的摄像头不在其中。
+        """
+        state = self._ticks[tick]
+        while state.answered < state.submitted:
+            if not self._drain(state.deadline_at - time.perf_counter()):
+                break
+        for old_tick in [t for t in self._ticks if t <= tick]:
+            del self._ticks[old_tick]
+        metrics.PROCESSOR_WAIT_SECONDS.observe(
+            max(0.0, time.perf_counter() - (state.deadline_at - self._deadline))
+        )
+        return state.results
+
+    def process(self, frames: list[CameraFrame]) -> dict[str, Any]:
+        """
+        提交一帧的所有图像并等待结果，最多等待 ``deadline`` 秒。
+
+        :param frames: 该帧的图像。
+        :return: 摄像头 ID 到处理结果的映射。
+        """
+        return self.collect(self.submit(frames))
+
+    def close(self):
+        """停止所有工作进程并释放共享内存。"""
+        for _ in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+        self._tasks.close()
+        self._results.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,165 @@
+"""
+VLA 场景中区域和建筑物的空间索引。
+
+VLA 场景的 :class:`~metacar.models.VLAExtension` 给出停车区、禁停区、功能区等区域以及建筑物，
+它们都是水平面内带朝向的矩形。生成 :class:`~metacar.models.ParkingResult` 和
+:class:`~metacar.models.FunctionZoneResult` 时，每帧都需要判断主车与哪些区域重叠，
+逐个区域旋转角点的开销与区域数量成正比。:class:`RegionIndex` 在连接场景时把所有区域和建筑物
+转换为 :class:`~metacar.obb.OrientedBoxes`，并预先计算按类型和名称的分组，
+每帧一次调用即可得到主车按类型重叠的区域，以及指定名称中离主车最近的建筑物。
+"""
+
+import numpy as np
+from .models import BuildingInfo, RegionInfo, RegionType, VLAExtension
+from .obb import OrientedBoxes, intersects, min_distance
+
+
+class RegionIndex:
+    """区域和建筑物的索引，非 VLA 场景时为空。"""
+
+    def __init__(self, vla_extension: VLAExtension | None):
+        """
+        :param vla_extension: 场景静态数据中的 VLA 扩展信息。
+        """
+        self._vla_extension = vla_extension
+        regions = vla_extension.regions if vla_extension is not None else []
+        buildings = vla_extension.buildings if vla_extension is not None else []
+        self._regions = list(regions)
+        self._buildings = list(buildings)
+        self._region_boxes = OrientedBoxes.from_regions(self._regions)
+        self._building_boxes = OrientedBoxes.from_buildings(self._buildings)
+        self._region_types = np.array(
+            [region.type.value for region in self._regions], dtype=np.int32
+        )
+        self._region_cos = np.cos(self._region_boxes.yaw)
+        self._region_sin = np.sin(self._region_boxes.yaw)
+        # 外接圆半径，用于在分离轴检测前排除距离较远的区域
+        self._region_radius = np.hypot(*self._region_boxes.size.T) / 2
+        self._region_by_id = {region.id: region for region in self._regions}
+        by_name: dict[str, list[int]] = {}
+        for idx, building in enumerate(self._buildings):
+            by_name.setdefault(building.name, []).append(idx)
+        # 名称 -> (建筑物下标, 对应的有向矩形)
+        self._buildings_by_name = {
+            name: (np.array(indices), self._building_boxes[indices])
+            for name, indices in by_name.items()
+        }
+
+    @property
+    def vla_extension(self) -> VLAExtension | None:
+        """构造时的 VLA 扩展信息。"""
+        return self._vla_extension
+
+    @property
+    def regions(self) -> list[RegionInfo]:
+        """所有区域，顺序与 :attr:`region_boxes` 一致。"""
+        return self._regions
+
+    @property
+    def buildings(self) -> list[BuildingInfo]:
+        """所有建筑物，顺序与 :attr:`building_boxes` 一致。"""
+        return self._buildings
+
+    @property
+    def region_boxes(self) -> OrientedBoxes:
+        """所有区域的有向矩形。"""
+        return self._region_boxes
+
+    @property
+    def building_boxes(self) -> OrientedBoxes:
+        """所有建筑物的有向矩形。"""
+        return self._building_boxes
+
+    def region(self, region_id: str) -> RegionInfo | None:
+        """按 ID 获取区域。"""
+        return self._region_by_id.get(region_id)
+
+    def buildings_named(self, name: str) -> list[BuildingInfo]:
+        """获取指定名称的所有建筑物。"""
+        entry = self._buildings_by_name.get(name)
+        if entry is None:
+            return []
+        return [self._buildings[idx] for idx in entry[0].tolist()]
+
+    def overlap_mask(self, boxes: OrientedBoxes) -> np.ndarray:
+        """
+        判断每个矩形与每个区域是否重叠。
+
+        只对外接圆相交的区域做分离轴检测。
+
+        :param boxes: 一组矩形，例如 :meth:`OrientedBoxes.from_main_vehicle() <metacar.obb.OrientedBoxes.from_main_vehicle>`。
+        :return: 形状为 (len(boxes), 区域数) 的布尔数组。
+        """
+        mask = np.zeros((len(boxes), len(self._regions)), dtype=bool)
+        if not len(boxes) or not self._regions:
+            return mask
+        radius = np.hypot(*boxes.size.T) / 2
+        delta = boxes.center[:, None, :] - self._region_boxes.center[None, :, :]
+        reach = radius[:, None] + self._region_radius[None, :]
+        near = np.einsum("ijk,ijk->ij", delta, delta) <= reach * reach
+        candidates = np.flatnonzero(near.any(axis=0))
+        if len(candidates):
+            mask[:, candidates] = intersects(boxes, self._region_boxes[candidates])
+        return mask
+
+    def overlapping(
+        self, box: OrientedBoxes, region_type: RegionType | None = None
+    ) -> dict[RegionType, list[RegionInfo]]:
+        """
+        获取与矩形重叠的区域，按区域类型分组。
+
+        :param box: 只包含一个矩形的 :class:`~metacar.obb.OrientedBoxes`，通常为主车。
+        :param region_type: 只返回该类型的区域，默认返回所有类型。
+        :return: 区域类型到重叠区域的映射，没有重叠区域的类型不在其中。
+        """
+        mask = self.overlap_mask(box)[0]
+        if region_type is not None:
+            mask &= self._region_types == region_type.value
+        result: dict[RegionType, list[RegionInfo]] = {}
+        for idx in np.flatnonzero(mask).tolist():
+            region = self._regions[idx]
+            result.setdefault(region.type, []).append(region)
+        return result
+
+    def contains(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        判断每个点位于哪些区域内。
+
+        :param x: 点的 X 坐标，形状为 (M,)。
+        :param y: 点的 Y 坐标，形状为 (M,)。
+        :return: 形状为 (M, 区域数) 的布尔数组，点在区域边界上时视为在区域内。
+        """
+        x = np.asarray(x, dtype=np.float64).reshape(-1, 1)
+        y = np.asarray(y, dtype=np.float64).reshape(-1, 1)
+        boxes = self._region_boxes
+        cos, sin = self._region_cos, self._region_sin
+        dx = x - boxes.center[None, :, 0]
+        dy = y - boxes.center[None, :, 1]
+        # 转换到区域的局部坐标系后与半长度比较
+        return (np.abs(dx * cos + dy * sin) <= boxes.size[:, 0] / 2) & (
+            np.abs(dy * cos - dx * sin) <= boxes.size[:, 1] / 2
+        )
+
+    def nearest_building(
+        self, box: OrientedBoxes, name: str | None = None
+    ) -> tuple[BuildingInfo, float] | None:
+        """
+        获取离矩形最近的建筑物。
+
+        :param box: 只包含一个矩形的 :class:`~metacar.obb.OrientedBoxes`，通常为主车。
+        :param name: 只在该名称的建筑物中查找，默认查找所有建筑物。
+        :return: 元组 (建筑物, 矩形之间的最小距离)，没有符合条件的建筑物时返回 None。
+        """
+        if name is None:
+            if not self._buildings:
+                return None
+            indices, boxes = None, self._building_boxes
+        else:
+            entry = self._buildings_by_name.get(name)
+            if entry is None:
+                return None
+            indices, boxes = entry
+        distance = min_distance(box, boxes)[0]
+        nearest = int(np.argmin(distance))
+        building = indices[nearest] if indices is not None else nearest
+        return self._buildings[building], float(distance[nearest])
@@ -0,0 +1,278 @@
+"""
+道路网络的空间索引。
+
+:attr:`SceneStaticData.roads <metacar.models.SceneStaticData.roads>` 中每条车道的中心线是一串 :class:`~metacar.Vector2`，
+判断主车位于哪条道路、哪条车道需要遍历所有车道的所有点。:class:`RoadIndex` 在连接后构造一次，
+把所有车道中心线的线段放入均匀网格，每帧的定位只需要计算主车所在网格中的少量线段，
+并预先计算每条车道的长度和停止线位置。
+
+角度约定与 :mod:`metacar.trajectory` 相同：弧度，逆时针为正。
+"""
+
+import math
+from dataclasses import dataclass
+from enum import Enum
+import numpy as np
+from .models import RoadInfo
+from .trajectory import wrap_angle
+
+
+class Manoeuvre(Enum):
+    """通过路口的方式，对应交通灯的三个方向。"""
+
+    STRAIGHT = "straight"  #: 直行
+    LEFT = "left"  #: 左转
+    RIGHT = "right"  #: 右转
+
+
+@dataclass(frozen=True)
+class LanePosition:
+    """点在车道上的位置。"""
+
+    road_id: str  #: 道路 ID
+    lane_id: str  #: 车道 ID
+    s: float  #: 沿车道中心线的弧长坐标
+    lateral: float  #: 相对车道中心线的横向偏差，在中心线左侧时为正
+    heading: float  #: 车道在该位置的航向
+    lane_index: int  #: 车道在索引中的下标，供其他索引使用
+
+
+class RoadIndex:
+    """
+    车道中心线的网格索引。
+
+    每条线段被放入与其外扩 ``search_radius`` 后的包围盒重叠的所有网格中，
+    因此查询时只需要检查点所在的一个网格。
+    """
+
+    def __init__(
+        self,
+        roads: list[RoadInfo],
+        cell_size: float = 20.0,
+        search_radius: float = 5.0,
+    ):
+        """
+        :param roads: 道路信息，通常为 ``static_data.roads``。
+        :param cell_size: 网格边长，单位米。
+        :param search_radius: 点到车道中心线的最大距离，超过该距离视为不在任何车道上。
+        """
+        self._cell_size = cell_size
+        self._search_radius = search_radius
+        self._roads = {road.id: road for road in roads}
+        self._lane_ids: list[str] = []
+        self._lane_roads: list[str] = []
+        lane_lengths = []
+        stop_s = []
+        columns: list[list[np.ndarray]] = [[] for _ in range(7)]
+        for road in roads:
+            stop_line = np.array([(p.x, p.y) for p in road.stop_line]).reshape(-1, 2)
+            for lane in road.lanes:
+                points = np.array([(p.x, p.y) for p in lane.path_points]).reshape(-1, 2)
+                if len(points) < 2:
+                    continue
+                lane_index = len(self._lane_ids)
+                self._lane_ids.append(lane.id)
+                self._lane_roads.append(road.id)
+                delta = np.diff(points, axis=0)
+                length = np.hypot(delta[:, 0], delta[:, 1])
+                s0 = np.concatenate([[0.0], np.cumsum(length)[:-1]])
+                lane_lengths.append(s0[-1] + length[-1])
+                stop_s.append(_stop_line_s(points, s0, stop_line))
+                for column, values in zip(
+                    columns,
+                    (
+                        points[:-1, 0],
+                        points[:-1, 1],
+                        delta[:, 0],
+                        delta[:, 1],
+                        length,
+                        s0,
+                        np.full(len(delta), lane_index),
+                    ),
+                ):
+                    column.append(values)
+        sx, sy, dx, dy, length, s0, lane = (
+            np.concatenate(column) if column else np.zeros(0) for column in columns
+        )
+        self._sx, self._sy, self._dx, self._dy = sx, sy, dx, dy
+        self._length = length
+        self._inv_length2 = 1.0 / np.maximum(length * length, 1e-18)
+        self._s0 = s0
+        self._segment_lane = lane.astype(np.intp)
+        self._segment_heading = np.arctan2(dy, dx)
+        self._lane_length = np.array(lane_lengths)
+        # 每条车道的线段在数组中是连续的，记录第一条和最后一条线段的下标
+        self._lane_first = np.searchsorted(
+            self._segment_lane, np.arange(len(lane_lengths))
+        )
+        self._lane_last = np.append(self._lane_first[1:], len(lane)) - 1
+        self._lane_stop_s = np.array(stop_s)
+        self._lane_lookup = {
+            (road_id, lane_id): idx
+            for idx, (road_id, lane_id) in enumerate(
+                zip(self._lane_roads, self._lane_ids)
+            )
+        }
+        self._road_length: dict[str, float] = {}
+        for road_id, length in zip(self._lane_roads, lane_lengths):
+            self._road_length[road_id] = max(
+                self._road_length.get(road_id, 0.0), float(length)
+            )
+        self._grid = self._build_grid()
+
+    def _build_grid(self) -> dict[tuple[int, int], np.ndarray]:
+        """把每条线段放入与其外扩后的包围盒重叠的网格中。"""
+        margin = self._search_radius
+        size = self._cell_size
+        ex, ey = self._sx + self._dx, self._sy + self._dy
+        min_x = np.floor((np.minimum(self._sx, ex) - margin) / size).astype(int)
+        max_x = np.floor((np.maximum(self._sx, ex) + margin) / size).astype(int)
+        min_y = np.floor((np.minimum(self._sy, ey) - margin) / size).astype(int)
+        max_y = np.floor((np.maximum(self._sy, ey) + margin) / size).astype(int)
+        cells: dict[tuple[int, int], list[int]] = {}
+        for segment, bounds in enumerate(
+            zip(min_x.tolist(), max_x.tolist(), min_y.tolist(), max_y.tolist())
+        ):
+            x0, x1, y0, y1 = bounds
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    cells.setdefault((cx, cy), []).append(segment)
+        return {cell: np.array(segments) for cell, segments in cells.items()}
+
+    def road(self, road_id: str) -> RoadInfo | None:
+        """按 ID 获取道路信息。"""
+        return self._roads.get(road_id)
+
+    def locate(
+        self, x: float, y: float, yaw: float | None = None
+    ) -> LanePosition | None:
+        """
+        查找点所在的车道。
+
+        :param x: X 坐标。
+        :param y: Y 坐标。
+        :param yaw: 车辆航向，指定时优先选择方向一致（夹角小于 90 度）的车道。
+        :return: 点在最近车道上的位置，距离所有车道中心线都超过 ``search_radius`` 时返回 None。
+        """
+        size = self._cell_size
+        segments = self._grid.get((math.floor(x / size), math.floor(y / size)))
+        if segments is None:
+            return None
+        dx, dy = self._dx[segments], self._dy[segments]
+        rx, ry = x - self._sx[segments], y - self._sy[segments]
+        t = np.clip((rx * dx + ry * dy) * self._inv_length2[segments], 0.0, 1.0)
+        ex, ey = rx - t * dx, ry - t * dy
+        dist2 = ex * ex + ey * ey
+        if yaw is not None:
+            # 方向相反的车道排在所有方向一致的车道之后
+            opposite = np.cos(self._segment_heading[segments] - yaw) < 0
+            dist2 = dist2 + opposite * (4 * self._search_radius**2)
+        best = int(dist2.argmin())
+        distance = math.hypot(ex[best], ey[best])
+        if distance > self._search_radius:
+            return None
+        segment = int(segments[best])
+        lane_index = int(self._segment_lane[segment])
+        cross = dx[best] * ry[best] - dy[best] * rx[best]
+        return LanePosition(
+            road_id=self._lane_roads[lane_index],
+            lane_id=self._lane_ids[lane_index],
+            s=float(self._s0[segment] + t[best] * self._length[segment]),
+            lateral=math.copysign(distance, cross),
+            heading=float(self._segment_heading[segment]),
+            lane_index=lane_index,
+        )
+
+    def lane_index(self, road_id: str, lane_id: str) -> int | None:
+        """获取车道在索引中的下标，车道不存在时返回 None。"""
+        return self._lane_lookup.get((road_id, lane_id))
+
+    def lane_length(self, position: LanePosition) -> float:
+        """车道中心线的长度。"""
+        return float(self._lane_length[position.lane_index])
+
+    def road_length(self, road_id: str) -> float:
+        """道路的长度，取其中最长车道的中心线长度，道路不存在时为 0。"""
+        return self._road_length.get(road_id, 0.0)
+
+    def stop_line_distance(self, position: LanePosition) -> float | None:
+        """
+        沿车道中心线到所在道路停止线的距离。
+
+        :param position: :meth:`locate` 的结果。
+        :return: 距离，已越过停止线时为负数，道路没有停止线时返回 None。
+        """
+        stop_s = self._lane_stop_s[position.lane_index]
+        if math.isnan(stop_s):
+            return None
+        return float(stop_s - position.s)
+
+    def _road_heading(self, road_id: str, at_end: bool) -> float | None:
+        """道路第一条车道在起点或终点处的航向。"""
+        road = self._roads.get(road_id)
+        if road is None:
+            return None
+        for lane in road.lanes:
+            idx = self._lane_lookup.get((road_id, lane.id))
+            if idx is None:
+                continue
+            segment = self._lane_last[idx] if at_end else self._lane_first[idx]
+            return float(self._segment_heading[segment])
+        return None
+
+    def turn(
+        self, from_road_id: str, to_road_id: str, threshold: float = math.radians(30)
+    ) -> Manoeuvre:
+        """
+        根据两条道路的航向判断从一条道路驶入另一条道路的方式。
+
+        :param from_road_id: 驶出的道路 ID。
+        :param to_road_id: 驶入的道路 ID。
+        :param threshold: 航向变化超过该角度时视为转弯。
+        :return: 通过路口的方式，道路不存在时视为直行。
+        """
+        start = self._road_heading(from_road_id, at_end=True)
+        end = self._road_heading(to_road_id, at_end=False)
+        if start is None or end is None:
+            return Manoeuvre.STRAIGHT
+        change = float(wrap_angle(end - start))
+        if change > threshold:
+            return Manoeuvre.LEFT
+        if change < -threshold:
+            return Manoeuvre.RIGHT
+        return Manoeuvre.STRAIGHT
+
+
+def _stop_line_s(points: np.ndarray, s0: np.ndarray, stop_line: np.ndarray) -> float:
+    """
+    计算车道中心线与停止线交点的弧长坐标。
+
+    中心线与停止线不相交时，取停止线上离中心线最近的点在中心线上的投影；没有停止线时返回 nan。
+    """
+    if len(stop_line) == 0:
+        return math.nan
+    start, delta = points[:-1], np.diff(points, axis=0)
+    if len(stop_line) >= 2:
+        for a, b in zip(stop_line[:-1], stop_line[1:]):
+            edge = b - a
+            denom = delta[:, 0] * edge[1] - delta[:, 1] * edge[0]
+            offset = a - start
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = (offset[:, 0] * edge[1] - offset[:, 1] * edge[0]) / denom
+                u = (offset[:, 0] * delta[:, 1] - offset[:, 1] * delta[:, 0]) / denom
+            hit = np.flatnonzero((t >= 0) & (t <= 1) & (u >= 0) & (u <= 1))
+            if len(hit):
+                idx = hit[0]
+                return float(s0[idx] + t[idx] * np.hypot(*delta[idx]))
+    # 不相交时取停止线上的点到中心线的最近投影
+    length2 = np.maximum(np.einsum("ij,ij->i", delta, delta), 1e-18)
+    best_s, best_dist = math.nan, math.inf
+    for point in stop_line:
+        rel = point - start
+        t = np.clip(np.einsum("ij,ij->i", rel, delta) / length2, 0.0, 1.0)
+        dist = np.hypot(*(rel - t[:, None] * delta).T)
+        idx = int(dist.argmin())
+        if dist[idx] < best_dist:
+            best_dist = dist[idx]
+            best_s = float(s0[idx] + t[idx] * math.sqrt(length2[idx]))
+    return best_s
@@ -1,17 +1,36 @@
 import logging
+import threading
+import time
 from pathlib import Path
 from pydantic import TypeAdapter, Field
 from typing import Annotated
-from .sockets import ModelSocket, StreamingSocket, ConnectionClosedError
+from .sockets import ModelSocket, StreamingSocket
+from .sync import FrameSynchronizer
+from .compression import Codec, available_codecs
+from .batch import FrameBatcher
+from .calibration import CalibrationCache, CameraCalibration
+from .trajectory import Trajectory, TrajectoryCache
+from .roads import RoadIndex
+from .lights import TrafficLightIndex
+from .signs import SignLayer
+from .regions import RegionIndex
+from .tracking import ObstacleTracker
+from .processing import FrameProcessorPool
+from .shm import is_descriptor
 from .geometry import Vector3
+from . import metrics, wire
 from .models import (
     CameraFrame,
+    CameraFrames,
+    SimCarMsg,
     SimCarMsgOutput,
     VehicleControl,
     VehicleControlDTO,
     RoadInfo,
     SceneStaticData,
+    MapConfig,
     VLAExtensionOutput,
+    ProtocolFeature,
     Code1,
     Code2,
     Code3,
@@ -22,6 +41,181 @@ from .models import (
 logger = logging.getLogger(__name__)
 
 
+def read_map_files(map_info: MapConfig) -> tuple[list[Vector3], list[RoadInfo]]:
+    """读取并解析地图配置中的路线文件和地图文件。
+
+    :param map_info: code1 中的地图配置
+    :return: 元组 (路线, 道路信息)
+    """
+    dir_path = Path(map_info.path)
+    route_path = dir_path / map_info.route
+    with route_path.open("rb") as route_file:
+        route = TypeAdapter(list[Vector3]).validate_json(route_file.read())
+    map_path = dir_path / map_info.map
+    with map_path.open("rb") as map_file:
+        road_lines = TypeAdapter(list[RoadInfo]).validate_json(map_file.read())
+    return route, road_lines
+
+
+def make_code4(
+    vc: VehicleControl,
+    vla_extension: VLAExtensionOutput | None,
+    move_to_start: int,
+    move_to_end: int,
+) -> Code4:
+    """组装发送给场景的 code4 消息。
+
+    :param vc: 车辆控制命令
+    :param vla_extension: VLA 相关的输出，非 VLA 场景为 None
+    :param move_to_start: 重试关卡计数
+    :param move_to_end: 跳过关卡计数
+    """
+    vc_dto = VehicleControlDTO(
+        **vc.model_dump(),
+        move_to_start=move_to_start,
+        move_to_end=move_to_end,
+    )
+    sim_car_msg = SimCarMsgOutput(vehicle_control=vc_dto, vla_extension=vla_extension)
+    return Code4(code=4, sim_car_msg=sim_car_msg)
+
+
+def negotiate_features(
+    server_features: list[str],
+    binary_state: bool = False,
+    strict_sync: bool = False,
+    shared_memory: bool = False,
+    compression: str | None = None,
+) -> list[str]:
+    """
+    根据场景在 code1 中声明的特性，选择需要启用的协议特性。
+
+    :param server_features: 场景声明支持的特性。
+    :param binary_state: 是否希望使用二进制格式。
+    :param strict_sync: 是否希望按帧序号对齐图像。
+    :param shared_memory: 是否希望通过共享内存传输图像。
+    :param compression: 希望使用的压缩算法名称。
+    :return: 写入 code2 的特性列表。
+    """
+    features = []
+    if binary_state:
+        if ProtocolFeature.BINARY_STATE in server_features:
+            features.append(ProtocolFeature.BINARY_STATE.value)
+        else:
+            logger.warning("场景不支持二进制格式，使用 JSON")
+    if strict_sync:
+        if ProtocolFeature.FRAME_SEQ in server_features:
+            features.append(ProtocolFeature.FRAME_SEQ.value)
+        else:
+            logger.warning("场景不支持帧序号，strict_sync 不生效")
+    if shared_memory:
+        if ProtocolFeature.SHARED_MEMORY_FRAMES in server_features:
+            features.append(ProtocolFeature.SHARED_MEMORY_FRAMES.value)
+        else:
+            logger.warning("场景不支持共享内存，图像通过视频流传输")
+    if compression is not None:
+        codec = available_codecs()[compression]
+        if codec.feature in server_features:
+            features.append(codec.feature.value)
+        else:
+            logger.warning(f"场景不支持 {compression} 压缩，不压缩消息")
+    return features
+
+
+def enabled_codec(features: list[str]) -> Codec | None:
+    """获取 code2 中启用的压缩算法，未启用压缩时返回 None。"""
+    return next(
+        (codec for codec in available_codecs().values() if codec.feature in features),
+        None,
+    )
+
+
+def _release_frames(frames: list[CameraFrame]):
+    """释放一帧中所有图像及批量张量对缓冲池的引用。"""
+    for frame in frames:
+        frame.release()
+    batch = getattr(frames, "batch", None)
+    if batch is not None:
+        batch.release()
+
+
+class _LatestTickReader:
+    """在后台线程中持续接收仿真帧，只保留最新的一帧。"""
+
+    def __init__(self, recv_tick):
+        """
+        :param recv_tick: 接收一帧的函数，返回 None 表示场景结束。
+        """
+        self._recv_tick = recv_tick
+        self._cond = threading.Condition()
+        self._latest = None
+        self._skipped = 0
+        self._finished = False
+        self._error: BaseException | None = None
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="metacar-latest-tick", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                tick = self._recv_tick()
+                with self._cond:
+                    if tick is None:
+                        break
+                    if self._latest is not None:
+                        # 上一帧还没被取走，直接丢弃
+                        self._skipped += 1
+                        metrics.DROPPED_FRAMES.inc(len(self._latest[1]), ("stale",))
+                        _release_frames(self._latest[1])
+                    self._latest = tick
+                    self._cond.notify()
+        except Exception as e:
+            with self._cond:
+                # 主动停止时关闭 socket 引起的异常不需要上报
+                if not self._stopped:
+                    self._error = e
+        finally:
+            with self._cond:
+                self._finished = True
+                self._cond.notify()
+
+    def take(self) -> tuple[tuple[SimCarMsg, list[CameraFrame]] | None, int]:
+        """阻塞直到有新的一帧。
+
+        :return: 元组 (tick, skipped)，tick 为 None 表示场景结束，场景结束前的最后一帧仍会先返回，
+            skipped 为自上次调用以来丢弃的帧数。
+        :raises ConnectionClosedError: 当连接已关闭时抛出。
+        """
+        with self._cond:
+            while self._latest is None and not self._finished:
+                self._cond.wait()
+            tick, self._latest = self._latest, None
+            if tick is not None and self._error is not None:
+                # 连接已中断，无法再为这一帧发送控制命令，计入丢弃的帧数
+                self._skipped += 1
+                metrics.DROPPED_FRAMES.inc(len(tick[1]), ("stale",))
+                _release_frames(tick[1])
+                tick = None
+            skipped, self._skipped = self._skipped, 0
+            if tick is not None:
+                # 场景正常结束前收到的最后一帧照常返回，下一次调用时再报告结束
+                return tick, skipped
+            if self._error is not None:
+                raise self._error
+            return None, skipped
+
+    def stop(self):
+        """标记为主动停止，之后由调用方关闭 socket 使后台线程退出。"""
+        with self._cond:
+            self._stopped = True
+
+    def join(self):
+        """等待后台线程退出。"""
+        self._thread.join()
+
+
 class SceneAPI:
     """SceneAPI 是与仿真环境通信的主要接口。
 
@@ -29,14 +223,61 @@ class SceneAPI:
     使用流程通常是：创建实例 -> 连接 -> 获取静态数据 -> 进入主循环获取动态数据并发送控制命令。
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        binary_state: bool = False,
+        compression: str | None = None,
+        compress_threshold: int = 1024,
+        shared_memory: bool = False,
+        frame_batcher: FrameBatcher | None = None,
+        host: str = "127.0.0.1",
+        model_port: int = 5061,
+        streaming_port: int = 5063,
+    ):
         """初始化 SceneAPI 实例，但不会立即连接。
         需要调用 connect() 方法与仿真环境建立连接。
+
+        :param binary_state: 场景支持时，是否使用紧凑的二进制格式收发 code3/code4（见 :mod:`metacar.wire`），
+            可以大幅降低障碍物和轨迹较多时的解析开销，场景不支持时回退为 JSON。
+        :param compression: 场景支持时，JSON 通道上使用的压缩算法（``"zlib"`` 或 ``"lz4"``），
+            适用于场景运行在远程主机、带宽受限的情况，见 :mod:`metacar.compression`。
+        :param compress_threshold: 只压缩不小于该字节数的消息。
+        :param shared_memory: 场景与 API 运行在同一台机器上且场景支持时，是否通过共享内存传输图像，
+            图像以共享内存视图的形式返回，省去编解码和复制，见 :mod:`metacar.shm`。
+        :param frame_batcher: 指定时，每帧所有摄像头的图像解码到同一个批量张量中，
+            通过 ``frames.batch`` 获取，见 :mod:`metacar.batch`。
+        :param host: 监听的 IP 地址。
+        :param model_port: JSON 消息端口，同一台机器上运行多个实例时各自使用不同的端口。
+        :param streaming_port: 视频流端口。
+        :raises ValueError: 当压缩算法不支持或未安装时抛出。
         """
+        if compression is not None and compression not in available_codecs():
+            raise ValueError(f"不支持的压缩算法：{compression}")
+        self._binary_state = binary_state
+        self._compression = compression
+        self._compress_threshold = compress_threshold
+        self._shared_memory = shared_memory
+        self._frame_batcher = frame_batcher
+        self._calibrations = CalibrationCache()
+        self._trajectory_cache = TrajectoryCache()
+        self._road_index: RoadIndex | None = None
+        self._traffic_lights: TrafficLightIndex | None = None
+        self._signs: SignLayer | None = None
+        self._tracker: ObstacleTracker | None = None
+        self._region_index: RegionIndex | None = None
+        self._enabled_features: list[str] = []
         self._move_to_start = 0
         self._move_to_end = 0
-        self._model_socket = ModelSocket("127.0.0.1", 5061)
-        self._streaming_socket = StreamingSocket("127.0.0.1", 5063)
+        self._skipped_ticks = 0
+        self._server_features: list[str] = []
+        self._synchronizer: FrameSynchronizer | None = None
+        self._tick_reader: _LatestTickReader | None = None
+        self._desync_ticks = 0
+        self._reconnects = 0
+        self._resilient = False
+        self._static_key: tuple[str, str, str] | None = None
+        self._model_socket = ModelSocket(host, model_port)
+        self._streaming_socket = StreamingSocket(host, streaming_port)
 
     def _load_static_data(self, code1: Code1):
         """读取文件内容，组装场景静态信息。
@@ -46,19 +287,26 @@ class SceneAPI:
         :param code1: 场景发送的 code1 消息
         """
         map_info = code1.map_info
-        dir_path = Path(map_info.path)
-        route_path = dir_path / map_info.route
-        with route_path.open("rb") as route_file:
-            route = TypeAdapter(list[Vector3]).validate_json(route_file.read())
-        map_path = dir_path / map_info.map
-        with map_path.open("rb") as map_file:
-            road_lines = TypeAdapter(list[RoadInfo]).validate_json(map_file.read())
+        static_key = (map_info.path, map_info.route, map_info.map)
+        if static_key == self._static_key:
+            # 重连后地图没有变化，直接复用已解析的路线和道路
+            logger.info("地图未变化，复用已加载的静态数据")
+            route = self._scene_static_data.route
+            road_lines = self._scene_static_data.roads
+        else:
+            route, road_lines = read_map_files(map_info)
+            self._static_key = static_key
+            self._road_index = None
         self._scene_static_data = SceneStaticData(
             route=route,
             roads=road_lines,
             sub_scenes=map_info.sub_scenes,
             vla_extension=code1.vla_extension,
         )
+        region_index = self._region_index
+        if region_index is None or region_index.vla_extension != code1.vla_extension:
+            # 区域和建筑物随 code1 下发，重连后没有变化时继续复用
+            self._region_index = RegionIndex(code1.vla_extension)
 
     def connect(self):
         """与场景建立连接，会产生阻塞，直到与场景连接成功。
@@ -69,8 +317,96 @@ class SceneAPI:
         self._model_socket.accept()  # 连接 json socket
         self._streaming_socket.accept()  # 连接视频流
         code1: Code1 = self._model_socket.recv(Code1)
+        if code1.session_token is not None:
+            # 视频流连接的第一条消息是会话令牌，不是图像
+            token = bytes(self._streaming_socket.recv_raw()).decode("utf-8")
+            if token != code1.session_token:
+                raise ValueError(f"视频流连接的会话令牌 {token!r} 与 code1 不一致")
+        self._server_features = code1.features
         self._load_static_data(code1)
 
+    def camera_calibrations(
+        self, sim_car_msg: SimCarMsg
+    ) -> dict[str, CameraCalibration]:
+        """获取主车摄像头换算好的标定参数，摄像头信息没有变化时直接返回缓存。
+
+        :param sim_car_msg: 当前帧的仿真数据。
+        :return: 摄像头 ID 到 :class:`~metacar.calibration.CameraCalibration` 的映射。
+        """
+        return self._calibrations.update(sim_car_msg.sensor.ego_rgb_cams)
+
+    def trajectory(self, sim_car_msg: SimCarMsg) -> Trajectory:
+        """获取推荐轨迹的数组形式，轨迹没有变化或只是起点前移时复用上一帧的计算结果。
+
+        跨帧使用 :meth:`Trajectory.nearest() <metacar.trajectory.Trajectory.nearest>` 的 ``hint`` 时，
+        应减去 :meth:`trajectory_shift` 的返回值。
+
+        :param sim_car_msg: 当前帧的仿真数据。
+        :return: 推荐轨迹。
+        :raises ValueError: 当轨迹为空时抛出。
+        """
+        return self._trajectory_cache.update(sim_car_msg)
+
+    def trajectory_shift(self) -> int | None:
+        """获取上一次调用 :meth:`trajectory` 时轨迹起点前移的点数，重新构造时为 None。"""
+        return self._trajectory_cache.shift
+
+    def road_index(self) -> RoadIndex:
+        """获取道路网络的空间索引，仅在 connect() 函数调用后可用。
+
+        首次调用时构造，重连后地图没有变化时继续复用。
+
+        :return: 道路索引。
+        """
+        if self._road_index is None:
+            self._road_index = RoadIndex(self._scene_static_data.roads)
+        return self._road_index
+
+    def region_index(self) -> RegionIndex:
+        """获取 VLA 场景中区域和建筑物的空间索引，仅在 connect() 函数调用后可用。
+
+        在连接时构造，重连后区域和建筑物没有变化时继续复用，非 VLA 场景时为空。
+
+        :return: 区域索引，见 :mod:`metacar.regions`。
+        """
+        return self._region_index
+
+    def traffic_lights(self, sim_car_msg: SimCarMsg) -> TrafficLightIndex:
+        """获取按道路索引的交通灯，并用当前帧的状态更新。
+
+        :param sim_car_msg: 当前帧的仿真数据。
+        :return: 交通灯索引，见 :mod:`metacar.lights`。
+        """
+        road_index = self.road_index()
+        lights = self._traffic_lights
+        if lights is None or lights.road_index is not road_index:
+            lights = self._traffic_lights = TrafficLightIndex(road_index)
+        return lights.update(sim_car_msg.traffic_light_groups)
+
+    def traffic_signs(self, sim_car_msg: SimCarMsg) -> SignLayer:
+        """获取交通标志图层，并用当前帧的障碍物更新，已解析过的标志不会重复解析。
+
+        :param sim_car_msg: 当前帧的仿真数据。
+        :return: 交通标志图层，见 :mod:`metacar.signs`。
+        """
+        road_index = self.road_index()
+        signs = self._signs
+        if signs is None or signs.road_index is not road_index:
+            signs = self._signs = SignLayer(road_index)
+        return signs.update(sim_car_msg)
+
+    def obstacle_tracker(self, sim_car_msg: SimCarMsg) -> ObstacleTracker:
+        """获取按障碍物 ID 跟踪的时序状态，并用当前帧的障碍物更新。
+
+        同一帧多次调用只更新一次，关卡重新开始（已用时间倒退）时自动清空。
+
+        :param sim_car_msg: 当前帧的仿真数据。
+        :return: 障碍物跟踪器，见 :mod:`metacar.tracking`。
+        """
+        if self._tracker is None:
+            self._tracker = ObstacleTracker()
+        return self._tracker.update(sim_car_msg)
+
     def get_scene_static_data(self):
         """获取场景静态信息，仅在 connect() 函数调用后可用
 
@@ -81,38 +417,218 @@ class SceneAPI:
         """
         return self._scene_static_data
 
-    def main_loop(self):
+    def _recv_tick(self) -> tuple[SimCarMsg, list[CameraFrame]] | None:
+        """接收一帧仿真数据及其对应的所有摄像头图像。
+
+        :return: 元组 (sim_car_msg, frames)，场景结束时返回 None。
+        :raises ConnectionClosedError: 当连接已关闭时抛出。
+        """
+        raw_message = self._model_socket.recv_bytes()
+        if wire.is_binary(raw_message):
+            start_time = time.perf_counter()
+            message = wire.decode_code3(raw_message)
+            metrics.DECODE_SECONDS.observe(time.perf_counter() - start_time, ("state",))
+        else:
+            message_type = Annotated[Code3 | Code5, Field(discriminator="code")]
+            stripped_message, stripped = self._trajectory_cache.strip_json(raw_message)
+            message = self._model_socket.decode(stripped_message, message_type)
+            if isinstance(message, Code3) and not self._trajectory_cache.restore(
+                message.sim_car_msg, stripped
+            ):
+                message = self._model_socket.decode(raw_message, message_type)
+        if isinstance(message, Code5):
+            return None
+        sim_car_msg = message.sim_car_msg
+        camera_infos = sim_car_msg.sensor.ego_rgb_cams
+        if self._synchronizer is None:
+            raw_images = [self._streaming_socket.recv_raw() for _ in camera_infos]
+        else:
+            camera_ids = [camera_info.id for camera_info in camera_infos]
+            collected = self._synchronizer.collect(message.seq or 0, camera_ids)
+            camera_infos = [info for info in camera_infos if info.id in collected]
+            raw_images = [collected[camera_info.id] for camera_info in camera_infos]
+        if self._frame_batcher is not None:
+            frames = self._frame_batcher.assemble(
+                camera_infos, raw_images, self._streaming_socket.decode_frame
+            )
+        else:
+            frames = CameraFrames(
+                CameraFrame(
+                    id=camera_info.id,
+                    frame=self._streaming_socket.decode_frame(raw_image),
+                    raw=None if is_descriptor(raw_image) else raw_image,
+                )
+                for camera_info, raw_image in zip(camera_infos, raw_images)
+            )
+        return sim_car_msg, frames
+
+    def _lockstep_ticks(self):
+        """逐帧按顺序接收，不丢弃任何一帧。"""
+        while True:
+            tick = self._recv_tick()
+            if tick is None:
+                return
+            yield tick
+
+    def _latest_ticks(self):
+        """由后台线程持续接收，每次只取最新的一帧，来不及处理的帧会被丢弃。"""
+        reader = self._tick_reader = _LatestTickReader(self._recv_tick)
+        try:
+            while True:
+                tick, skipped = reader.take()
+                self._skipped_ticks += skipped
+                if tick is None:
+                    return
+                yield tick
+        finally:
+            reader.stop()
+
+    @property
+    def skipped_ticks(self) -> int:
+        """当前场景中因处理不及时而被丢弃的帧数，仅在 ``latest_only`` 模式下会增加。"""
+        return self._skipped_ticks
+
+    @property
+    def desync_ticks(self) -> int:
+        """当前场景中图像与状态消息错位的帧数，仅在 ``strict_sync`` 模式下统计。"""
+        if self._synchronizer is None:
+            return self._desync_ticks
+        return self._desync_ticks + self._synchronizer.desync_count
+
+    @property
+    def reconnects(self) -> int:
+        """当前场景中自动重连的次数，仅在 ``reconnect`` 模式下会增加。"""
+        return self._reconnects
+
+    def _start_session(self, strict_sync: bool):
+        """协商协议特性并发送 code2，告知场景已经就绪。"""
+        features = negotiate_features(
+            self._server_features,
+            binary_state=self._binary_state,
+            strict_sync=strict_sync,
+            shared_memory=self._shared_memory,
+            compression=self._compression,
+        )
+        self._model_socket.send(Code2(code=2, features=features), Code2)
+        self._enabled_features = features
+        # 场景收到 code2 后才会识别压缩消息，因此在发送 code2 之后再启用
+        self._model_socket.set_compression(
+            enabled_codec(features), self._compress_threshold
+        )
+        if ProtocolFeature.FRAME_SEQ in features:
+            self._synchronizer = FrameSynchronizer(self._streaming_socket)
+
+    def _disconnect(self):
+        """断开与场景的连接并等待后台线程退出，但保持监听。"""
+        if self._tick_reader is not None:
+            self._tick_reader.stop()
+        self._model_socket.disconnect()
+        self._streaming_socket.disconnect()
+        if self._tick_reader is not None:
+            self._tick_reader.join()
+            self._tick_reader = None
+        if self._synchronizer is not None:
+            self._synchronizer.join()
+            self._desync_ticks += self._synchronizer.desync_count
+            self._synchronizer = None
+
+    def _reconnect(self, strict_sync: bool, max_backoff: float):
+        """等待场景重新连接并完成握手，握手失败时按指数退避重试。"""
+        backoff = 0.5
+        while True:
+            self._disconnect()
+            try:
+                self.connect()
+                self._start_session(strict_sync)
+            except (ConnectionError, ValueError) as e:
+                logger.warning(f"重连失败：{e}，{backoff:.1f} 秒后重试")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, max_backoff)
+                continue
+            self._reconnects += 1
+            metrics.RECONNECTS.inc()
+            logger.info("已重新连接场景")
+            return
+
+    def main_loop(
+        self,
+        latest_only: bool = False,
+        strict_sync: bool = False,
+        reconnect: bool = False,
+        max_backoff: float = 5.0,
+        processor: FrameProcessorPool | None = None,
+    ):
         """生成器，每次迭代返回 :class:`~metacar.models.SimCarMsg` 和图像帧，场景结束时退出。
 
         此方法是一个生成器，每次迭代会返回当前的仿真车辆消息和摄像头图像帧。
         当场景结束或连接中断时，生成器会自动退出。
 
-        :return: 元组 (sim_car_msg, frames)，其中:
+        默认情况下会按顺序处理每一帧。如果算法偶尔比仿真慢，延迟会不断累积，
+        此时可以开启 ``latest_only``：后台线程会持续从两个 socket 读取数据，
+        每次迭代只返回最新的完整一帧，跳过的帧数可通过 :attr:`skipped_ticks` 获取。
+
+        开启 ``strict_sync`` 后，如果场景支持帧序号，图像会按帧序号和摄像头 ID 与状态消息对齐，
+        并在后台线程中与状态消息并行接收。缺帧或摄像头列表变化时只丢弃错位的数据并继续，
+        此时 frames 中只包含已对齐的摄像头，错位次数可通过 :attr:`desync_ticks` 获取。
+
+        开启 ``reconnect`` 后，连接中断时不会退出，而是保持监听并等待场景重新连接，
+        重新握手后继续迭代。如果新的 code1 使用同一张地图，会直接复用已加载的静态数据，
+        否则重新加载，可再次调用 :meth:`get_scene_static_data` 获取。重连次数可通过 :attr:`reconnects` 获取。
+
+        :param latest_only: 是否只处理最新的一帧，丢弃来不及处理的旧帧。
+        :param strict_sync: 是否按帧序号严格对齐图像与状态消息，场景不支持时回退为默认行为。
+        :param reconnect: 连接中断时是否等待场景重新连接。
+        :param max_backoff: 重连握手失败时的最长重试间隔，单位秒。
+        :param processor: 图像处理进程池，每帧的图像会提交给它在工作进程中并行处理，见 :mod:`metacar.processing`。
+            处理与调用方的控制逻辑同时进行，每次迭代返回的是上一帧的处理结果。
+        :return: 元组 (sim_car_msg, frames)，指定 ``processor`` 时为 (sim_car_msg, frames, results)，其中:
 
             - sim_car_msg: :class:`~metacar.models.SimCarMsg` 对象，包含车辆状态、传感器数据等信息
             - frames: 当前相机视图的列表，每个元素为 :class:`~metacar.models.CameraFrame` 对象
+            - results: 上一帧摄像头 ID 到处理结果的映射，第一帧为空，未在截止时间内完成的摄像头不在其中
         """
-        # 先发送 code2，告知场景已经就绪
-        self._model_socket.send(Code2(code=2), Code2)
-        # 进入主循环，持续从场景接收消息
+        self._skipped_ticks = 0
+        self._desync_ticks = 0
+        self._reconnects = 0
+        self._resilient = reconnect
         try:
+            self._start_session(strict_sync)
+            # 进入主循环，持续从场景接收消息
             while True:
-                message: Code3 | Code5 = self._model_socket.recv(
-                    Annotated[Code3 | Code5, Field(discriminator="code")]
-                )
-                if isinstance(message, Code5):
+                ticks = self._latest_ticks() if latest_only else self._lockstep_ticks()
+                previous_tick = None
+                try:
+                    for sim_car_msg, frames in ticks:
+                        metrics.TICKS.inc()
+                        try:
+                            if processor is None:
+                                yield sim_car_msg, frames
+                            else:
+                                # 先提交本帧再收集上一帧的结果，上一帧在调用方运行控制逻辑期间已经在处理
+                                tick = processor.submit(frames)
+                                results = (
+                                    {}
+                                    if previous_tick is None
+                                    else processor.collect(previous_tick)
+                                )
+                                previous_tick = tick
+                                yield sim_car_msg, frames, results
+                        finally:
+                            # 图像只在当前帧内有效，需要跨帧持有时由调用方 retain
+                            _release_frames(frames)
                     logger.info("场景结束")
                     return
-                sim_car_msg = message.sim_car_msg
-                frames = [
-                    CameraFrame(id=camera_info.id, frame=self._streaming_socket.recv())
-                    for camera_info in sim_car_msg.sensor.ego_rgb_cams
-                ]
-                yield sim_car_msg, frames
-        except ConnectionClosedError:
-            logger.warning("连接中断，退出场景")
-            return
+                except ConnectionError:
+                    if not reconnect:
+                        logger.warning("连接中断，退出场景")
+                        return
+                    logger.warning("连接中断，等待场景重新连接")
+                finally:
+                    ticks.close()
+                self._reconnect(strict_sync, max_backoff)
         finally:
+            self._resilient = False
+            self._disconnect()
             self._model_socket.close()
             self._streaming_socket.close()
 
@@ -126,15 +642,32 @@ class SceneAPI:
         :param vc: 车辆控制命令，包含油门、刹车、转向等参数
         :param vla_extension: VLA 相关的输出，非 VLA 场景为 None
         """
-        vc_dto = VehicleControlDTO(
-            **vc.model_dump(),
-            move_to_start=self._move_to_start,
-            move_to_end=self._move_to_end,
-        )
-        sim_car_msg = SimCarMsgOutput(
-            vehicle_control=vc_dto, vla_extension=vla_extension
-        )
-        self._model_socket.send(Code4(code=4, sim_car_msg=sim_car_msg), Code4)
+        code4 = make_code4(vc, vla_extension, self._move_to_start, self._move_to_end)
+        start_time = time.perf_counter()
+        try:
+            if ProtocolFeature.BINARY_STATE in self._enabled_features:
+                self._model_socket.send_bytes(wire.encode_code4(code4))
+            else:
+                self._model_socket.send(code4, Code4)
+        except ConnectionError as e:
+            if not self._resilient:
+                raise
+            # 自动重连模式下由主循环处理连接中断
+            logger.warning(f"发送控制命令失败：{e}")
+            return
+        metrics.CONTROL_SEND_SECONDS.observe(time.perf_counter() - start_time)
+
+    def start_metrics_server(self, port: int, host: str = "127.0.0.1"):
+        """在后台线程中启动 Prometheus/OpenMetrics 指标导出服务。
+
+        导出的指标包括已处理的帧数、各通道收发字节数、解码耗时、控制命令发送耗时、
+        丢帧数、重连次数以及重试/跳过关卡次数，详见 :mod:`metacar.metrics`。
+
+        :param port: 监听的端口号。
+        :param host: 绑定的 IP 地址，默认只监听本机。
+        :return: 导出服务，调用其 close() 方法停止。
+        """
+        return metrics.start_http_server(port, host)
 
     def retry_level(self):
         """重试关卡
@@ -142,6 +675,7 @@ class SceneAPI:
         增加重试关卡计数器，在下一次发送控制命令时会通知场景重试当前关卡。
         """
         self._move_to_start += 1
+        metrics.LEVEL_RETRIES.inc()
         logger.info("重试关卡")
 
     def skip_level(self):
@@ -150,4 +684,5 @@ class SceneAPI:
         增加跳过关卡计数器，在下一次发送控制命令时会通知场景跳过当前关卡。
         """
         self._move_to_end += 1
+        metrics.LEVEL_SKIPS.inc()
         logger.info("跳过关卡")
@@ -0,0 +1,629 @@
+"""
+在一个进程中同时服务多个仿真端的多路复用服务器。
+
+:class:`~metacar.SceneAPI` 只支持单个客户端。:class:`MultiSceneServer` 使用 selectors（Linux 上为 epoll）
+在同一对监听端口上接受任意多个仿真端的连接，每个仿真端的 JSON 连接和视频流连接组成一个
+:class:`SceneSession`，由一个事件循环负责所有连接的收发，解析消息和运行算法则交给线程池处理。
+"""
+
+import logging
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Annotated, Any, Callable
+from pydantic import Field, TypeAdapter
+from .compression import available_codecs
+from .models import (
+    CameraFrame,
+    CameraInfo,
+    Code1,
+    Code2,
+    Code3,
+    Code4,
+    Code5,
+    SceneStaticData,
+    SimCarMsg,
+    VehicleControl,
+    VLAExtensionOutput,
+    ProtocolFeature,
+)
+from .sceneapi import enabled_codec, make_code4, negotiate_features, read_map_files
+from .sockets import StreamingSocket, compress_message, decompress_message
+from . import metrics, wire
+
+logger = logging.getLogger(__name__)
+
+_CODE1_ADAPTER = TypeAdapter(Code1)
+_CODE2_ADAPTER = TypeAdapter(Code2)
+_CODE4_ADAPTER = TypeAdapter(Code4)
+_CODE3_OR_CODE5_ADAPTER = TypeAdapter(
+    Annotated[Code3 | Code5, Field(discriminator="code")]
+)
+
+#: 算法函数，返回控制命令，VLA 场景可以同时返回 (控制命令, VLA 输出)
+Policy = Callable[
+    ["SceneSession", SimCarMsg, list[CameraFrame]],
+    VehicleControl | tuple[VehicleControl, VLAExtensionOutput | None],
+]
+
+
+class _Connection:
+    """非阻塞的分包连接，格式与 :class:`~metacar.sockets.RawSocket` 相同。"""
+
+    _HEADER = struct.Struct("!I")
+    _COMPRESSED_FLAG = 0x80000000
+    _RECV_SIZE = 1 << 18
+
+    def __init__(self, sock: socket.socket, channel: str):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.codec = None  #: 发送时使用的压缩算法，握手后按 code2 设置
+        self.compress_threshold = 1024
+        self._channel = (channel,)
+        self._inbox = bytearray()
+        self._outbox = bytearray()
+
+    def read_messages(self) -> list[bytes] | None:
+        """读取当前可读的数据并拆出完整的消息，连接关闭时返回 None。"""
+        try:
+            chunk = self.sock.recv(self._RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return []
+        except OSError:
+            return None
+        if not chunk:
+            return None
+        self._inbox.extend(chunk)
+        messages = []
+        header_size = self._HEADER.size
+        offset = 0
+        while len(self._inbox) - offset >= header_size:
+            (length,) = self._HEADER.unpack_from(self._inbox, offset)
+            compressed = length & self._COMPRESSED_FLAG
+            length &= ~self._COMPRESSED_FLAG
+            end = offset + header_size + length
+            if len(self._inbox) < end:
+                break
+            message = bytes(self._inbox[offset + header_size : end])
+            metrics.RECEIVED_BYTES.inc(header_size + length, self._channel)
+            if compressed:
+                try:
+                    message = decompress_message(memoryview(message), self._channel)
+                except ValueError as e:
+                    logger.warning(f"解压消息失败：{e}")
+                    return None
+            messages.append(message)
+            offset = end
+        del self._inbox[:offset]
+        return messages
+
+    def queue(self, data: bytes):
+        """将一条消息加入发送缓冲区。"""
+        if self.codec is not None and len(data) >= self.compress_threshold:
+            data = compress_message(data, self.codec, self._channel)
+        else:
+            data = self._HEADER.pack(len(data)) + data
+        self._outbox += data
+        metrics.SENT_BYTES.inc(len(data), self._channel)
+
+    @property
+    def has_pending_output(self) -> bool:
+        return bool(self._outbox)
+
+    def flush(self) -> bool:
+        """尽可能多地发送缓冲区中的数据，连接出错时返回 False。"""
+        try:
+            while self._outbox:
+                sent = self.sock.send(self._outbox)
+                del self._outbox[:sent]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            return False
+        return True
+
+    def close(self):
+        self.sock.close()
+
+
+class _PendingConnection:
+    """尚未配对的连接，收到第一条消息后才能确定属于哪个仿真端。"""
+
+    def __init__(self, conn: _Connection, address: str):
+        self.conn = conn
+        self.address = address
+        self.code1: Code1 | None = None  # JSON 连接收到的 code1
+        self.token: str | None = None  # 视频流连接收到的会话令牌
+        self.messages: list[bytes] = []  # 第一条消息之后、配对之前收到的消息
+
+
+class SceneSession:
+    """一个仿真端对应的会话，包含其连接、静态数据以及关卡计数。
+
+    :attr:`context` 可用于保存每个车辆智能体自己的状态。
+    """
+
+    def __init__(
+        self,
+        session_id: int,
+        address: str,
+        model_conn: _Connection,
+        streaming_conn: _Connection,
+    ):
+        self.id = session_id  #: 会话 ID，按连接顺序递增
+        self.address = address  #: 仿真端的 IP 地址
+        self.static_data: SceneStaticData | None = None  #: 握手完成后可用
+        self.features: list[str] = []  #: 握手时启用的协议特性
+        self.context: dict[str, Any] = {}  #: 供算法保存状态
+        self._model_conn = model_conn
+        self._streaming_conn = streaming_conn
+        self._code1: Code1 | None = None
+        self._messages: deque[bytes] = deque()
+        self._frames: deque[bytes] = deque()
+        self._tagged_frames: dict[str, memoryview] = {}
+        self._pending_tick: Code3 | None = None
+        self._handshaken = False
+        self._busy = False
+        self._closed = False
+        self._move_to_start = 0
+        self._move_to_end = 0
+
+    def retry_level(self):
+        """重试关卡，在下一次发送控制命令时生效。"""
+        self._move_to_start += 1
+        metrics.LEVEL_RETRIES.inc()
+
+    def skip_level(self):
+        """跳过关卡，在下一次发送控制命令时生效。"""
+        self._move_to_end += 1
+        metrics.LEVEL_SKIPS.inc()
+
+    def __repr__(self):
+        return f"SceneSession(id={self.id}, address={self.address!r})"
+
+
+class MultiSceneServer:
+    """在同一对端口上服务多个仿真端的服务器。
+
+    仿真端在 code1 中发送会话令牌，并把同一令牌作为视频流连接的第一条消息时，两个连接按令牌配对。
+    不发送令牌的旧版本仿真端按同一主机上的连接顺序配对，此时同一台主机上的多个仿真端需要依次连接，
+    不能交错。尚未配对的连接断开时会被直接丢弃。
+    """
+
+    def __init__(
+        self,
+        policy: Policy,
+        host: str = "127.0.0.1",
+        model_port: int = 5061,
+        streaming_port: int = 5063,
+        max_workers: int | None = None,
+        on_session_start: Callable[[SceneSession], None] | None = None,
+        on_session_end: Callable[[SceneSession], None] | None = None,
+        binary_state: bool = False,
+        strict_sync: bool = False,
+        compression: str | None = None,
+        compress_threshold: int = 1024,
+    ):
+        """
+        :param policy: 算法函数，参数为 (会话, 仿真动态信息, 图像帧列表)，返回控制命令。
+            同一会话的帧按顺序串行处理，不同会话的帧在线程池中并行处理。
+        :param host: 监听的 IP 地址。
+        :param model_port: JSON 消息端口。
+        :param streaming_port: 视频流端口。
+        :param max_workers: 线程池大小，默认由 ThreadPoolExecutor 决定。
+        :param on_session_start: 会话握手完成后的回调，在线程池中调用。
+        :param on_session_end: 会话结束（场景结束或连接中断）后的回调，在事件循环中调用。
+        :param binary_state: 仿真端支持时，是否使用二进制格式收发 code3/code4，见 :class:`~metacar.SceneAPI`。
+        :param strict_sync: 仿真端支持时，是否按帧序号对齐图像与状态消息。
+        :param compression: 仿真端支持时，JSON 通道上使用的压缩算法。
+        :param compress_threshold: 只压缩不小于该字节数的消息。
+        :raises ValueError: 当压缩算法不支持或未安装时抛出。
+        """
+        if compression is not None and compression not in available_codecs():
+            raise ValueError(f"不支持的压缩算法：{compression}")
+        self._binary_state = binary_state
+        self._strict_sync = strict_sync
+        self._compression = compression
+        self._compress_threshold = compress_threshold
+        self._policy = policy
+        self._on_session_start = on_session_start
+        self._on_session_end = on_session_end
+        self._selector = selectors.DefaultSelector()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="metacar-session"
+        )
+        self._listeners = []
+        for port, handler in (
+            (model_port, self._accept_model),
+            (streaming_port, self._accept_streaming),
+        ):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+            sock.listen()
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, handler)
+            self._listeners.append(sock)
+            logger.info(f"监听 {host}:{port}")
+        # 工作线程通过 socketpair 唤醒事件循环
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._selector.register(
+            self._wakeup_recv, selectors.EVENT_READ, self._drain_wakeup
+        )
+        self._completions: deque[tuple[SceneSession, Any]] = deque()
+        # 按连接顺序排列的未配对连接
+        self._pending_model: list[_PendingConnection] = []
+        self._pending_streaming: list[_PendingConnection] = []
+        self._sessions: dict[int, SceneSession] = {}
+        self._next_session_id = 0
+        self._static_cache: dict[tuple[str, str, str], tuple[list, list]] = {}
+        self._static_cache_lock = threading.Lock()
+        self._running = True
+
+    @property
+    def sessions(self) -> list[SceneSession]:
+        """当前活跃的会话。"""
+        return list(self._sessions.values())
+
+    def serve_forever(self):
+        """运行事件循环，直到调用 :meth:`shutdown`。"""
+        try:
+            while self._running:
+                for key, mask in self._selector.select():
+                    key.data(key.fileobj, mask)
+                self._process_completions()
+        finally:
+            self._close_all()
+
+    def shutdown(self):
+        """停止事件循环，可以在其他线程中调用。"""
+        self._running = False
+        self._wake()
+
+    # ---- 连接管理 ----
+
+    def _accept(self, listener: socket.socket, pending: list, handler):
+        try:
+            sock, (address, _) = listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = _PendingConnection(
+            _Connection(sock, str(listener.getsockname()[1])), address
+        )
+        pending.append(conn)
+        # 未配对的连接也需要注册，才能在其断开时及时丢弃
+        self._selector.register(
+            sock, selectors.EVENT_READ, lambda sock, mask, c=conn: handler(c)
+        )
+
+    def _accept_model(self, listener, mask):
+        self._accept(listener, self._pending_model, self._on_pending_model)
+
+    def _accept_streaming(self, listener, mask):
+        self._accept(listener, self._pending_streaming, self._on_pending_streaming)
+
+    def _on_pending_model(self, pending: _PendingConnection):
+        messages = pending.conn.read_messages()
+        if messages is None:
+            self._discard_pending(pending, self._pending_model)
+            return
+        if pending.code1 is None and messages:
+            try:
+                pending.code1 = _CODE1_ADAPTER.validate_json(messages.pop(0))
+            except ValueError as e:
+                logger.warning(f"{pending.address} 的 code1 格式错误：{e}")
+                self._discard_pending(pending, self._pending_model)
+                return
+        pending.messages.extend(messages)
+        self._try_pair()
+
+    def _on_pending_streaming(self, pending: _PendingConnection):
+        messages = pending.conn.read_messages()
+        if messages is None:
+            self._discard_pending(pending, self._pending_streaming)
+            return
+        if pending.token is None and messages:
+            # 场景在握手完成前不会发送图像，因此第一条消息只能是会话令牌
+            pending.token = messages.pop(0).decode("utf-8", errors="replace")
+        pending.messages.extend(messages)
+        self._try_pair()
+
+    def _discard_pending(self, pending: _PendingConnection, queue: list):
+        queue.remove(pending)
+        self._selector.unregister(pending.conn.sock)
+        pending.conn.close()
+        logger.info(f"{pending.address} 的连接在配对前断开")
+
+    def _try_pair(self):
+        for model in list(self._pending_model):
+            if model.code1 is None:
+                continue
+            token = model.code1.session_token
+            if token is not None:
+                matches = (p for p in self._pending_streaming if p.token == token)
+            else:
+                # 旧版本仿真端不发送令牌，只能按同一主机上的连接顺序配对
+                matches = (
+                    p
+                    for p in self._pending_streaming
+                    if p.token is None and p.address == model.address
+                )
+            streaming = next(matches, None)
+            if streaming is not None:
+                self._pending_model.remove(model)
+                self._pending_streaming.remove(streaming)
+                self._open_session(model, streaming)
+
+    def _open_session(self, model: _PendingConnection, streaming: _PendingConnection):
+        session = SceneSession(
+            self._next_session_id, model.address, model.conn, streaming.conn
+        )
+        self._next_session_id += 1
+        self._sessions[session.id] = session
+        session._code1 = model.code1
+        session._messages.extend(model.messages)
+        session._frames.extend(streaming.messages)
+        self._selector.modify(
+            session._model_conn.sock,
+            selectors.EVENT_READ,
+            lambda sock, mask, s=session: self._on_model_event(s, mask),
+        )
+        self._selector.modify(
+            session._streaming_conn.sock,
+            selectors.EVENT_READ,
+            lambda sock, mask, s=session: self._on_streaming_event(s),
+        )
+        logger.info(f"新会话 {session}")
+        self._dispatch(session)
+
+    def _on_model_event(self, session: SceneSession, mask: int):
+        if mask & selectors.EVENT_WRITE:
+            if not session._model_conn.flush():
+                self._close_session(session, "连接中断")
+                return
+            self._update_interest(session)
+        if mask & selectors.EVENT_READ:
+            messages = session._model_conn.read_messages()
+            if messages is None:
+                self._close_session(session, "连接中断")
+                return
+            session._messages.extend(messages)
+            self._dispatch(session)
+
+    def _on_streaming_event(self, session: SceneSession):
+        frames = session._streaming_conn.read_messages()
+        if frames is None:
+            self._close_session(session, "连接中断")
+            return
+        session._frames.extend(frames)
+        self._dispatch(session)
+
+    def _update_interest(self, session: SceneSession):
+        events = selectors.EVENT_READ
+        if session._model_conn.has_pending_output:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(
+            session._model_conn.sock,
+            events,
+            self._selector.get_key(session._model_conn.sock).data,
+        )
+
+    def _send(self, session: SceneSession, data: bytes):
+        session._model_conn.queue(data)
+        if not session._model_conn.flush():
+            self._close_session(session, "连接中断")
+            return
+        self._update_interest(session)
+
+    def _close_session(self, session: SceneSession, reason: str):
+        if session._closed:
+            return
+        session._closed = True
+        for conn in (session._model_conn, session._streaming_conn):
+            self._selector.unregister(conn.sock)
+            conn.close()
+        del self._sessions[session.id]
+        logger.info(f"会话 {session} 结束：{reason}")
+        if self._on_session_end is not None:
+            self._on_session_end(session)
+
+    def _close_all(self):
+        for session in list(self._sessions.values()):
+            self._close_session(session, "服务器关闭")
+        for pending in (*self._pending_model, *self._pending_streaming):
+            self._selector.unregister(pending.conn.sock)
+            pending.conn.close()
+        for sock in self._listeners:
+            self._selector.unregister(sock)
+            sock.close()
+        self._executor.shutdown(wait=True)
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    # ---- 任务调度 ----
+
+    def _wake(self):
+        try:
+            self._wakeup_send.send(b"\0")
+        except OSError:
+            pass
+
+    def _drain_wakeup(self, sock, mask):
+        try:
+            while sock.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _submit(self, session: SceneSession, func, *args):
+        session._busy = True
+
+        def done(future):
+            self._completions.append((session, future))
+            self._wake()
+
+        self._executor.submit(func, session, *args).add_done_callback(done)
+
+    def _process_completions(self):
+        while self._completions:
+            session, future = self._completions.popleft()
+            session._busy = False
+            if session._closed:
+                continue
+            try:
+                result = future.result()
+            except Exception:
+                logger.exception(f"会话 {session} 处理消息出错")
+                self._close_session(session, "处理消息出错")
+                continue
+            if isinstance(result, Code2):
+                self._send(session, _CODE2_ADAPTER.dump_json(result, by_alias=True))
+                # 仿真端收到 code2 后才会识别压缩消息，因此在发送 code2 之后再启用
+                session._model_conn.codec = enabled_codec(result.features)
+                session._model_conn.compress_threshold = self._compress_threshold
+            elif isinstance(result, Code3):
+                session._pending_tick = result
+            elif isinstance(result, Code5):
+                self._close_session(session, "场景结束")
+                continue
+            elif result is not None:
+                self._send(session, result)
+            self._dispatch(session)
+
+    def _dispatch(self, session: SceneSession):
+        """同一会话同时只有一个任务在处理，保证消息按顺序处理。"""
+        if session._busy or session._closed:
+            return
+        if not session._handshaken:
+            if session._code1 is not None:
+                code1, session._code1 = session._code1, None
+                self._submit(session, self._handshake, code1)
+            return
+        if session._pending_tick is None:
+            if session._messages:
+                self._submit(session, self._parse, session._messages.popleft())
+            return
+        camera_infos = session._pending_tick.sim_car_msg.sensor.ego_rgb_cams
+        if ProtocolFeature.FRAME_SEQ in session.features:
+            try:
+                cameras = self._collect_tagged(session, camera_infos)
+            except ValueError as e:
+                # 只结束出错的会话，不影响其他会话
+                logger.warning(f"会话 {session} 的视频流帧头错误：{e}")
+                self._close_session(session, "视频流帧头错误")
+                return
+            if cameras is None:
+                return
+        else:
+            if len(session._frames) < len(camera_infos):
+                return
+            cameras = [(info, session._frames.popleft()) for info in camera_infos]
+        code3, session._pending_tick = session._pending_tick, None
+        self._submit(session, self._run_policy, code3, cameras)
+
+    def _collect_tagged(
+        self, session: SceneSession, camera_infos: list[CameraInfo]
+    ) -> list[tuple[CameraInfo, memoryview]] | None:
+        """
+        按帧序号和摄像头 ID 取出当前帧的图像，规则与 :class:`~metacar.sync.FrameSynchronizer` 相同。
+
+        :return: 已对齐的 (摄像头信息, 图像数据) 列表，图像尚未到齐时返回 None。
+        """
+        seq = session._pending_tick.seq or 0
+        wanted = {info.id for info in camera_infos}
+        collected = session._tagged_frames
+        newer = False
+        while session._frames:
+            frame_seq, camera_id, raw_image = StreamingSocket.parse_tagged(
+                session._frames[0]
+            )
+            if frame_seq > seq:
+                # TCP 按顺序到达，当前帧缺失的图像不会再到达
+                newer = True
+                break
+            session._frames.popleft()
+            if frame_seq < seq or camera_id not in wanted:
+                metrics.DROPPED_FRAMES.inc(1, ("desync",))
+                continue
+            collected[camera_id] = raw_image
+        if not newer and not wanted.issubset(collected):
+            return None
+        session._tagged_frames = {}
+        if not wanted.issubset(collected):
+            missing = sorted(wanted - collected.keys())
+            logger.warning(f"会话 {session} 帧 {seq} 图像错位，缺失摄像头 {missing}")
+        return [
+            (info, collected[info.id]) for info in camera_infos if info.id in collected
+        ]
+
+    # ---- 在线程池中运行的任务 ----
+
+    def _load_static_data(self, code1: Code1) -> SceneStaticData:
+        map_info = code1.map_info
+        static_key = (map_info.path, map_info.route, map_info.map)
+        with self._static_cache_lock:
+            cached = self._static_cache.get(static_key)
+        if cached is None:
+            cached = read_map_files(map_info)
+            with self._static_cache_lock:
+                self._static_cache[static_key] = cached
+        route, roads = cached
+        return SceneStaticData(
+            route=route,
+            roads=roads,
+            sub_scenes=map_info.sub_scenes,
+            vla_extension=code1.vla_extension,
+        )
+
+    def _handshake(self, session: SceneSession, code1: Code1) -> Code2:
+        session.static_data = self._load_static_data(code1)
+        session.features = negotiate_features(
+            code1.features,
+            binary_state=self._binary_state,
+            strict_sync=self._strict_sync,
+            compression=self._compression,
+        )
+        if self._on_session_start is not None:
+            self._on_session_start(session)
+        session._handshaken = True
+        return Code2(code=2, features=session.features)
+
+    def _parse(self, session: SceneSession, raw_message: bytes) -> Code3 | Code5:
+        start_time = time.perf_counter()
+        if wire.is_binary(raw_message):
+            message = wire.decode_code3(raw_message)
+        else:
+            message = _CODE3_OR_CODE5_ADAPTER.validate_json(raw_message)
+        metrics.DECODE_SECONDS.observe(time.perf_counter() - start_time, ("state",))
+        return message
+
+    def _run_policy(
+        self,
+        session: SceneSession,
+        code3: Code3,
+        cameras: list[tuple[CameraInfo, bytes | memoryview]],
+    ) -> bytes:
+        sim_car_msg = code3.sim_car_msg
+        frames = [
+            CameraFrame(id=camera_info.id, frame=StreamingSocket.decode(raw_image))
+            for camera_info, raw_image in cameras
+        ]
+        metrics.TICKS.inc()
+        result = self._policy(session, sim_car_msg, frames)
+        if isinstance(result, tuple):
+            vc, vla_extension = result
+        else:
+            vc, vla_extension = result, None
+        code4 = make_code4(
+            vc, vla_extension, session._move_to_start, session._move_to_end
+        )
+        if ProtocolFeature.BINARY_STATE in session.features:
+            return wire.encode_code4(code4)
+        return _CODE4_ADAPTER.dump_json(code4, by_alias=True)
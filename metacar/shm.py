@@ -0,0 +1,246 @@
+"""
+同一台机器上通过共享内存传输图像。
+
+启用 :attr:`~metacar.models.ProtocolFeature.SHARED_MEMORY_FRAMES` 特性后，仿真端把图像写入共享内存中的环形缓冲区
+（:class:`FrameRing`），视频流中只传输几十字节的描述符，API 端（:class:`FrameRingReader`）
+直接把共享内存映射为 NumPy 数组，省去 JPEG 编解码和 TCP 回环上的多次复制。
+
+环形缓冲区由若干个固定大小的槽组成，每个槽前有 8 字节的写入代数（小端序）。
+仿真端覆盖一个槽之前先把代数置为 0，写完数据后再写入新的代数，
+API 端读取前后比较代数，据此判断槽是否正在或已经被覆盖。
+描述符格式（大端序）：4 字节魔数 ``MCSM`` + 1 字节编码方式 + 8 字节槽的偏移量 + 8 字节写入代数
++ 4 字节数据长度 + 2 字节高度 + 2 字节宽度 + 1 字节名称长度 + 共享内存名称。
+"""
+
+import logging
+import struct
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MCSM"
+ENCODING_RAW = 0  #: 未压缩的 BGR 图像，API 端直接得到共享内存的视图
+ENCODING_ENCODED = 1  #: JPEG/PNG 等编码后的图像，API 端解码后得到新的数组
+
+_DESCRIPTOR = struct.Struct("!4sBQQIHHB")
+_SLOT_HEADER = struct.Struct("<Q")
+_SLOT_ALIGN = 64
+
+
+class StaleFrameError(ValueError):
+    """描述符指向的槽已被新的图像覆盖。"""
+
+
+# 本进程创建的共享内存名称。映射这些共享内存时不能再从 resource_tracker 注销，
+# 否则创建者释放时会重复注销，resource_tracker 在退出时输出 KeyError
+_created_names: set[str] = set()
+
+
+class _AttachedSegment(SharedMemory):
+    """API 端映射的共享内存，由仿真端创建和释放。"""
+
+    def __init__(self, name: str, shared_tracker: bool = False):
+        if sys.version_info >= (3, 13):
+            super().__init__(name=name, track=False)
+        else:
+            super().__init__(name=name)
+            if not shared_tracker and name not in _created_names:
+                # 避免本进程退出时 resource_tracker 删除仿真端的共享内存
+                resource_tracker.unregister(self._name, "shared_memory")
+
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            # 仍有图像视图引用该映射，视图释放后由系统回收
+            pass
+
+
+def is_descriptor(data: bytes | memoryview) -> bool:
+    """判断视频流中的一条消息是否为共享内存描述符。"""
+    return bytes(data[: len(MAGIC)]) == MAGIC
+
+
+class FrameRing:
+    """
+    仿真端使用的共享内存环形缓冲区。
+
+    API 端拿到的是槽的视图而不是副本，因此槽数应不少于 摄像头数 × 同时处理的帧数，
+    否则图像在被处理前就可能被覆盖。
+    """
+
+    def __init__(self, slot_size: int, slots: int = 16, name: str | None = None):
+        """
+        :param slot_size: 每个槽最多可以存放的字节数，未压缩图像为 宽 × 高 × 3。
+        :param slots: 槽的数量。
+        :param name: 共享内存名称，默认由系统生成。
+        """
+        self._slot_size = slot_size
+        self._slot_stride = (
+            (_SLOT_HEADER.size + slot_size + _SLOT_ALIGN - 1) // _SLOT_ALIGN
+        ) * _SLOT_ALIGN
+        self._slots = slots
+        self._shm = SharedMemory(name=name, create=True, size=self._slot_stride * slots)
+        _created_names.add(self._shm.name)
+        self._name = self._shm.name.encode("utf-8")
+        self._next = 0
+
+    @property
+    def name(self) -> str:
+        """共享内存名称。"""
+        return self._shm.name
+
+    @property
+    def slots(self) -> int:
+        """槽的数量。"""
+        return self._slots
+
+    @property
+    def slot_size(self) -> int:
+        """每个槽最多可以存放的字节数。"""
+        return self._slot_size
+
+    def write(self, image: np.ndarray | bytes, slot: int | None = None) -> bytes:
+        """
+        把一张图像写入下一个槽。
+
+        :param image: 未压缩的 BGR 图像（uint8，形状为 (高, 宽, 3)），或编码后的图像数据。
+        :param slot: 写入指定的槽，默认按顺序循环使用。由调用方管理空闲的槽时，可以保证未处理完的图像不被覆盖。
+        :return: 在视频流中发送的描述符。
+        :raises ValueError: 当图像超过槽的大小时抛出。
+        """
+        if isinstance(image, np.ndarray):
+            height, width = image.shape[:2]
+            data = np.ascontiguousarray(image, np.uint8).reshape(-1)
+            encoding = ENCODING_RAW
+        else:
+            height = width = 0
+            data = np.frombuffer(image, np.uint8)
+            encoding = ENCODING_ENCODED
+        if data.nbytes > self._slot_size:
+            raise ValueError(f"图像大小 {data.nbytes} 超过槽的大小 {self._slot_size}")
+        generation = self._next + 1  # 代数从 1 开始，0 表示槽尚未写入
+        if slot is None:
+            slot = self._next % self._slots
+        offset = slot * self._slot_stride
+        buf = self._shm.buf
+        # 写入期间代数为 0，读取方不会把写了一半的数据当作有效的图像
+        _SLOT_HEADER.pack_into(buf, offset, 0)
+        buf[offset + _SLOT_HEADER.size : offset + _SLOT_HEADER.size + data.nbytes] = (
+            data
+        )
+        _SLOT_HEADER.pack_into(buf, offset, generation)
+        self._next += 1
+        return (
+            _DESCRIPTOR.pack(
+                MAGIC,
+                encoding,
+                offset,
+                generation,
+                data.nbytes,
+                height,
+                width,
+                len(self._name),
+            )
+            + self._name
+        )
+
+    def close(self):
+        """释放共享内存。已映射该共享内存的 API 端在关闭前仍可以访问。"""
+        self._shm.close()
+        self._shm.unlink()
+        _created_names.discard(self._shm.name)
+
+
+def _check_generation(shm: SharedMemory, offset: int, generation: int):
+    """检查槽的写入代数是否仍为描述符中的代数。"""
+    (current,) = _SLOT_HEADER.unpack_from(shm.buf, offset)
+    if current != generation:
+        raise StaleFrameError(f"共享内存 {shm.name} 偏移量 {offset} 处的图像已被覆盖")
+
+
+class FrameRingReader:
+    """API 端使用的描述符解析器，按名称缓存已映射的共享内存。"""
+
+    def __init__(self, shared_tracker: bool = False, single_segment: bool = False):
+        """
+        :param shared_tracker: 是否与共享内存的创建者共用 resource_tracker，
+            由创建者通过 :mod:`multiprocessing` 启动的子进程应为 True。
+        :param single_segment: 创建者同时只使用一块共享内存时为 True，
+            映射新的共享内存时解除其他映射，避免创建者重新分配后旧的映射一直占用内存。
+        """
+        self._shared_tracker = shared_tracker
+        self._single_segment = single_segment
+        self._segments: dict[str, _AttachedSegment] = {}
+
+    def _segment(self, name: str) -> _AttachedSegment:
+        shm = self._segments.get(name)
+        if shm is None:
+            if self._single_segment:
+                self.close()
+            shm = self._segments[name] = _AttachedSegment(name, self._shared_tracker)
+            logger.info(f"已映射共享内存 {name}，大小 {shm.size} 字节")
+        return shm
+
+    def read(self, descriptor: bytes | memoryview, copy: bool = False) -> np.ndarray:
+        """
+        根据描述符读取图像。
+
+        未压缩图像默认返回共享内存的视图，只在读取时检查槽是否已被覆盖，
+        之后仿真端覆盖该槽时视图的内容会随之改变，甚至是新旧图像各一部分。
+        需要保证图像完整时指定 ``copy``，复制完成后会再次检查。
+
+        :param descriptor: 视频流中收到的描述符。
+        :param copy: 未压缩图像是否复制一份，而不是返回共享内存的视图。
+        :return: 未压缩图像时为共享内存的视图或副本，编码图像时为解码后的新数组。
+        :raises StaleFrameError: 当槽正在或已经被新的图像覆盖时抛出。
+        :raises ValueError: 当描述符格式错误时抛出。
+        """
+        if len(descriptor) < _DESCRIPTOR.size:
+            raise ValueError("共享内存描述符不完整")
+        (
+            magic,
+            encoding,
+            offset,
+            generation,
+            length,
+            height,
+            width,
+            name_length,
+        ) = _DESCRIPTOR.unpack_from(descriptor)
+        if magic != MAGIC:
+            raise ValueError("不是共享内存描述符")
+        name = bytes(
+            descriptor[_DESCRIPTOR.size : _DESCRIPTOR.size + name_length]
+        ).decode("utf-8")
+        shm = self._segment(name)
+        if offset + _SLOT_HEADER.size + length > shm.size:
+            raise ValueError("共享内存描述符越界")
+        _check_generation(shm, offset, generation)
+        data = np.frombuffer(
+            shm.buf, np.uint8, count=length, offset=offset + _SLOT_HEADER.size
+        )
+        if encoding == ENCODING_RAW:
+            frame = data.reshape(height, width, 3)
+            if not copy:
+                return frame
+            frame = frame.copy()
+        else:
+            import cv2  # 延迟导入，只使用未压缩图像时不需要加载 OpenCV
+
+            frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        # 读取期间槽被覆盖时，得到的可能是新旧图像各一部分
+        _check_generation(shm, offset, generation)
+        return frame
+
+    def close(self):
+        """解除共享内存的映射。仍有图像视图在使用的映射会在视图释放后由系统回收。"""
+        segments, self._segments = self._segments, {}
+        for shm in segments.values():
+            try:
+                shm.close()
+            except BufferError:
+                pass
@@ -0,0 +1,229 @@
+"""
+交通标志图层。
+
+限速值以 ``"SpeedLimit|30"`` 的格式放在限速标志障碍物的 :attr:`~metacar.models.ObstacleInfo.extra_info` 中，
+每帧逐个解析字符串并判断标志属于哪条道路的开销与障碍物数量成正比。
+:class:`SignLayer` 按障碍物 ID 缓存解析结果和所在的道路，只有新出现或移动过的标志才重新处理，
+并按道路维护按弧长排序的限速标志，查询前方一定距离内的限速只需要二分查找。
+
+限速的单位为 km/h。
+"""
+
+import bisect
+from dataclasses import dataclass
+import numpy as np
+from .models import ObstacleInfo, ObstacleType, SimCarMsg, TrafficSignType
+from .roads import LanePosition, RoadIndex
+from .wire import cached_state_arrays
+
+#: 作为交通标志处理的障碍物类型
+SIGN_TYPES = (ObstacleType.SPEED_LIMIT_SIGN, ObstacleType.TRAFFIC_SIGN)
+
+_SPEED_LIMIT_KIND = "SpeedLimit"
+
+
+def parse_extra_info(extra_info: str | None) -> tuple[str, float | None] | None:
+    """
+    解析标志的额外信息。
+
+    :param extra_info: 格式为 ``"种类|数值"`` 的字符串，例如 ``"SpeedLimit|30"``。
+    :return: 元组 (kind, value)，数值无法解析时 value 为 None，额外信息为空时返回 None。
+    """
+    if not extra_info:
+        return None
+    kind, _, value = extra_info.partition("|")
+    try:
+        return kind.strip(), float(value)
+    except ValueError:
+        return kind.strip(), None
+
+
+@dataclass(frozen=True)
+class Sign:
+    """解析后的交通标志。"""
+
+    id: int  #: 障碍物 ID
+    type: ObstacleType  #: 障碍物类型
+    kind: str | None  #: 额外信息中的种类，例如 ``"SpeedLimit"``
+    value: float | None  #: 额外信息中的数值，限速标志为限速值
+    x: float  #: 位置 X
+    y: float  #: 位置 Y
+    road_id: str | None  #: 所在道路的 ID，不在任何道路附近时为 None
+    s: float | None  #: 在道路上的弧长坐标
+
+    @property
+    def speed_limit(self) -> float | None:
+        """限速值，不是限速标志时为 None。"""
+        if self.type is ObstacleType.SPEED_LIMIT_SIGN or self.kind == _SPEED_LIMIT_KIND:
+            return self.value
+        return None
+
+
+class SignLayer:
+    """按障碍物 ID 缓存的交通标志，以及按道路排序的限速标志。"""
+
+    def __init__(self, road_index: RoadIndex | None = None):
+        """
+        :param road_index: 道路索引，用于确定标志所在的道路，未指定时只解析标志而不关联道路。
+        """
+        self._road_index = road_index
+        self._signs: dict[int, Sign] = {}
+        # 道路 ID -> (按弧长排序的弧长列表, 对应的限速标志)
+        self._limits: dict[str, tuple[list[float], list[Sign]]] = {}
+
+    @property
+    def road_index(self) -> RoadIndex | None:
+        """构造时指定的道路索引。"""
+        return self._road_index
+
+    def __len__(self) -> int:
+        return len(self._signs)
+
+    def __iter__(self):
+        return iter(self._signs.values())
+
+    def get(self, obstacle_id: int) -> Sign | None:
+        """按障碍物 ID 获取标志。"""
+        return self._signs.get(obstacle_id)
+
+    def update(self, msg: SimCarMsg) -> "SignLayer":
+        """
+        用本帧的障碍物更新标志，不在本帧中的标志会被移除。
+
+        启用 :attr:`~metacar.models.ProtocolFeature.BINARY_STATE` 时用障碍物数组筛选标志，
+        只有出现新的标志时才遍历 :attr:`~metacar.models.SimCarMsg.obstacles`。
+
+        :param msg: 仿真动态信息。
+        :return: 自身。
+        """
+        arrays = cached_state_arrays(msg)
+        if arrays is not None:
+            obstacles = arrays.obstacles
+            mask = np.isin(obstacles["type"], [t.value for t in SIGN_TYPES])
+            current = {
+                obstacle_id: (x, y)
+                for obstacle_id, x, y in zip(
+                    obstacles["id"][mask].tolist(),
+                    obstacles["pos_x"][mask].tolist(),
+                    obstacles["pos_y"][mask].tolist(),
+                )
+            }
+            infos = None
+        else:
+            infos = {o.id: o for o in msg.obstacles if o.type in SIGN_TYPES}
+            current = {o.id: (o.pos_x, o.pos_y) for o in infos.values()}
+        changed = len(current) != len(self._signs)
+        for obstacle_id, (x, y) in current.items():
+            sign = self._signs.get(obstacle_id)
+            if sign is not None and sign.x == x and sign.y == y:
+                continue
+            if infos is None:
+                infos = {o.id: o for o in msg.obstacles if o.type in SIGN_TYPES}
+            self._signs[obstacle_id] = self._parse(infos[obstacle_id])
+            changed = True
+        if changed:
+            for obstacle_id in [i for i in self._signs if i not in current]:
+                del self._signs[obstacle_id]
+            self._index_limits()
+        return self
+
+    def _parse(self, obstacle: ObstacleInfo) -> Sign:
+        """解析一个标志的额外信息，并确定其所在的道路。"""
+        parsed = parse_extra_info(obstacle.extra_info)
+        kind, value = parsed if parsed is not None else (None, None)
+        position = (
+            self._road_index.locate(obstacle.pos_x, obstacle.pos_y)
+            if self._road_index is not None
+            else None
+        )
+        return Sign(
+            id=obstacle.id,
+            type=obstacle.type,
+            kind=kind,
+            value=value,
+            x=obstacle.pos_x,
+            y=obstacle.pos_y,
+            road_id=position.road_id if position is not None else None,
+            s=position.s if position is not None else None,
+        )
+
+    def _index_limits(self):
+        """按道路重新排序限速标志。"""
+        limits: dict[str, list[Sign]] = {}
+        for sign in self._signs.values():
+            if sign.road_id is not None and sign.speed_limit is not None:
+                limits.setdefault(sign.road_id, []).append(sign)
+        self._limits = {}
+        for road_id, signs in limits.items():
+            signs.sort(key=lambda sign: sign.s)
+            self._limits[road_id] = ([sign.s for sign in signs], signs)
+
+    def current_speed_limit(self, position: LanePosition) -> float | None:
+        """
+        获取所在道路上最近一个已经经过的限速标志的限速值。
+
+        :param position: 主车位置，见 :meth:`RoadIndex.locate() <metacar.roads.RoadIndex.locate>`。
+        :return: 限速值，所在道路上还没有经过限速标志时返回 None。
+        """
+        entry = self._limits.get(position.road_id)
+        if entry is None:
+            return None
+        idx = bisect.bisect_right(entry[0], position.s)
+        return entry[1][idx - 1].speed_limit if idx else None
+
+    def speed_limits_ahead(
+        self, position: LanePosition, distance: float
+    ) -> list[tuple[float, Sign]]:
+        """
+        获取前方一定距离内的限速标志。
+
+        超出所在道路时，沿唯一的后继道路继续查找；后继道路不唯一时停止。
+
+        :param position: 主车位置。
+        :param distance: 查找的距离，单位米。
+        :return: 按距离排序的 (距离, 标志) 列表。
+        """
+        result = []
+        road_id, start, offset = position.road_id, position.s, 0.0
+        visited = set()
+        while road_id is not None and road_id not in visited and offset <= distance:
+            visited.add(road_id)
+            entry = self._limits.get(road_id)
+            if entry is not None:
+                first = bisect.bisect_left(entry[0], start)
+                last = bisect.bisect_right(entry[0], start + distance - offset)
+                result.extend(
+                    (offset + s - start, sign)
+                    for s, sign in zip(entry[0][first:last], entry[1][first:last])
+                )
+            if self._road_index is None:
+                break
+            offset += self._road_index.road_length(road_id) - start
+            road = self._road_index.road(road_id)
+            successors = road.successor_ids if road is not None else []
+            road_id = successors[0] if len(successors) == 1 else None
+            start = 0.0
+        return result
+
+    def effective_speed_limit(
+        self, position: LanePosition, distance: float
+    ) -> float | None:
+        """
+        获取从当前位置到前方一定距离内需要遵守的最低限速。
+
+        :param position: 主车位置。
+        :param distance: 查找的距离，单位米。
+        :return: 当前限速与前方限速中的最小值，都没有时返回 None。
+        """
+        limits = [
+            sign.speed_limit for _, sign in self.speed_limits_ahead(position, distance)
+        ]
+        current = self.current_speed_limit(position)
+        if current is not None:
+            limits.append(current)
+        return min(limits) if limits else None
+
+    def road_sign(self, road_id: str) -> TrafficSignType:
+        """获取道路信息中的交通标志，道路不存在时返回 :attr:`TrafficSignType.NO_SIGN`。"""
+        road = self._road_index.road(road_id) if self._road_index is not None else None
+        return road.traffic_sign_type if road is not None else TrafficSignType.NO_SIGN
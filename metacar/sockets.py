@@ -1,10 +1,13 @@
-import cv2
 import numpy as np
 import socket
 import struct
+import time
 import logging
 from typing import Any
 from pydantic import TypeAdapter
+from . import metrics
+from .compression import Codec, codec_by_id
+from .shm import FrameRingReader, is_descriptor
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +16,70 @@ class ConnectionClosedError(ConnectionError):
     pass
 
 
+_COMPRESSED_FLAG = 0x80000000
+_COMPRESSED_HEADER = struct.Struct("!BI")
+
+
+def compress_message(data: bytes, codec: Codec, channel: tuple[str]) -> bytes:
+    """
+    压缩一条消息并加上长度前缀，压缩后没有变小时按原样加上长度前缀。
+
+    :param data: 消息内容。
+    :param codec: 压缩算法。
+    :param channel: 指标的通道标签。
+    :return: 可以直接发送的数据。
+    """
+    start_time = time.perf_counter()
+    compressed = codec.compress(data)
+    metrics.COMPRESSION_SECONDS.observe(
+        time.perf_counter() - start_time, (codec.name, "compress")
+    )
+    if len(compressed) + _COMPRESSED_HEADER.size >= len(data):
+        return struct.pack("!I", len(data)) + data
+    metrics.COMPRESSION_INPUT_BYTES.inc(len(data), channel + ("send",))
+    metrics.COMPRESSION_OUTPUT_BYTES.inc(len(compressed), channel + ("send",))
+    length = _COMPRESSED_HEADER.size + len(compressed)
+    return (
+        struct.pack("!I", length | _COMPRESSED_FLAG)
+        + _COMPRESSED_HEADER.pack(codec.id, len(data))
+        + compressed
+    )
+
+
+def decompress_message(view: memoryview, channel: tuple[str]) -> bytes:
+    """
+    解压一条压缩消息的内容（不含长度前缀）。
+
+    :param view: 1 字节压缩算法 ID + 4 字节原始长度 + 压缩数据。
+    :param channel: 指标的通道标签。
+    :return: 解压后的消息内容。
+    :raises ValueError: 当算法不支持或解压后长度与声明不一致时抛出。
+    """
+    codec_id, raw_length = _COMPRESSED_HEADER.unpack_from(view)
+    codec = codec_by_id(codec_id)
+    start_time = time.perf_counter()
+    data = codec.decompress(view[_COMPRESSED_HEADER.size :], raw_length)
+    metrics.COMPRESSION_SECONDS.observe(
+        time.perf_counter() - start_time, (codec.name, "decompress")
+    )
+    metrics.COMPRESSION_INPUT_BYTES.inc(raw_length, channel + ("recv",))
+    metrics.COMPRESSION_OUTPUT_BYTES.inc(
+        len(view) - _COMPRESSED_HEADER.size, channel + ("recv",)
+    )
+    if len(data) != raw_length:
+        raise ValueError(f"解压后长度 {len(data)} 与消息声明的 {raw_length} 不一致")
+    return data
+
+
 class RawSocket:
     """
     一个简单的 TCP 服务器类，实现基于长度 + 内容格式的基本分包。
     长度为 4 字节的无符号整数，使用网络字节序（大端序）。
     仅支持单个客户端连接。
+
+    长度的最高位为压缩标志，置位时消息内容为 1 字节压缩算法 ID + 4 字节原始长度 + 压缩数据，
+    见 :mod:`metacar.compression`。接收时总是识别压缩消息，发送时只有调用
+    :meth:`set_compression` 后才会压缩。
     """
 
     _HEADER_SIZE = 4  # 消息长度的 4 字节前缀
@@ -36,8 +98,22 @@ class RawSocket:
         self._sock.bind((self._host, self._port))
         self._sock.listen()
         self._conn = None
+        self._channel = (str(self._port),)  # 指标的通道标签
+        self._codec: Codec | None = None
+        self._compress_threshold = 0
+        self._scratch = bytearray()  # 接收压缩数据的复用缓冲区
         logger.info(f"监听 {self._host}:{self._port}")
 
+    def set_compression(self, codec: Codec | None, threshold: int = 1024):
+        """
+        设置发送时使用的压缩算法。
+
+        :param codec: 压缩算法，为 None 时不压缩。
+        :param threshold: 只压缩不小于该字节数的消息，较小的消息压缩收益不抵开销。
+        """
+        self._codec = codec
+        self._compress_threshold = threshold
+
     def accept(self):
         """
         接受一个新的客户端连接。
@@ -56,8 +132,12 @@ class RawSocket:
         """
         if not self._conn:
             raise ConnectionError("无客户端连接")
-        length_prefix = struct.pack("!I", len(data))  # 将长度转换为 4 字节大端序
-        self._conn.sendall(length_prefix + data)
+        if self._codec is not None and len(data) >= self._compress_threshold:
+            data = compress_message(data, self._codec, self._channel)
+        else:
+            data = struct.pack("!I", len(data)) + data  # 将长度转换为 4 字节大端序
+        self._conn.sendall(data)
+        metrics.SENT_BYTES.inc(len(data), self._channel)
 
     def recv(self) -> bytes:
         """
@@ -75,8 +155,39 @@ class RawSocket:
         if not length_data:
             return b""
         message_length = struct.unpack("!I", length_data)[0]  # 解包 4 字节大端整数
+        if message_length & _COMPRESSED_FLAG:
+            return self._recv_compressed(message_length & ~_COMPRESSED_FLAG)
+        metrics.RECEIVED_BYTES.inc(self._HEADER_SIZE + message_length, self._channel)
         return self._recv_exact(message_length)
 
+    def _recv_compressed(self, message_length: int) -> bytes:
+        """接收一条压缩消息并解压，压缩数据读入复用的缓冲区，不会每条消息重新分配。"""
+        metrics.RECEIVED_BYTES.inc(self._HEADER_SIZE + message_length, self._channel)
+        if len(self._scratch) < message_length:
+            self._scratch = bytearray(message_length)
+        view = memoryview(self._scratch)[:message_length]
+        if not self._recv_into(view):
+            return b""
+        return decompress_message(view, self._channel)
+
+    def _recv_into(self, view: memoryview) -> bool:
+        """
+        精确接收数据填满给定的缓冲区。
+
+        :param view: 目标缓冲区。
+        :return: 是否接收完整，连接已关闭时返回 False。
+        """
+        conn = self._conn
+        if conn is None:
+            raise ConnectionError("无客户端连接")
+        received = 0
+        while received < len(view):
+            count = conn.recv_into(view[received:])
+            if not count:
+                return False  # 连接已关闭
+            received += count
+        return True
+
     def _recv_exact(self, size: int) -> bytes:
         """
         精确接收指定字节数的数据。
@@ -84,22 +195,36 @@ class RawSocket:
         :param size: 需要接收的字节数。
         :return: 接收到的字节数据，如果连接已关闭则返回空字节。
         """
-        # recv 函数里面检查过了，这里简单 assert 一下，防止类型检查报错
-        assert self._conn is not None, "无客户端连接"
+        # 其他线程可能随时调用 disconnect()，这里先取出当前连接
+        conn = self._conn
+        if conn is None:
+            raise ConnectionError("无客户端连接")
         data = bytearray()
         while len(data) < size:
-            chunk = self._conn.recv(size - len(data))
+            chunk = conn.recv(size - len(data))
             if not chunk:
                 return b""  # 连接已关闭
             data.extend(chunk)
         return bytes(data)
 
-    def close(self):
+    def disconnect(self):
         """
-        关闭服务器 socket 及客户端连接。
+        关闭当前客户端连接，但保持监听，之后可以再次调用 accept()。
         """
         if self._conn:
+            try:
+                # 先 shutdown，使其他线程中阻塞的 recv 立即返回
+                self._conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self._conn.close()
+            self._conn = None
+
+    def close(self):
+        """
+        关闭服务器 socket 及客户端连接。
+        """
+        self.disconnect()
         self._sock.close()
         logger.info(f"{self._host}:{self._port}已关闭")
 
@@ -118,9 +243,36 @@ class ModelSocket:
     def accept(self):
         return self._raw_socket.accept()
 
+    def disconnect(self):
+        return self._raw_socket.disconnect()
+
     def close(self):
         return self._raw_socket.close()
 
+    def set_compression(self, codec: Codec | None, threshold: int = 1024):
+        """设置发送时使用的压缩算法，见 :meth:`RawSocket.set_compression`。"""
+        self._raw_socket.set_compression(codec, threshold)
+
+    def send_bytes(self, data: bytes):
+        """
+        发送已编码的消息。
+
+        :param data: 消息内容。
+        """
+        self._raw_socket.send(data)
+
+    def recv_bytes(self) -> bytes:
+        """
+        接收一条未解码的消息。
+
+        :return: 消息内容。
+        :raises ConnectionClosedError: 当连接已关闭时抛出。
+        """
+        raw_data = self._raw_socket.recv()
+        if not raw_data:
+            raise ConnectionClosedError("连接已关闭")
+        return raw_data
+
     def send(self, data: Any, type_: Any):
         """
         发送数据（自动 JSON 序列化）。
@@ -130,7 +282,21 @@ class ModelSocket:
         """
         adapter = TypeAdapter(type_)
         json_bytes = adapter.dump_json(data, by_alias=True)
-        self._raw_socket.send(json_bytes)
+        self.send_bytes(json_bytes)
+
+    def decode(self, raw_data: bytes, type_: Any) -> Any:
+        """
+        将 JSON 消息解析为指定类型。
+
+        :param raw_data: JSON 消息。
+        :param type_: 目标类型（可为 BaseModel、list[...]、tuple[...] 等）。
+        :return: 解析后的对象。
+        """
+        start_time = time.perf_counter()
+        adapter = TypeAdapter(type_)
+        result = adapter.validate_json(raw_data)
+        metrics.DECODE_SECONDS.observe(time.perf_counter() - start_time, ("state",))
+        return result
 
     def recv(self, type_: Any) -> Any:
         """
@@ -140,37 +306,119 @@ class ModelSocket:
         :return: 解析后的对象。
         :raises ConnectionClosedError: 当连接已关闭时抛出。
         """
-        raw_data = self._raw_socket.recv()
-        if not raw_data:
-            raise ConnectionClosedError("连接已关闭")
-        adapter = TypeAdapter(type_)
-        return adapter.validate_json(raw_data)
+        return self.decode(self.recv_bytes(), type_)
 
 
 class StreamingSocket:
     """
     支持单向接收视频流的 Socket。
+
+    启用 :attr:`~metacar.models.ProtocolFeature.FRAME_SEQ` 特性后，每张图像前带有帧头：
+    4 字节帧序号（大端序无符号整数）+ 1 字节摄像头 ID 长度 + UTF-8 编码的摄像头 ID。
+
+    启用 :attr:`~metacar.models.ProtocolFeature.SHARED_MEMORY_FRAMES` 特性后，图像数据可能是
+    共享内存描述符，由 :meth:`decode_frame` 解析，见 :mod:`metacar.shm`。
     """
 
+    _TAG_HEADER = struct.Struct("!IB")
+
     def __init__(self, host: str, port: int):
         self._raw_socket = RawSocket(host, port)
+        self._ring_reader = FrameRingReader()
 
     def accept(self):
         return self._raw_socket.accept()
 
+    def disconnect(self):
+        self._ring_reader.close()
+        return self._raw_socket.disconnect()
+
     def close(self):
+        self._ring_reader.close()
         return self._raw_socket.close()
 
-    def recv(self) -> np.ndarray:
+    def recv_raw(self) -> bytes:
         """
-        接收视频帧。
+        接收一张未解码的图像。
 
-        :return: 接收到的视频帧。
-        :rtype: numpy.ndarray
+        :return: 图像的编码数据。
         :raises ConnectionClosedError: 当连接已关闭时抛出。
         """
         raw_image = self._raw_socket.recv()
         if not raw_image:
             raise ConnectionClosedError("连接已关闭")
+        return raw_image
+
+    def recv_tagged(self) -> tuple[int, str, memoryview]:
+        """
+        接收一张带有帧头的未解码图像。
+
+        :return: 元组 (帧序号, 摄像头 ID, 图像的编码数据)，图像数据是接收缓冲区的视图，不会复制。
+        :raises ConnectionClosedError: 当连接已关闭时抛出。
+        :raises ValueError: 当帧头格式错误时抛出。
+        """
+        return self.parse_tagged(self.recv_raw())
+
+    @classmethod
+    def parse_tagged(cls, data: bytes) -> tuple[int, str, memoryview]:
+        """
+        解析一条带有帧头的图像消息。
+
+        :param data: 视频流中收到的消息。
+        :return: 元组 (帧序号, 摄像头 ID, 图像的编码数据)，图像数据是 ``data`` 的视图。
+        :raises ValueError: 当帧头格式错误时抛出。
+        """
+        header_size = cls._TAG_HEADER.size
+        if len(data) < header_size:
+            raise ValueError("帧头不完整")
+        seq, id_length = cls._TAG_HEADER.unpack_from(data)
+        camera_id = data[header_size : header_size + id_length].decode("utf-8")
+        return seq, camera_id, memoryview(data)[header_size + id_length :]
+
+    @staticmethod
+    def decode(raw_image: bytes | memoryview) -> np.ndarray:
+        """
+        解码图像。
+
+        :param raw_image: 图像的编码数据。
+        :return: 解码后的图像。
+        """
+        import cv2  # 延迟导入，只使用状态数据的程序不需要加载 OpenCV
+
+        start_time = time.perf_counter()
         frame = cv2.imdecode(np.frombuffer(raw_image, np.uint8), cv2.IMREAD_COLOR)
+        metrics.DECODE_SECONDS.observe(time.perf_counter() - start_time, ("frame",))
+        return frame
+
+    def decode_frame(
+        self, raw_image: bytes | memoryview, out: np.ndarray | None = None
+    ) -> np.ndarray:
+        """
+        解码图像，同时支持编码后的图像和共享内存描述符。
+
+        :param raw_image: 视频流中收到的图像数据。
+        :param out: 输出数组，形状与解码结果一致时把解码结果复制到其中并返回该数组，否则忽略。
+            ``cv2.imdecode`` 不支持输出到指定数组，用于需要把图像放进更大数组的场合（例如批量张量）。
+        :return: 解码后的图像，未压缩的共享内存图像为共享内存的视图，不会复制，也不会写入 ``out``。
+        :raises StaleFrameError: 当共享内存中的图像已被覆盖时抛出。
+        """
+        if not is_descriptor(raw_image):
+            frame = self.decode(raw_image)
+            if out is None or frame is None or frame.shape != out.shape:
+                return frame
+            np.copyto(out, frame)
+            return out
+        start_time = time.perf_counter()
+        frame = self._ring_reader.read(raw_image)
+        metrics.DECODE_SECONDS.observe(time.perf_counter() - start_time, ("frame",))
         return frame
+
+    def recv(self) -> np.ndarray:
+        """
+        接收视频帧。
+
+        :return: 接收到的视频帧。
+        :rtype: numpy.ndarray
+        :raises ConnectionClosedError: 当连接已关闭时抛出。
+        """
+        return self.decode_frame(self.recv_raw())
@@ -0,0 +1,156 @@
+"""
+按帧序号和摄像头 ID 对齐状态消息与图像帧。
+
+默认协议下，视频流中的第 k 张图像被认为属于最近一条 code3 的第 k 个摄像头，
+一旦丢失一张图像或摄像头列表发生变化，之后的所有图像都会错位。
+启用 :attr:`~metacar.models.ProtocolFeature.FRAME_SEQ` 特性后，
+每张图像都带有帧序号和摄像头 ID，:class:`FrameSynchronizer` 据此进行对齐。
+"""
+
+import logging
+import threading
+from .sockets import StreamingSocket, ConnectionClosedError
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FrameSynchronizer:
+    """
+    在后台线程中持续接收带帧头的图像（与状态消息的接收流水线并行），
+    并按帧序号缓存，供主循环按 (帧序号, 摄像头 ID) 取用。
+
+    TCP 保证同一连接上的图像按发送顺序到达，因此一旦收到更大帧序号的图像，
+    当前帧缺失的图像就不会再到达，此时直接判定为错位，丢弃旧数据并继续处理下一帧，
+    而不需要重建连接。
+
+    状态消息的帧序号总是递增，取用的帧序号比上一次小时，认为场景重新开始计数（例如重试关卡），
+    丢弃旧计数下的缓存并从新的帧序号重新对齐。某个摄像头超时未到达后，之后的帧不再等待它，
+    直到再次收到它的图像。
+    """
+
+    def __init__(
+        self,
+        streaming_socket: StreamingSocket,
+        timeout: float = 1.0,
+        max_pending: int = 64,
+    ):
+        """
+        :param streaming_socket: 已连接的视频流 socket。
+        :param timeout: 等待一帧图像到齐的最长时间，单位秒。
+        :param max_pending: 最多缓存多少个帧序号的图像，超出时丢弃最旧的。
+        """
+        self._streaming_socket = streaming_socket
+        self._timeout = timeout
+        self._max_pending = max_pending
+        self._cond = threading.Condition()
+        self._pending: dict[int, dict[str, memoryview]] = {}
+        self._max_seq = -1
+        self._last_seq = -1  # 上一次取用的帧序号
+        self._silent: set[str] = set()  # 超时未到达、之后不再等待的摄像头
+        self._closed = False
+        self._desync_count = 0
+        self._thread = threading.Thread(
+            target=self._run, name="metacar-frame-sync", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def desync_count(self) -> int:
+        """检测到错位（缺帧、多帧或超时）的帧数。"""
+        return self._desync_count
+
+    def _run(self):
+        try:
+            while True:
+                seq, camera_id, raw_image = self._streaming_socket.recv_tagged()
+                with self._cond:
+                    self._silent.discard(camera_id)
+                    self._pending.setdefault(seq, {})[camera_id] = raw_image
+                    self._max_seq = max(self._max_seq, seq)
+                    while len(self._pending) > self._max_pending:
+                        oldest = min(self._pending)
+                        self._drop(oldest)
+                    self._cond.notify_all()
+        except ValueError as e:
+            logger.error(f"视频流帧头错误：{e}")
+        except (ConnectionClosedError, OSError):
+            # 连接关闭或主循环关闭 socket 时退出
+            pass
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+
+    def join(self):
+        """等待后台线程退出，需先断开视频流连接。"""
+        self._thread.join()
+
+    def _drop(self, seq: int):
+        """丢弃某个帧序号下缓存的所有图像，调用时需持有锁。"""
+        frames = self._pending.pop(seq, None)
+        if frames:
+            metrics.DROPPED_FRAMES.inc(len(frames), ("desync",))
+
+    def _restart(self, seq: int):
+        """帧序号重新开始计数时丢弃旧计数下的缓存，调用时需持有锁。"""
+        logger.info(f"帧序号从 {self._last_seq} 回退到 {seq}，重新对齐")
+        # 不小于上一次取用的帧序号的缓存属于旧的计数（包括迟到的图像），
+        # 更小的是重新计数后已经到达的图像
+        for stale_seq in [s for s in self._pending if s >= self._last_seq]:
+            self._drop(stale_seq)
+        self._max_seq = max(self._pending, default=-1)
+
+    def collect(self, seq: int, camera_ids: list[str]) -> dict[str, memoryview]:
+        """
+        取出某一帧所有摄像头的图像。
+
+        等待直到所有摄像头的图像到齐、收到更新的帧或超时，之前超时的摄像头不再等待。
+        不完整时只返回已到达的图像，并丢弃所有不晚于该帧序号的缓存。
+
+        :param seq: code3 中的帧序号。
+        :param camera_ids: 该帧的摄像头 ID 列表。
+        :return: 摄像头 ID 到图像编码数据的映射。
+        :raises ConnectionClosedError: 当视频流连接已关闭且图像不完整时抛出。
+        """
+        wanted = set(camera_ids)
+        with self._cond:
+            if seq < self._last_seq:
+                self._restart(seq)
+            self._last_seq = seq
+            silent = self._silent & wanted
+            expected = wanted - silent
+            complete = self._cond.wait_for(
+                lambda: expected.issubset(self._pending.get(seq, {}))
+                or self._max_seq > seq
+                or self._closed,
+                self._timeout,
+            )
+            frames = self._pending.pop(seq, {})
+            if not wanted.issubset(frames):
+                if self._closed:
+                    raise ConnectionClosedError("连接已关闭")
+                if not complete:
+                    # 超时说明这些摄像头已经不再发送，之后的帧不再等待
+                    self._silent |= expected - frames.keys()
+                complete = False
+            # 丢弃摄像头列表之外的图像，以及已经过期的帧
+            extra = len(frames.keys() - wanted)
+            if extra:
+                metrics.DROPPED_FRAMES.inc(extra, ("desync",))
+                complete = False
+            for stale_seq in [s for s in self._pending if s < seq]:
+                self._drop(stale_seq)
+                complete = False
+        if not complete:
+            self._desync_count += 1
+            missing = wanted - frames.keys()
+            if not missing.issubset(silent):
+                logger.warning(
+                    f"帧 {seq} 图像错位，缺失摄像头 {sorted(missing)}，已重新对齐"
+                )
+        return {
+            camera_id: frames[camera_id]
+            for camera_id in camera_ids
+            if camera_id in frames
+        }
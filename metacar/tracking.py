@@ -0,0 +1,359 @@
+"""
+按障碍物 ID 跟踪的时序状态。
+
+每帧的 :attr:`SimCarMsg.obstacles <metacar.models.SimCarMsg.obstacles>` 互相独立，
+计算加速度、航向角速度或者"这辆车已经停了多久"都需要自己维护每个障碍物的历史。
+:class:`ObstacleTracker` 为每个障碍物 ID 分配固定容量数组中的一个槽，
+所有跟踪目标的状态都存放在按槽索引的 NumPy 数组中，每帧用一次向量化的计算更新平滑后的速度、
+加速度和航向角速度，并可以一次性预测所有目标未来的位置（匀速模型或 CTRV 模型）。
+
+ID 到槽的映射为字典，障碍物消失超过 ``max_age`` 秒后释放其槽供新的 ID 使用。
+每个槽还有一个固定长度的环形缓冲区，保存最近若干帧的时间、位置和航向。
+
+角度约定与 :mod:`metacar.trajectory` 相同：弧度，逆时针为正。
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Literal
+import numpy as np
+from .models import SimCarMsg
+from .trajectory import wrap_angle
+from .wire import state_arrays
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TrackArrays:
+    """所有活跃目标的状态，各数组的第一维一一对应。"""
+
+    ids: np.ndarray  #: 障碍物 ID，形状为 (n,)
+    types: np.ndarray  #: 障碍物类型的值，形状为 (n,)
+    position: np.ndarray  #: 位置，形状为 (n, 2)
+    velocity: np.ndarray  #: 平滑后的速度，形状为 (n, 2)
+    acceleration: np.ndarray  #: 平滑后的加速度，形状为 (n, 2)
+    yaw: np.ndarray  #: 航向，形状为 (n,)
+    yaw_rate: np.ndarray  #: 平滑后的航向角速度，形状为 (n,)
+    size: np.ndarray  #: (长度, 宽度)，形状为 (n, 2)
+    age: np.ndarray  #: 从首次出现到最近一次出现的时间，形状为 (n,)
+    stopped_duration: np.ndarray  #: 持续静止的时间，运动中为 0，形状为 (n,)
+    missing: np.ndarray  #: 本帧是否未出现（仍在 ``max_age`` 内），形状为 (n,)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def speed(self) -> np.ndarray:
+        """平滑后的速率，形状为 (n,)。"""
+        return np.hypot(self.velocity[:, 0], self.velocity[:, 1])
+
+
+class ObstacleTracker:
+    """
+    固定容量的障碍物跟踪器，每帧调用 :meth:`update`。
+
+    示例::
+
+        tracker = ObstacleTracker()
+        for sim_car_msg, frames in api.main_loop():
+            tracks = tracker.update(sim_car_msg).tracks()
+            waiting = tracks.ids[tracks.stopped_duration > 5.0]
+            future = tracker.predict([0.5, 1.0, 2.0], model="ctrv")
+    """
+
+    def __init__(
+        self,
+        capacity: int = 256,
+        history: int = 16,
+        time_constant: float = 0.3,
+        max_age: float = 1.0,
+        stop_speed: float = 0.2,
+        velocity_source: Literal["reported", "position"] = "reported",
+    ):
+        """
+        :param capacity: 同时跟踪的目标数量上限。
+        :param history: 每个目标保存的历史帧数。
+        :param time_constant: 指数平滑的时间常数，单位秒，越大越平滑，为 0 时不平滑。
+        :param max_age: 目标消失超过该时间（单位秒）后释放其槽。
+        :param stop_speed: 速率低于该值（单位 m/s）时视为静止。
+        :param velocity_source: 速度的来源，``"reported"`` 使用仿真端提供的速度，
+            ``"position"`` 由相邻两帧的位置差分得到。
+        """
+        self._capacity = capacity
+        self._history = history
+        self._time_constant = time_constant
+        self._max_age = max_age
+        self._stop_speed = stop_speed
+        self._velocity_source = velocity_source
+        self._slots: dict[int, int] = {}
+        self._time: float | None = None
+        self._allocate()
+
+    def _allocate(self):
+        """分配并清空所有数组。"""
+        capacity, history = self._capacity, self._history
+        self._free = list(range(capacity - 1, -1, -1))
+        self._active = np.zeros(capacity, dtype=bool)
+        self._ids = np.full(capacity, -1, dtype=np.int64)
+        self._types = np.zeros(capacity, dtype=np.int32)
+        self._position = np.zeros((capacity, 2))
+        self._velocity = np.zeros((capacity, 2))
+        self._acceleration = np.zeros((capacity, 2))
+        self._yaw = np.zeros(capacity)
+        self._yaw_rate = np.zeros(capacity)
+        self._size = np.zeros((capacity, 2))
+        self._first_seen = np.zeros(capacity)
+        self._last_seen = np.zeros(capacity)
+        # 开始静止的时间，运动中为 nan
+        self._stopped_since = np.full(capacity, np.nan)
+        # 环形缓冲区，_head 为下一次写入的位置
+        self._history_time = np.zeros((capacity, history))
+        self._history_position = np.zeros((capacity, history, 2))
+        self._history_yaw = np.zeros((capacity, history))
+        self._head = np.zeros(capacity, dtype=np.intp)
+        self._count = np.zeros(capacity, dtype=np.intp)
+
+    @property
+    def capacity(self) -> int:
+        """同时跟踪的目标数量上限。"""
+        return self._capacity
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, obstacle_id: int) -> bool:
+        return obstacle_id in self._slots
+
+    def reset(self):
+        """清空所有目标。"""
+        self._slots.clear()
+        self._time = None
+        self._allocate()
+
+    def _release(self, slots: np.ndarray):
+        for slot in slots.tolist():
+            del self._slots[int(self._ids[slot])]
+            self._free.append(slot)
+        self._active[slots] = False
+        self._ids[slots] = -1
+
+    def _assign(self, ids: list[int], now: float) -> np.ndarray:
+        """
+        查找或分配每个 ID 的槽。
+
+        :return: 每个 ID 的槽，容量不足时未分配的 ID 为 -1。
+        """
+        lookup = self._slots
+        slots = np.array([lookup.get(i, -1) for i in ids], dtype=np.intp)
+        missing = np.flatnonzero(slots < 0)
+        if len(missing) == 0:
+            return slots
+        if len(missing) > len(self._free):
+            # 容量不足时，按最近一次出现的时间从早到晚释放本帧未出现的目标
+            candidates = self._active.copy()
+            candidates[slots[slots >= 0]] = False
+            candidates &= self._last_seen < now
+            order = np.flatnonzero(candidates)
+            order = order[np.argsort(self._last_seen[order], kind="stable")]
+            self._release(order[: len(missing) - len(self._free)])
+            if len(missing) > len(self._free):
+                logger.warning(
+                    f"障碍物数量超过跟踪器容量 {self._capacity}，多余的障碍物不会被跟踪"
+                )
+        for idx in missing.tolist():
+            obstacle_id = ids[idx]
+            slot = lookup.get(obstacle_id)
+            if slot is None:
+                if not self._free:
+                    continue
+                slot = lookup[obstacle_id] = self._free.pop()
+                self._ids[slot] = obstacle_id
+            slots[idx] = slot
+        return slots
+
+    def update(
+        self, msg: SimCarMsg, timestamp: float | None = None
+    ) -> "ObstacleTracker":
+        """
+        用一帧的障碍物更新所有目标。
+
+        :param msg: 仿真动态信息，通过 :func:`metacar.wire.state_arrays` 读取障碍物数组。
+        :param timestamp: 本帧的时间，单位秒，默认为 :attr:`SceneStatus.used_time <metacar.models.SceneStatus.used_time>`。
+            时间倒退（例如重新开始关卡）时清空所有目标。
+        :return: 自身。
+        """
+        now = float(msg.scene_status.used_time if timestamp is None else timestamp)
+        if self._time is not None and now < self._time:
+            self.reset()
+        if self._time is not None and now == self._time:
+            return self
+        self._time = now
+        obstacles = state_arrays(msg).obstacles
+        slots = self._assign(obstacles["id"].tolist(), now)
+        valid = slots >= 0
+        if not valid.all():
+            slots, obstacles = slots[valid], obstacles[valid]
+        new = ~self._active[slots]
+        self._active[slots] = True
+        position = np.stack([obstacles["pos_x"], obstacles["pos_y"]], axis=-1)
+        yaw = -np.radians(obstacles["ori_z"])
+        self._step(slots, new, now, position, yaw, obstacles)
+        # 释放消失太久的目标
+        expired = np.flatnonzero(self._active & (now - self._last_seen > self._max_age))
+        if len(expired):
+            self._release(expired)
+        return self
+
+    def _step(
+        self,
+        slots: np.ndarray,
+        new: np.ndarray,
+        now: float,
+        position: np.ndarray,
+        yaw: np.ndarray,
+        obstacles: np.ndarray,
+    ):
+        """对本帧出现的所有目标做一次向量化的更新。"""
+        dt = now - self._last_seen[slots]
+        dt[new] = 0.0
+        moved = dt > 0
+        safe_dt = np.where(moved, dt, 1.0)
+        if self._velocity_source == "reported":
+            measured = np.stack([obstacles["vel_x"], obstacles["vel_y"]], axis=-1)
+        else:
+            measured = (position - self._position[slots]) / safe_dt[:, None]
+            measured[~moved] = self._velocity[slots][~moved]
+            measured[new] = 0.0
+        measured_yaw_rate = wrap_angle(yaw - self._yaw[slots]) / safe_dt
+        measured_yaw_rate[~moved] = self._yaw_rate[slots][~moved]
+        measured_yaw_rate[new] = 0.0
+        # 按时间间隔换算的指数平滑系数，帧率变化时平滑程度不变
+        if self._time_constant > 0:
+            alpha = np.where(new, 1.0, -np.expm1(-dt / self._time_constant))
+        else:
+            alpha = np.ones(len(slots))
+        previous_velocity = self._velocity[slots]
+        velocity = previous_velocity + alpha[:, None] * (measured - previous_velocity)
+        measured_acceleration = (velocity - previous_velocity) / safe_dt[:, None]
+        measured_acceleration[~moved] = self._acceleration[slots][~moved]
+        measured_acceleration[new] = 0.0
+        previous_acceleration = self._acceleration[slots]
+        self._acceleration[slots] = previous_acceleration + alpha[:, None] * (
+            measured_acceleration - previous_acceleration
+        )
+        self._velocity[slots] = velocity
+        previous_yaw_rate = self._yaw_rate[slots]
+        self._yaw_rate[slots] = previous_yaw_rate + alpha * (
+            measured_yaw_rate - previous_yaw_rate
+        )
+        self._position[slots] = position
+        self._yaw[slots] = yaw
+        self._types[slots] = obstacles["type"]
+        self._size[slots, 0] = obstacles["length"]
+        self._size[slots, 1] = obstacles["width"]
+        self._first_seen[slots[new]] = now
+        self._last_seen[slots] = now
+        # 静止计时
+        stopped = np.hypot(velocity[:, 0], velocity[:, 1]) < self._stop_speed
+        since = self._stopped_since[slots]
+        self._stopped_since[slots] = np.where(
+            stopped, np.where(np.isnan(since), now, since), np.nan
+        )
+        # 写入环形缓冲区
+        head = self._head[slots]
+        self._history_time[slots, head] = now
+        self._history_position[slots, head] = position
+        self._history_yaw[slots, head] = yaw
+        self._head[slots] = (head + 1) % self._history
+        count = np.where(new, 0, self._count[slots])
+        self._count[slots] = np.minimum(count + 1, self._history)
+
+    def _active_slots(self) -> np.ndarray:
+        return np.flatnonzero(self._active)
+
+    def tracks(self) -> TrackArrays:
+        """获取所有活跃目标的状态（副本），按槽的顺序排列。"""
+        slots = self._active_slots()
+        now = self._time if self._time is not None else 0.0
+        since = self._stopped_since[slots]
+        return TrackArrays(
+            ids=self._ids[slots],
+            types=self._types[slots],
+            position=self._position[slots],
+            velocity=self._velocity[slots],
+            acceleration=self._acceleration[slots],
+            yaw=self._yaw[slots],
+            yaw_rate=self._yaw_rate[slots],
+            size=self._size[slots],
+            age=self._last_seen[slots] - self._first_seen[slots],
+            stopped_duration=np.where(np.isnan(since), 0.0, now - since),
+            missing=self._last_seen[slots] < now,
+        )
+
+    def history(self, obstacle_id: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        获取一个目标最近若干帧的历史。
+
+        :param obstacle_id: 障碍物 ID。
+        :return: 元组 (时间, 位置, 航向)，按时间从早到晚排列，形状分别为 (k,)、(k, 2)、(k,)。
+        :raises KeyError: 当该 ID 未被跟踪时抛出。
+        """
+        slot = self._slots[obstacle_id]
+        count = int(self._count[slot])
+        order = (self._head[slot] - count + np.arange(count)) % self._history
+        return (
+            self._history_time[slot, order],
+            self._history_position[slot, order],
+            self._history_yaw[slot, order],
+        )
+
+    def predict(
+        self,
+        times: float | list[float] | np.ndarray,
+        model: Literal["cv", "ctrv"] = "cv",
+    ) -> np.ndarray:
+        """
+        一次性预测所有活跃目标未来的位置。
+
+        ``"cv"`` 为匀速直线模型；``"ctrv"`` 为匀速率、匀角速度模型，航向角速度接近 0 时退化为匀速直线模型。
+        预测的起点为目标最近一次出现时的位置，目标的顺序与 :meth:`tracks` 相同。
+
+        :param times: 相对本帧的预测时间，单位秒，标量或形状为 (t,) 的数组。
+        :param model: 运动模型。
+        :return: 预测位置，形状为 (n, t, 2)。
+        """
+        slots = self._active_slots()
+        now = self._time if self._time is not None else 0.0
+        # 消失的目标从最近一次出现的时间开始外推
+        horizon = (
+            np.atleast_1d(np.asarray(times, dtype=np.float64))[None, :]
+            + (now - self._last_seen[slots])[:, None]
+        )
+        position = self._position[slots][:, None, :]
+        velocity = self._velocity[slots]
+        if model == "cv":
+            return position + velocity[:, None, :] * horizon[..., None]
+        if model != "ctrv":
+            raise ValueError(f"未知的运动模型 {model}")
+        speed = np.hypot(velocity[:, 0], velocity[:, 1])
+        # 运动方向取速度方向，静止时取车身航向
+        heading = np.where(
+            speed > 1e-6, np.arctan2(velocity[:, 1], velocity[:, 0]), self._yaw[slots]
+        )[:, None]
+        omega = self._yaw_rate[slots][:, None]
+        turning = np.abs(omega) > 1e-4
+        safe_omega = np.where(turning, omega, 1.0)
+        angle = heading + omega * horizon
+        radius = (speed[:, None] / safe_omega)[..., None]
+        curved = np.stack(
+            [np.sin(angle) - np.sin(heading), np.cos(heading) - np.cos(angle)],
+            axis=-1,
+        )
+        straight = np.stack([np.cos(heading), np.sin(heading)], axis=-1)
+        displacement = np.where(
+            turning[..., None],
+            radius * curved,
+            (speed[:, None] * horizon)[..., None] * straight,
+        )
+        return position + displacement
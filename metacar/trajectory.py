@@ -0,0 +1,491 @@
+"""
+轨迹跟踪工具。
+
+:attr:`SimCarMsg.trajectory <metacar.models.SimCarMsg.trajectory>` 和
+:attr:`SceneStaticData.route <metacar.models.SceneStaticData.route>` 是 :class:`~metacar.Vector3` 的列表，
+每帧用 ``math.dist`` 逐点查找最近点和预瞄点的开销随轨迹长度线性增长。
+:class:`Trajectory` 把轨迹一次性转换为数组并预先计算累计弧长、航向和曲率，
+最近点查找可以从上一帧的结果附近开始搜索，:func:`stanley` 和 :func:`pure_pursuit` 在此基础上实现。
+
+角度约定与 :meth:`Vector3.yaw_rad <metacar.Vector3.yaw_rad>` 相同：弧度，逆时针为正。
+由 :attr:`PoseGnss.ori_z <metacar.models.PoseGnss.ori_z>` 换算时为 ``-math.radians(ori_z)``。
+"""
+
+import logging
+import math
+from dataclasses import dataclass
+import numpy as np
+from . import metrics
+from .geometry import Vector3
+from .models import SceneStaticData, SimCarMsg
+from .wire import cached_state_arrays, state_arrays
+
+logger = logging.getLogger(__name__)
+
+
+def _dedup(points: np.ndarray) -> np.ndarray:
+    """去掉水平面内连续重复的点。"""
+    if len(points) < 2:
+        return points
+    step = np.diff(points[:, :2], axis=0)
+    return points[np.concatenate([[True], np.any(step != 0, axis=1)])]
+
+
+def wrap_angle(angle: np.ndarray | float) -> np.ndarray:
+    """把角度换算到 [-π, π) 范围内。"""
+    return (np.asarray(angle) + math.pi) % (2 * math.pi) - math.pi
+
+
+@dataclass(frozen=True)
+class Projection:
+    """点在轨迹上的投影（最近点），各字段的形状与查询点相同。"""
+
+    index: np.ndarray  #: 最近点所在线段的下标，可作为下一次查找的 ``hint``
+    s: np.ndarray  #: 最近点的弧长坐标
+    x: np.ndarray  #: 最近点 X
+    y: np.ndarray  #: 最近点 Y
+    lateral: np.ndarray  #: 横向偏差（带符号），查询点在轨迹左侧时为正
+
+
+class Trajectory:
+    """
+    转换为数组的轨迹，以及预先计算的累计弧长、航向和曲率。
+
+    连续重复的轨迹点会被去掉，避免出现长度为 0 的线段。
+    """
+
+    #: 带 ``hint`` 查找时，在上次结果之前和之后搜索的线段数
+    SEARCH_BEHIND = 8
+    SEARCH_AHEAD = 56
+
+    def __init__(self, points: np.ndarray):
+        """
+        :param points: 轨迹点，形状为 (n, 2) 或 (n, 3)。
+        :raises ValueError: 当轨迹为空时抛出。
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2 or len(points) == 0:
+            raise ValueError("轨迹至少需要一个点")
+        if points.shape[1] == 2:
+            points = np.column_stack([points, np.zeros(len(points))])
+        points = _dedup(points)
+        self.points = points  #: 轨迹点，形状为 (n, 3)
+        self.points.flags.writeable = False
+        xy = points[:, :2]
+        if len(points) > 1:
+            delta = np.diff(xy, axis=0)
+        else:
+            delta = np.array([[1e-9, 0.0]])
+        length = np.hypot(delta[:, 0], delta[:, 1])
+        start = xy[:-1] if len(points) > 1 else xy
+        # 线段的起点和方向按分量分开保存，查找时避免跨步访问
+        self._sx, self._sy = start[:, 0].copy(), start[:, 1].copy()
+        self._dx, self._dy = delta[:, 0].copy(), delta[:, 1].copy()
+        self._inv_length2 = 1.0 / np.maximum(length * length, 1e-18)
+        #: 每个点的累计弧长，形状为 (n,)
+        self.s = np.concatenate([[0.0], np.cumsum(length)])[: len(points)]
+        # 点的航向取前后两条线段航向的平均，展开后可以直接插值
+        segment_heading = np.unwrap(np.arctan2(delta[:, 1], delta[:, 0]))
+        heading = np.empty(len(points))
+        heading[0] = segment_heading[0]
+        heading[-1] = segment_heading[-1]
+        heading[1:-1] = (segment_heading[:-1] + segment_heading[1:]) / 2
+        self._heading = heading
+        #: 每个点的曲率，左转为正，形状为 (n,)
+        self.curvature = (
+            np.gradient(heading, self.s) if len(points) > 2 else np.zeros(len(points))
+        )
+
+    @classmethod
+    def from_vectors(cls, points: list[Vector3]) -> "Trajectory":
+        """由 :class:`~metacar.Vector3` 列表构造。"""
+        return cls(np.array([(p.x, p.y, p.z) for p in points]).reshape(-1, 3))
+
+    @classmethod
+    def from_msg(cls, msg: SimCarMsg) -> "Trajectory":
+        """
+        由仿真动态信息中的推荐轨迹构造。
+
+        启用 :attr:`~metacar.models.ProtocolFeature.BINARY_STATE` 时直接使用解码得到的数组，
+        不会构造 :class:`~metacar.Vector3` 列表。
+        """
+        return cls(state_arrays(msg).trajectory)
+
+    @classmethod
+    def from_route(cls, static_data: SceneStaticData) -> "Trajectory":
+        """由场景静态信息中的路线构造。"""
+        return cls.from_vectors(static_data.route)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @property
+    def length(self) -> float:
+        """轨迹总长度。"""
+        return float(self.s[-1])
+
+    @property
+    def heading(self) -> np.ndarray:
+        """每个点的航向，形状为 (n,)。"""
+        return wrap_angle(self._heading)
+
+    def _slice(self, start: int, stop: int) -> "Trajectory":
+        """
+        取第 ``start`` 到 ``stop - 1`` 个点组成的轨迹，复用已计算的线段、弧长和航向。
+
+        结果与用这些点重新构造的轨迹相同。
+        """
+        if stop - start < 2:
+            return Trajectory(self.points[start:stop])
+        sliced = object.__new__(Trajectory)
+        sliced.points = self.points[start:stop]
+        segments = slice(start, stop - 1)
+        sliced._sx, sliced._sy = self._sx[segments], self._sy[segments]
+        sliced._dx, sliced._dy = self._dx[segments], self._dy[segments]
+        sliced._inv_length2 = self._inv_length2[segments]
+        sliced.s = self.s[start:stop] - self.s[start]
+        # 端点的航向只取一条线段的航向
+        heading = self._heading[start:stop].copy()
+        for idx, segment in ((0, start), (-1, stop - 2)):
+            segment_heading = math.atan2(self._dy[segment], self._dx[segment])
+            heading[idx] = heading[idx] + wrap_angle(segment_heading - heading[idx])
+        sliced._heading = heading
+        sliced.curvature = (
+            np.gradient(heading, sliced.s) if len(heading) > 2 else np.zeros(2)
+        )
+        return sliced
+
+    def _project_segments(
+        self, x: np.ndarray, y: np.ndarray, segments: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        把每个查询点投影到对应的一组线段上。
+
+        :param segments: 线段下标，形状为 (k, m) 或 (1, m)。
+        :return: 元组 (t, dist2)，分别为投影在线段上的位置（0 到 1）和距离的平方，形状为 (k, m)。
+        """
+        dx, dy = self._dx[segments], self._dy[segments]
+        rx = x[:, None] - self._sx[segments]
+        ry = y[:, None] - self._sy[segments]
+        t = (rx * dx + ry * dy) * self._inv_length2[segments]
+        np.clip(t, 0.0, 1.0, out=t)
+        ex = rx - t * dx
+        ey = ry - t * dy
+        return t, ex * ex + ey * ey
+
+    def nearest(
+        self,
+        x: np.ndarray | float,
+        y: np.ndarray | float,
+        hint: np.ndarray | int | None = None,
+    ) -> Projection:
+        """
+        查找点在轨迹上的最近点，可以一次查找多个点。
+
+        不提供 ``hint`` 时搜索所有线段；提供上一帧结果的 :attr:`Projection.index` 时，
+        只在其附近的 :attr:`SEARCH_BEHIND` + :attr:`SEARCH_AHEAD` 条线段中搜索，
+        最近点落在搜索范围的边界上时再搜索所有线段。
+
+        :param x: 查询点 X。
+        :param y: 查询点 Y。
+        :param hint: 上一次查找得到的线段下标。
+        :return: 最近点。
+        """
+        shape = np.shape(x)
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64)).ravel()
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64)).ravel()
+        index, t = self._search(x, y, hint)
+        return self._projection(x, y, index, t, shape)
+
+    def _search(
+        self, x: np.ndarray, y: np.ndarray, hint: np.ndarray | int | None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """查找每个点最近的线段，返回线段下标和投影在线段上的位置。"""
+        count = len(self._sx)
+        window = self.SEARCH_BEHIND + self.SEARCH_AHEAD
+        rows = np.arange(len(x))
+        if hint is None or count <= window:
+            t, dist2 = self._project_segments(x, y, np.arange(count)[None, :])
+            best = dist2.argmin(axis=1)
+            return best, t[rows, best]
+        first = np.clip(
+            np.atleast_1d(hint).ravel() - self.SEARCH_BEHIND, 0, count - window
+        )
+        segments = np.broadcast_to(first, (len(x),))[:, None] + np.arange(window)
+        t, dist2 = self._project_segments(x, y, segments)
+        best = dist2.argmin(axis=1)
+        index, t = segments[rows, best], t[rows, best]
+        # 最近点落在搜索范围的边界上（且不是轨迹的端点）时，可能还有更近的点
+        at_edge = ((best == 0) & (first > 0)) | (
+            (best == window - 1) & (first + window < count)
+        )
+        if at_edge.any():
+            index[at_edge], t[at_edge] = self._search(x[at_edge], y[at_edge], None)
+        return index, t
+
+    def _projection(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        index: np.ndarray,
+        t: np.ndarray,
+        shape: tuple,
+    ) -> Projection:
+        """由最近的线段和在线段上的位置构造投影结果。"""
+        sx, sy = self._sx[index], self._sy[index]
+        dx, dy = self._dx[index], self._dy[index]
+        px = sx + t * dx
+        py = sy + t * dy
+        s = self.s[np.minimum(index, len(self.s) - 1)] + t * np.sqrt(
+            1.0 / self._inv_length2[index]
+        )
+        # 叉积的符号表示查询点在线段的哪一侧
+        cross = dx * (y - sy) - dy * (x - sx)
+        lateral = np.copysign(np.hypot(x - px, y - py), cross)
+        return Projection(
+            index=index.reshape(shape),
+            s=np.minimum(s, self.length).reshape(shape),
+            x=px.reshape(shape),
+            y=py.reshape(shape),
+            lateral=lateral.reshape(shape),
+        )
+
+    def sample(self, s: np.ndarray | float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        按弧长坐标插值得到轨迹上的点，超出轨迹范围时取端点。
+
+        :param s: 弧长坐标。
+        :return: 元组 (x, y)。
+        """
+        return (
+            np.interp(s, self.s, self.points[:, 0]),
+            np.interp(s, self.s, self.points[:, 1]),
+        )
+
+    def heading_at(self, s: np.ndarray | float) -> np.ndarray:
+        """按弧长坐标插值得到轨迹的航向。"""
+        return wrap_angle(np.interp(s, self.s, self._heading))
+
+    def curvature_at(self, s: np.ndarray | float) -> np.ndarray:
+        """按弧长坐标插值得到轨迹的曲率，左转为正。"""
+        return np.interp(s, self.s, self.curvature)
+
+    def lookahead(
+        self, projection: Projection, distance: np.ndarray | float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        获取最近点沿轨迹向前 ``distance`` 处的预瞄点。
+
+        :param projection: :meth:`nearest` 的结果。
+        :param distance: 预瞄距离。
+        :return: 元组 (x, y)。
+        """
+        return self.sample(projection.s + distance)
+
+
+def stanley(
+    trajectory: Trajectory,
+    x: np.ndarray | float,
+    y: np.ndarray | float,
+    yaw: np.ndarray | float,
+    speed: np.ndarray | float,
+    gain: float = 0.5,
+    softening: float = 1.0,
+    hint: np.ndarray | int | None = None,
+) -> tuple[np.ndarray, Projection]:
+    """
+    Stanley 横向控制，可以一次计算多个车辆位姿。
+
+    :param trajectory: 要跟踪的轨迹。
+    :param x: 前轴中心 X。
+    :param y: 前轴中心 Y。
+    :param yaw: 车辆航向（弧度，逆时针为正）。
+    :param speed: 车速。
+    :param gain: 横向偏差的增益。
+    :param softening: 低速时避免转角过大的软化系数。
+    :param hint: 上一帧最近点的线段下标，见 :meth:`Trajectory.nearest`。
+    :return: 元组 (angle, projection)，angle 为前轮转角（弧度，逆时针为正），projection 为最近点。
+    """
+    projection = trajectory.nearest(x, y, hint)
+    heading_error = wrap_angle(trajectory.heading_at(projection.s) - yaw)
+    cross_track = np.arctan2(gain * projection.lateral, softening + np.abs(speed))
+    return wrap_angle(heading_error - cross_track), projection
+
+
+def pure_pursuit(
+    trajectory: Trajectory,
+    x: np.ndarray | float,
+    y: np.ndarray | float,
+    yaw: np.ndarray | float,
+    speed: np.ndarray | float,
+    wheelbase: float = 2.8,
+    gain: float = 0.5,
+    min_lookahead: float = 3.0,
+    hint: np.ndarray | int | None = None,
+) -> tuple[np.ndarray, Projection]:
+    """
+    纯跟踪横向控制，预瞄距离为 ``max(min_lookahead, gain * speed)``，可以一次计算多个车辆位姿。
+
+    :param trajectory: 要跟踪的轨迹。
+    :param x: 后轴中心 X。
+    :param y: 后轴中心 Y。
+    :param yaw: 车辆航向（弧度，逆时针为正）。
+    :param speed: 车速。
+    :param wheelbase: 轴距。
+    :param gain: 预瞄距离与车速的比例。
+    :param min_lookahead: 最小预瞄距离。
+    :param hint: 上一帧最近点的线段下标，见 :meth:`Trajectory.nearest`。
+    :return: 元组 (angle, projection)，angle 为前轮转角（弧度，逆时针为正），projection 为最近点。
+    """
+    projection = trajectory.nearest(x, y, hint)
+    distance = np.maximum(min_lookahead, gain * np.abs(speed))
+    target_x, target_y = trajectory.lookahead(projection, distance)
+    alpha = np.arctan2(target_y - y, target_x - x) - yaw
+    chord = np.maximum(np.hypot(target_x - x, target_y - y), 1e-6)
+    return np.arctan2(2 * wheelbase * np.sin(alpha), chord), projection
+
+
+def steering_command(
+    angle: np.ndarray | float, max_angle: float = math.radians(45)
+) -> np.ndarray:
+    """
+    把前轮转角换算为 :attr:`VehicleControl.steering <metacar.models.VehicleControl.steering>`。
+
+    :param angle: 前轮转角（弧度，逆时针为正）。
+    :param max_angle: 方向盘打满时的前轮转角。
+    :return: 方向盘，范围为 [-1, 1]，向右为正。
+    """
+    return np.clip(-np.asarray(angle) / max_angle, -1.0, 1.0)
+
+
+class TrajectoryCache:
+    """
+    跨帧复用推荐轨迹。
+
+    相邻两帧的推荐轨迹通常完全相同，或者只是随着主车前进去掉了开头的若干个点。
+    :meth:`update` 在轨迹没有变化时直接返回上一帧的 :class:`Trajectory`，
+    在新轨迹是上一帧轨迹的一段时复用已计算的数组，只有其他情况才重新构造。
+
+    对于 JSON 格式的 code3，:meth:`strip_json` 和 :meth:`restore` 在轨迹的 JSON 片段与上一帧相同时
+    跳过其解析和校验，直接复用上一帧的 :class:`~metacar.Vector3` 列表。
+    """
+
+    _MESSAGE_KEY = b'"SimCarMsg"'
+    _JSON_KEY = b'"Trajectory"'
+    # 轨迹点是只包含数字的 {"x": ..., "y": ..., "z": ...} 对象，片段中只会出现这些字符
+    _POINT_CHARS = b' \t\r\n{}":,.-+0123456789eExyzXYZ'
+
+    def __init__(self):
+        self._enabled = True
+        self._json: bytes | None = None
+        self._vectors: list[Vector3] | None = None
+        self._trajectory: Trajectory | None = None
+        self._source: list[Vector3] | np.ndarray | None = None
+        self._shift: int | None = None
+
+    @property
+    def shift(self) -> int | None:
+        """
+        上一次 :meth:`update` 时轨迹起点前移的点数，未变化时为 0，重新构造时为 None。
+
+        跨帧使用 :meth:`Trajectory.nearest` 的 ``hint`` 时，应减去该值。
+        """
+        return self._shift
+
+    def strip_json(self, raw_message: bytes) -> tuple[bytes, bool]:
+        """
+        轨迹的 JSON 片段与上一帧相同时，把它替换为空列表，避免重复解析。
+
+        :param raw_message: JSON 格式的 code3。
+        :return: 元组 (message, stripped)，stripped 表示轨迹是否已被去掉，需要传给 :meth:`restore`。
+        """
+        anchor = raw_message.find(self._MESSAGE_KEY)
+        if not self._enabled or anchor < 0:
+            return raw_message, False
+        key = raw_message.find(self._JSON_KEY, anchor + len(self._MESSAGE_KEY))
+        if key < 0:
+            return raw_message, False
+        value = key + len(self._JSON_KEY)
+        start = raw_message.find(b"[", value)
+        end = raw_message.find(b"]", start) + 1
+        if (
+            start < 0
+            or end <= 0
+            or raw_message[value:start].strip() != b":"
+            or raw_message[start + 1 : end - 1].translate(None, self._POINT_CHARS)
+        ):
+            # 不是紧跟在键后面的点列表，不做处理
+            return raw_message, False
+        fragment = raw_message[start:end]
+        if fragment == self._json and self._vectors is not None:
+            metrics.TRAJECTORY_CACHE.inc(1, ("json",))
+            return raw_message[:start] + b"[]" + raw_message[end:], True
+        self._json = fragment
+        self._vectors = None
+        return raw_message, False
+
+    def restore(self, msg: SimCarMsg, stripped: bool) -> bool:
+        """
+        解析 :meth:`strip_json` 处理过的消息后，填回上一帧的轨迹，或记录本帧的轨迹。
+
+        :param msg: 解析得到的仿真动态信息。
+        :param stripped: :meth:`strip_json` 的返回值。
+        :return: 去掉的片段是否确实是轨迹，为 False 时消息中其他同名字段被替换，需要重新解析原始消息。
+        """
+        if stripped:
+            if msg.trajectory:
+                # 轨迹被替换为空列表后解析结果仍不为空，说明去掉的是其他同名字段
+                logger.warning("轨迹的 JSON 片段定位错误，不再跳过轨迹的解析")
+                self._enabled = False
+                self._json = self._vectors = None
+                return False
+            msg.trajectory = self._vectors
+        else:
+            self._vectors = msg.trajectory
+        return True
+
+    def update(self, msg: SimCarMsg) -> Trajectory:
+        """
+        获取本帧的推荐轨迹。
+
+        :param msg: 仿真动态信息。
+        :return: 推荐轨迹，没有变化时返回与上一帧相同的对象。
+        :raises ValueError: 当轨迹为空时抛出。
+        """
+        previous = self._trajectory
+        arrays = cached_state_arrays(msg)
+        source = arrays.trajectory if arrays is not None else msg.trajectory
+        if source is self._source and previous is not None:
+            # strip_json 复用了上一帧的轨迹列表
+            self._shift = 0
+            metrics.TRAJECTORY_CACHE.inc(1, ("hit",))
+            return previous
+        if isinstance(source, np.ndarray):
+            points = source
+        else:
+            points = np.array([(p.x, p.y, p.z) for p in source], dtype=np.float64)
+        points = _dedup(points.reshape(-1, 3))
+        self._trajectory, self._shift = self._reuse(previous, points)
+        self._source = source
+        result = "rebuild" if self._shift is None else "shift" if self._shift else "hit"
+        metrics.TRAJECTORY_CACHE.inc(1, (result,))
+        return self._trajectory
+
+    @staticmethod
+    def _reuse(
+        previous: Trajectory | None, points: np.ndarray
+    ) -> tuple[Trajectory, int | None]:
+        """尽量复用上一帧的轨迹，返回轨迹和起点前移的点数。"""
+        if previous is not None and len(points):
+            old = previous.points
+            count = len(points)
+            if old.shape == points.shape and np.array_equal(old, points):
+                return previous, 0
+            candidates = np.flatnonzero(
+                (old[:, 0] == points[0, 0]) & (old[:, 1] == points[0, 1])
+            )
+            for start in candidates[:4].tolist():
+                stop = start + count
+                if stop <= len(old) and np.array_equal(old[start:stop], points):
+                    return previous._slice(start, stop), start
+        return Trajectory(points), None
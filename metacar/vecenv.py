@@ -0,0 +1,430 @@
+"""
+在多个工作进程中同时驱动多个仿真端，按批量返回观测。
+
+强化学习和大规模评测需要同时运行多个仿真端。:class:`VectorSceneEnv` 为每个仿真端启动一个工作进程，
+工作进程中的 :class:`~metacar.SceneAPI` 各自监听一对端口，负责接收、解析消息和解码图像，
+并把观测直接写入主进程创建的共享内存中的批量数组（第一维为仿真端下标）。
+主进程与工作进程之间只传递控制命令和几个字节的完成通知，所有仿真端并行步进，
+步进 N 个仿真端的耗时与步进一个相当。
+
+场景结束（code5）或连接中断时，工作进程等待该仿真端重新连接，新场景的第一帧即为新回合的开始；
+调用 :meth:`VectorSceneEnv.retry_level` 或 :meth:`VectorSceneEnv.skip_level` 后，
+关卡重新开始（已用时间倒退）的那一帧同样作为新回合的开始。
+指定 ``auto_reset`` 后，关卡已用时间达到时间限制时工作进程自动重试或跳过关卡。
+"""
+
+import logging
+import multiprocessing
+import os
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Sequence
+import numpy as np
+from .batch import FrameBatcher
+from .models import CameraFrame, SimCarMsg, VehicleControl
+from .sceneapi import SceneAPI
+from .shm import _AttachedSegment
+from .wire import OBSTACLE_DTYPE, POSE_FIELDS, state_arrays
+
+logger = logging.getLogger(__name__)
+
+#: 主车状态数组中各列的含义
+EGO_FIELDS = (*POSE_FIELDS, "speed", "throttle", "brake", "steering", "used_time")
+
+_ALIGN = 64
+
+# 工作进程发给主进程的消息类型
+_OBSERVATION = 0
+_ERROR = 1
+
+# 主进程发给工作进程的命令
+_CONTROL = 0
+_RETRY = 1
+_SKIP = 2
+
+
+@dataclass
+class VectorObservation:
+    """
+    一批观测，数组均为共享内存的视图，第一维为仿真端下标，障碍物的类型为 :data:`~metacar.wire.OBSTACLE_DTYPE`。
+
+    数组在下一次 :meth:`VectorSceneEnv.step` 时被覆盖，需要跨步保存时请复制。
+    """
+
+    ego: np.ndarray  #: 主车状态，形状为 (N, len(EGO_FIELDS))，各列见 :data:`EGO_FIELDS`
+    obstacles: np.ndarray  #: 障碍物，形状为 (N, max_obstacles)，多余的记录为 0
+    obstacle_counts: np.ndarray  #: 每个仿真端的有效障碍物数量，形状为 (N,)
+    trajectory: np.ndarray  #: 推荐轨迹，形状为 (N, max_trajectory_points, 3)
+    trajectory_counts: np.ndarray  #: 每个仿真端的有效轨迹点数量，形状为 (N,)
+    frames: np.ndarray  #: 图像，形状为 (N, cameras, 高, 宽, 3)，BGR，缺少的摄像头为 0
+    dones: np.ndarray  #: 形状为 (N,)，为 True 表示上一回合已结束，本帧是新回合的第一帧
+
+    @property
+    def obstacle_mask(self) -> np.ndarray:
+        """有效障碍物的掩码，形状为 (N, max_obstacles)。"""
+        return np.arange(self.obstacles.shape[1]) < self.obstacle_counts[:, np.newaxis]
+
+
+def _layout(
+    num_envs: int,
+    max_obstacles: int,
+    max_trajectory_points: int,
+    cameras: int,
+    frame_size: tuple[int, int],
+) -> tuple[dict[str, tuple[int, tuple[int, ...], np.dtype]], int]:
+    """
+    计算各批量数组在共享内存中的位置。
+
+    :return: 元组 (名称 -> (偏移量, 形状, 类型), 总字节数)。
+    """
+    width, height = frame_size
+    arrays = {
+        "ego": ((num_envs, len(EGO_FIELDS)), np.dtype("<f8")),
+        "obstacles": ((num_envs, max_obstacles), OBSTACLE_DTYPE),
+        "obstacle_counts": ((num_envs,), np.dtype("<i8")),
+        "trajectory": ((num_envs, max_trajectory_points, 3), np.dtype("<f8")),
+        "trajectory_counts": ((num_envs,), np.dtype("<i8")),
+        "frames": ((num_envs, cameras, height, width, 3), np.dtype(np.uint8)),
+    }
+    layout = {}
+    offset = 0
+    for name, (shape, dtype) in arrays.items():
+        layout[name] = (offset, shape, dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        offset += (size + _ALIGN - 1) // _ALIGN * _ALIGN
+    return layout, max(offset, 1)
+
+
+def _map_arrays(buf, layout: dict) -> dict[str, np.ndarray]:
+    """把共享内存映射为各批量数组。"""
+    return {
+        name: np.ndarray(shape, dtype, buffer=buf, offset=offset)
+        for name, (offset, shape, dtype) in layout.items()
+    }
+
+
+class _ObservationWriter:
+    """工作进程中把一帧写入共享内存中本仿真端对应的位置。"""
+
+    def __init__(self, arrays: dict[str, np.ndarray], index: int):
+        self._ego = arrays["ego"][index]
+        self._obstacles = arrays["obstacles"][index]
+        self._obstacle_counts = arrays["obstacle_counts"]
+        self._trajectory = arrays["trajectory"][index]
+        self._trajectory_counts = arrays["trajectory_counts"]
+        self._frames = arrays["frames"][index]
+        self._index = index
+        self._truncated = False
+
+    def write(self, msg: SimCarMsg, frames: list[CameraFrame]):
+        """写入一帧的主车状态、障碍物、推荐轨迹和图像。"""
+        state = state_arrays(msg)
+        vehicle = msg.main_vehicle
+        pose_size = len(POSE_FIELDS)
+        self._ego[:pose_size] = state.pose
+        self._ego[pose_size:] = (
+            vehicle.speed,
+            vehicle.throttle,
+            vehicle.brake,
+            vehicle.steering,
+            msg.scene_status.used_time,
+        )
+
+        obstacles = state.obstacles
+        capacity = len(self._obstacles)
+        if len(obstacles) > capacity:
+            # 只保留离主车最近的障碍物
+            distance = (obstacles["pos_x"] - state.pose[0]) ** 2 + (
+                obstacles["pos_y"] - state.pose[1]
+            ) ** 2
+            nearest = np.argpartition(distance, capacity - 1)[:capacity]
+            obstacles = obstacles[np.sort(nearest)]
+            if not self._truncated:
+                self._truncated = True
+                logger.warning(
+                    f"仿真端 {self._index} 的障碍物数量超过 {capacity}，只保留最近的障碍物"
+                )
+        count = len(obstacles)
+        previous = self._obstacle_counts[self._index]
+        self._obstacles[:count] = obstacles
+        if previous > count:
+            self._obstacles[count:previous] = 0
+        self._obstacle_counts[self._index] = count
+
+        trajectory = state.trajectory[: len(self._trajectory)]
+        count = len(trajectory)
+        previous = self._trajectory_counts[self._index]
+        self._trajectory[:count] = trajectory
+        if previous > count:
+            self._trajectory[count:previous] = 0
+        self._trajectory_counts[self._index] = count
+
+        cameras = len(self._frames)
+        batch = getattr(frames, "batch", None)
+        count = 0
+        if cameras and batch is not None:
+            count = min(cameras, len(batch.tensor))
+            self._frames[:count] = batch.tensor[:count]
+        if count < cameras:
+            self._frames[count:] = 0
+
+
+def _worker_main(
+    index: int,
+    ports: tuple[str, int, int],
+    scene_options: dict[str, Any],
+    frame_size: tuple[int, int],
+    auto_reset: str | None,
+    shm_name: str,
+    layout: dict,
+    conn,
+):
+    """工作进程的主函数，每个场景使用一个新的 SceneAPI，场景结束后等待仿真端重新连接。"""
+    segment = _AttachedSegment(shm_name, shared_tracker=True)
+    arrays = _map_arrays(segment.buf, layout)
+    writer = _ObservationWriter(arrays, index)
+    host, model_port, streaming_port = ports
+    options = dict(scene_options)
+    if arrays["frames"].shape[1]:
+        options.setdefault("frame_batcher", FrameBatcher(size=frame_size))
+    new_episode = True
+    try:
+        while True:
+            api = SceneAPI(
+                host=host,
+                model_port=model_port,
+                streaming_port=streaming_port,
+                **options,
+            )
+            api.connect()
+            last_time = None
+            reset_sent = False
+            for msg, frames in api.main_loop():
+                status = msg.scene_status
+                if last_time is not None and status.used_time < last_time:
+                    new_episode = True
+                    reset_sent = False
+                last_time = status.used_time
+                writer.write(msg, frames)
+                conn.send((_OBSERVATION, new_episode))
+                new_episode = False
+                if (
+                    auto_reset is not None
+                    and not reset_sent
+                    and 0 < status.time_limit <= status.used_time
+                ):
+                    # 随下一个控制命令发送，关卡重新开始前只发送一次
+                    if auto_reset == "retry":
+                        api.retry_level()
+                    else:
+                        api.skip_level()
+                    reset_sent = True
+                while True:
+                    command = conn.recv()
+                    if command is None:
+                        return
+                    kind, payload = command
+                    if kind == _RETRY:
+                        api.retry_level()
+                    elif kind == _SKIP:
+                        api.skip_level()
+                    else:
+                        api.set_vehicle_control(payload)
+                        break
+            logger.info(f"仿真端 {index} 的场景已结束，等待重新连接")
+            new_episode = True
+    except (KeyboardInterrupt, EOFError):
+        pass
+    except Exception as e:
+        conn.send((_ERROR, f"{type(e).__name__}: {e}"))
+    finally:
+        writer = arrays = None
+        try:
+            segment.close()
+        except BufferError:
+            pass
+
+
+class VectorSceneEnv:
+    """
+    同时驱动多个仿真端的批量环境。
+
+    第 i 个仿真端默认连接端口 (5061 + 10i, 5063 + 10i)，也可以通过 ``ports`` 指定。
+    :meth:`reset` 等待所有仿真端连接并返回第一帧，之后每次 :meth:`step` 发送一批控制命令，
+    并等待所有仿真端的下一帧。某个仿真端场景结束时，:meth:`step` 会等待它重新连接。
+
+    code5 之后连接即关闭，无法再发送重试或跳过关卡的命令，因此场景结束后只能等待仿真端重新连接。
+    ``auto_reset`` 处理的是连接仍然存在时的回合结束：已用时间达到时间限制后，
+    工作进程随下一个控制命令重试或跳过关卡，关卡重新开始的那一帧以 ``dones`` 标记。
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        ports: Sequence[tuple[int, int]] | None = None,
+        host: str = "127.0.0.1",
+        max_obstacles: int = 64,
+        max_trajectory_points: int = 256,
+        cameras: int = 0,
+        frame_size: tuple[int, int] = (640, 480),
+        scene_options: dict[str, Any] | None = None,
+        start_method: str | None = None,
+        auto_reset: str | None = None,
+    ):
+        """
+        :param num_envs: 仿真端数量。
+        :param ports: 每个仿真端的 (JSON 消息端口, 视频流端口)。
+        :param host: 监听的 IP 地址。
+        :param max_obstacles: 每个仿真端最多返回的障碍物数量，超出时只保留离主车最近的障碍物。
+        :param max_trajectory_points: 每个仿真端最多返回的推荐轨迹点数量，超出时截断。
+        :param cameras: 每个仿真端返回的摄像头数量，按 :class:`~metacar.models.CameraInfo` 的顺序，为 0 时不返回图像。
+        :param frame_size: 图像大小 (宽, 高)，大小不一致的图像会被缩放。
+        :param scene_options: 创建每个 :class:`~metacar.SceneAPI` 时的其他参数，例如 ``binary_state``。
+        :param start_method: 工作进程的启动方式（``"fork"``、``"spawn"`` 等），默认使用平台的默认方式。
+        :param auto_reset: 关卡已用时间达到时间限制时的处理方式，``"retry"`` 重试关卡，
+            ``"skip"`` 跳过关卡，默认为 None，不做处理。
+        :raises ValueError: 当端口数量与仿真端数量不一致或 ``auto_reset`` 无效时抛出。
+        """
+        if ports is None:
+            ports = [(5061 + 10 * idx, 5063 + 10 * idx) for idx in range(num_envs)]
+        if len(ports) != num_envs:
+            raise ValueError(f"端口数量 {len(ports)} 与仿真端数量 {num_envs} 不一致")
+        if auto_reset not in (None, "retry", "skip"):
+            raise ValueError(f"无效的 auto_reset：{auto_reset!r}")
+        context = multiprocessing.get_context(start_method)
+        self._num_envs = num_envs
+        self._layout, size = _layout(
+            num_envs, max_obstacles, max_trajectory_points, cameras, frame_size
+        )
+        self._shm = SharedMemory(create=True, size=size)
+        arrays = _map_arrays(self._shm.buf, self._layout)
+        for array in arrays.values():
+            array[...] = 0
+        self._observation = VectorObservation(
+            dones=np.zeros(num_envs, dtype=bool), **arrays
+        )
+        self._started = False
+        self._closed = False
+        self._conns = []
+        self._workers = []
+        if os.name == "posix":
+            # 工作进程需要与本进程共用 resource_tracker，必须在启动工作进程之前启动它
+            resource_tracker.ensure_running()
+        for idx, (model_port, streaming_port) in enumerate(ports):
+            parent_conn, child_conn = context.Pipe()
+            worker = context.Process(
+                target=_worker_main,
+                args=(
+                    idx,
+                    (host, model_port, streaming_port),
+                    scene_options or {},
+                    frame_size,
+                    auto_reset,
+                    self._shm.name,
+                    self._layout,
+                    child_conn,
+                ),
+                name=f"metacar-env-{idx}",
+                daemon=True,
+            )
+            worker.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._workers.append(worker)
+        logger.info(f"已启动 {num_envs} 个仿真端工作进程")
+
+    @property
+    def num_envs(self) -> int:
+        """仿真端数量。"""
+        return self._num_envs
+
+    @property
+    def observation(self) -> VectorObservation:
+        """最近一次返回的观测。"""
+        return self._observation
+
+    def _gather(self) -> VectorObservation:
+        """等待所有仿真端写入下一帧。"""
+        dones = self._observation.dones
+        for idx, conn in enumerate(self._conns):
+            try:
+                kind, payload = conn.recv()
+            except EOFError:
+                raise RuntimeError(f"仿真端 {idx} 的工作进程已退出") from None
+            if kind == _ERROR:
+                raise RuntimeError(f"仿真端 {idx} 出错：{payload}")
+            dones[idx] = payload
+        return self._observation
+
+    def reset(self) -> VectorObservation:
+        """
+        等待所有仿真端连接并返回第一帧，只需要在开始时调用一次，之后回合结束时自动开始新回合。
+
+        :return: 第一帧的观测，``dones`` 均为 True。
+        :raises RuntimeError: 当已经调用过或工作进程出错时抛出。
+        """
+        if self._started:
+            raise RuntimeError("环境已经开始运行，回合结束时会自动开始新回合")
+        self._started = True
+        return self._gather()
+
+    def step(self, controls: Sequence[VehicleControl]) -> VectorObservation:
+        """
+        向每个仿真端发送控制命令，并等待所有仿真端的下一帧。
+
+        :param controls: 每个仿真端的控制命令，与仿真端下标一一对应。
+        :return: 下一帧的观测，与上一次返回的是同一个对象。
+        :raises ValueError: 当控制命令数量与仿真端数量不一致时抛出。
+        :raises RuntimeError: 当尚未调用 :meth:`reset` 或工作进程出错时抛出。
+        """
+        if not self._started:
+            raise RuntimeError("需要先调用 reset()")
+        if len(controls) != self._num_envs:
+            raise ValueError(
+                f"控制命令数量 {len(controls)} 与仿真端数量 {self._num_envs} 不一致"
+            )
+        for conn, control in zip(self._conns, controls):
+            conn.send((_CONTROL, control))
+        return self._gather()
+
+    def retry_level(self, index: int):
+        """在下一次发送控制命令时通知第 ``index`` 个仿真端重试当前关卡。"""
+        self._conns[index].send((_RETRY, None))
+
+    def skip_level(self, index: int):
+        """在下一次发送控制命令时通知第 ``index`` 个仿真端跳过当前关卡。"""
+        self._conns[index].send((_SKIP, None))
+
+    def close(self):
+        """停止所有工作进程并释放共享内存，之前返回的观测数组随之失效。"""
+        if self._closed:
+            return
+        self._closed = True
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for worker in self._workers:
+            # 等待仿真端连接的工作进程不会响应命令
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        for conn in self._conns:
+            conn.close()
+        self._observation = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # 调用方仍持有观测数组，数组释放后由系统回收
+            pass
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,363 @@
+"""
+code3/code4 的紧凑二进制编码。
+
+启用 :attr:`~metacar.models.ProtocolFeature.BINARY_STATE` 特性后，体积最大、解析最慢的字段
+（``trajectory``、``obstacles`` 和 ``pose_gnss``）以固定布局的小端序数组传输，
+解码时直接得到指向接收缓冲区的 NumPy 数组，其余字段仍以 JSON 传输。
+
+code3 的二进制格式::
+
+    4 字节魔数 b"MCB3"
+    4 字节 JSON 头部长度 (uint32)，JSON 头部为去掉上述三个字段的 code3，
+        障碍物的额外信息以 {"下标": 字符串} 的形式放在 "ObstacleExtraInfo" 中
+    JSON 头部，之后补零到 8 字节对齐
+    位姿，9 个 float64（posX, posY, posZ, velX, velY, velZ, oriX, oriY, oriZ）
+    轨迹点数 n (uint32)，障碍物数 m (uint32)
+    轨迹，n × 3 个 float64
+    障碍物，m 条 :data:`OBSTACLE_DTYPE` 记录
+
+code4 的二进制格式::
+
+    4 字节魔数 b"MCB4"
+    油门、刹车、方向盘，3 个 float64
+    档位 (int32)，灯光标志位 (uint32，依次为左转向灯、右转向灯、双闪、前灯)
+    重开计数、跳关计数，2 个 int32
+    VLA 输出的 JSON 长度 (uint32)，之后为 VLA 输出的 JSON（无 VLA 输出时长度为 0）
+"""
+
+import json
+import struct
+import weakref
+from dataclasses import dataclass
+import numpy as np
+from pydantic import TypeAdapter
+from .geometry import Vector3
+from .models import (
+    Code3,
+    Code4,
+    MainVehicleInfo,
+    ObstacleInfo,
+    ObstacleType,
+    PoseGnss,
+    SceneStatus,
+    SensorInfo,
+    SimCarMsg,
+    TrafficLightGroupInfo,
+    VehicleControlDTO,
+    VLAExtensionOutput,
+)
+
+CODE3_MAGIC = b"MCB3"
+CODE4_MAGIC = b"MCB4"
+
+#: 障碍物记录的内存布局，字段名与 :class:`~metacar.models.ObstacleInfo` 一致
+OBSTACLE_DTYPE = np.dtype(
+    [
+        ("id", "<i8"),
+        ("type", "<i4"),
+        ("_reserved", "<i4"),
+        ("pos_x", "<f8"),
+        ("pos_y", "<f8"),
+        ("pos_z", "<f8"),
+        ("vel_x", "<f8"),
+        ("vel_y", "<f8"),
+        ("vel_z", "<f8"),
+        ("ori_x", "<f8"),
+        ("ori_y", "<f8"),
+        ("ori_z", "<f8"),
+        ("length", "<f8"),
+        ("width", "<f8"),
+        ("height", "<f8"),
+    ]
+)
+
+#: 位姿数组中各个分量的顺序，与 :class:`~metacar.models.PoseGnss` 的字段一致
+POSE_FIELDS = (
+    "pos_x",
+    "pos_y",
+    "pos_z",
+    "vel_x",
+    "vel_y",
+    "vel_z",
+    "ori_x",
+    "ori_y",
+    "ori_z",
+)
+
+_OBSTACLE_FLOAT_FIELDS = tuple(OBSTACLE_DTYPE.names[3:])
+_HEAVY_FIELDS = ("Trajectory", "ObstacleEntryList", "PoseGnss")
+_U32 = struct.Struct("<I")
+_COUNTS = struct.Struct("<II")
+_CODE4_BODY = struct.Struct("<3d i I 2i I")
+_OBSTACLE_TYPES = {member.value: member for member in ObstacleType}
+_OBSTACLE_FIELDS_SET = set(ObstacleInfo.model_fields)
+_HEADER_ADAPTER = TypeAdapter(Code3)
+_TRAFFIC_LIGHTS_ADAPTER = TypeAdapter(list[TrafficLightGroupInfo])
+_VLA_ADAPTER = TypeAdapter(VLAExtensionOutput)
+
+
+@dataclass
+class StateArrays:
+    """重量级字段的数组形式，二进制 code3 解码得到的数组均为接收缓冲区的只读视图。"""
+
+    pose: np.ndarray  #: 位姿，形状为 (9,)，顺序见 :data:`POSE_FIELDS`
+    trajectory: np.ndarray  #: 推荐轨迹，形状为 (n, 3)
+    obstacles: np.ndarray  #: 障碍物，形状为 (m,)，类型为 :data:`OBSTACLE_DTYPE`
+
+
+def is_binary(data: bytes) -> bool:
+    """判断一条消息是否为二进制编码（JSON 消息总是以 ``{`` 开头）。"""
+    return data[:4] in (CODE3_MAGIC, CODE4_MAGIC)
+
+
+def _align8(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def encode_code3(code3: Code3) -> bytes:
+    """将 code3 编码为二进制格式，供仿真端（以及参考仿真端）使用。
+
+    :param code3: 要编码的 code3 消息
+    :return: 编码后的字节数据
+    """
+    msg = code3.sim_car_msg
+    header = json.loads(_HEADER_ADAPTER.dump_json(code3, by_alias=True))
+    for field in _HEAVY_FIELDS:
+        header["SimCarMsg"].pop(field, None)
+    header["ObstacleExtraInfo"] = {
+        str(idx): obstacle.extra_info
+        for idx, obstacle in enumerate(msg.obstacles)
+        if obstacle.extra_info is not None
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    arrays = state_arrays(msg)
+    prefix = CODE3_MAGIC + _U32.pack(len(header_bytes)) + header_bytes
+    padding = b"\0" * (_align8(len(prefix)) - len(prefix))
+    return b"".join(
+        (
+            prefix,
+            padding,
+            arrays.pose.tobytes(),
+            _COUNTS.pack(len(arrays.trajectory), len(arrays.obstacles)),
+            arrays.trajectory.tobytes(),
+            arrays.obstacles.tobytes(),
+        )
+    )
+
+
+def decode_state_arrays(data: bytes) -> tuple[dict, StateArrays]:
+    """解码二进制 code3，只解析 JSON 头部，重量级字段直接映射为数组，不复制数据。
+
+    :param data: 二进制 code3 消息
+    :return: 元组 (JSON 头部, 数组)
+    :raises ValueError: 当消息格式错误时抛出
+    """
+    if data[:4] != CODE3_MAGIC:
+        raise ValueError("不是二进制 code3 消息")
+    (header_length,) = _U32.unpack_from(data, 4)
+    header = json.loads(data[8 : 8 + header_length])
+    offset = _align8(8 + header_length)
+    pose = np.frombuffer(data, "<f8", 9, offset)
+    offset += pose.nbytes
+    trajectory_count, obstacle_count = _COUNTS.unpack_from(data, offset)
+    offset += _COUNTS.size
+    trajectory = np.frombuffer(data, "<f8", trajectory_count * 3, offset)
+    offset += trajectory.nbytes
+    obstacles = np.frombuffer(data, OBSTACLE_DTYPE, obstacle_count, offset)
+    return header, StateArrays(pose, trajectory.reshape(-1, 3), obstacles)
+
+
+def decode_code3(data: bytes) -> Code3:
+    """解码二进制 code3。
+
+    只解析 JSON 头部，轨迹和障碍物直接映射为数组，可通过 :func:`state_arrays` 获取，不会复制数据。
+    :attr:`~metacar.models.SimCarMsg.trajectory` 和 :attr:`~metacar.models.SimCarMsg.obstacles`
+    在首次访问时才由数组构造，数组中的值已经是正确的类型，不再逐个字段校验。
+
+    :param data: 二进制 code3 消息
+    :return: 解码后的 code3
+    :raises ValueError: 当消息格式错误时抛出
+    """
+    header, arrays = decode_state_arrays(data)
+    extra_info = header.get("ObstacleExtraInfo", {})
+    msg_header = header["SimCarMsg"]
+    # 未知的障碍物类型在解码时就抛出 ValueError，而不是在首次访问时
+    for value in np.unique(arrays.obstacles["type"]).tolist():
+        if value not in _OBSTACLE_TYPES:
+            ObstacleType(value)
+
+    def pending() -> dict:
+        return {
+            "trajectory": _trajectory_from_array(arrays.trajectory),
+            "obstacles": _obstacles_from_array(arrays.obstacles, extra_info),
+        }
+
+    msg = SimCarMsg._from_lazy(
+        {
+            "pose_gnss": PoseGnss._from_trusted(
+                dict(zip(POSE_FIELDS, arrays.pose.tolist()))
+            ),
+            "main_vehicle": MainVehicleInfo.model_validate(
+                msg_header["DataMainVehicle"]
+            ),
+            "sensor": SensorInfo.model_validate(msg_header["Sensor"]),
+            "traffic_light_groups": _TRAFFIC_LIGHTS_ADAPTER.validate_python(
+                msg_header["TrafficLightStateLists"]
+            ),
+            "scene_status": SceneStatus.model_validate(msg_header["SceneStatus"]),
+        },
+        pending,
+    )
+    _cache_state_arrays(msg, arrays)
+    return Code3.model_construct(code=3, sim_car_msg=msg, seq=header.get("Seq"))
+
+
+def _trajectory_from_array(trajectory: np.ndarray) -> list[Vector3]:
+    return [Vector3(x, y, z) for x, y, z in trajectory.tolist()]
+
+
+def _obstacles_from_array(
+    obstacles: np.ndarray, extra_info: dict[str, str]
+) -> list[ObstacleInfo]:
+    names = OBSTACLE_DTYPE.names
+    types = _OBSTACLE_TYPES
+    # 所有障碍物共用同一个包含全部字段的集合，修改字段时不会改变集合
+    fields_set = _OBSTACLE_FIELDS_SET
+    construct = ObstacleInfo._from_trusted
+    result = []
+    for record in obstacles.tolist():
+        values = dict(zip(names, record))
+        del values["_reserved"]
+        values["type"] = types[values["type"]]
+        values["extra_info"] = None
+        result.append(construct(values, fields_set))
+    for idx, info in extra_info.items():
+        result[int(idx)].__dict__["extra_info"] = info
+    return result
+
+
+# 消息到数组形式的缓存。模型不可哈希，因此按 id 索引，并通过弱引用在消息被回收时移除；
+# 数组不放在模型的私有属性中，消息可以正常 pickle、复制和比较
+_STATE_CACHE: dict[int, tuple[weakref.ref, StateArrays]] = {}
+
+
+def _cache_state_arrays(msg: SimCarMsg, arrays: StateArrays):
+    key = id(msg)
+
+    def evict(ref: weakref.ref):
+        entry = _STATE_CACHE.get(key)
+        if entry is not None and entry[0] is ref:
+            del _STATE_CACHE[key]
+
+    _STATE_CACHE[key] = (weakref.ref(msg, evict), arrays)
+
+
+def cached_state_arrays(msg: SimCarMsg) -> StateArrays | None:
+    """获取已有的数组形式，不会构造。
+
+    :param msg: 仿真动态信息
+    :return: 通过二进制格式接收的消息或已调用过 :func:`state_arrays` 的消息返回其数组，否则返回 None
+    """
+    entry = _STATE_CACHE.get(id(msg))
+    if entry is not None and entry[0]() is msg:
+        return entry[1]
+    return None
+
+
+def state_arrays(msg: SimCarMsg) -> StateArrays:
+    """获取仿真动态信息中重量级字段的数组形式。
+
+    通过二进制格式接收的消息直接返回解码时的数组，否则由模型字段构造，并缓存到消息被回收为止。
+
+    :param msg: 仿真动态信息
+    :return: 位姿、轨迹和障碍物数组
+    """
+    arrays = cached_state_arrays(msg)
+    if arrays is not None:
+        return arrays
+    pose = np.array([getattr(msg.pose_gnss, name) for name in POSE_FIELDS], dtype="<f8")
+    trajectory = np.array(
+        [tuple(point) for point in msg.trajectory], dtype="<f8"
+    ).reshape(-1, 3)
+    obstacles = np.zeros(len(msg.obstacles), dtype=OBSTACLE_DTYPE)
+    if msg.obstacles:
+        obstacles["id"] = [obstacle.id for obstacle in msg.obstacles]
+        obstacles["type"] = [obstacle.type.value for obstacle in msg.obstacles]
+        for name in _OBSTACLE_FLOAT_FIELDS:
+            obstacles[name] = [getattr(obstacle, name) for obstacle in msg.obstacles]
+    arrays = StateArrays(pose, trajectory, obstacles)
+    _cache_state_arrays(msg, arrays)
+    return arrays
+
+
+def encode_code4(code4: Code4) -> bytes:
+    """将 code4 编码为二进制格式。
+
+    :param code4: 要编码的 code4 消息
+    :return: 编码后的字节数据
+    """
+    vc = code4.sim_car_msg.vehicle_control
+    flags = (
+        vc.left_blinker_on
+        | vc.right_blinker_on << 1
+        | vc.hazard_lights_on << 2
+        | vc.headlights_on << 3
+    )
+    vla_extension = code4.sim_car_msg.vla_extension
+    vla_bytes = (
+        b""
+        if vla_extension is None
+        else _VLA_ADAPTER.dump_json(vla_extension, by_alias=True)
+    )
+    return (
+        CODE4_MAGIC
+        + _CODE4_BODY.pack(
+            vc.throttle,
+            vc.brake,
+            vc.steering,
+            vc.gear.value,
+            flags,
+            vc.move_to_start,
+            vc.move_to_end,
+            len(vla_bytes),
+        )
+        + vla_bytes
+    )
+
+
+def decode_code4(data: bytes) -> tuple[VehicleControlDTO, dict | None]:
+    """解码二进制 code4，供仿真端（以及参考仿真端）使用。
+
+    :param data: 二进制 code4 消息
+    :return: 元组 (车辆控制, VLA 输出)，VLA 输出为 JSON 对象，字段名与 JSON 格式的 code4 相同
+    :raises ValueError: 当消息格式错误时抛出
+    """
+    if data[:4] != CODE4_MAGIC:
+        raise ValueError("不是二进制 code4 消息")
+    (
+        throttle,
+        brake,
+        steering,
+        gear,
+        flags,
+        move_to_start,
+        move_to_end,
+        vla_length,
+    ) = _CODE4_BODY.unpack_from(data, 4)
+    vla_offset = 4 + _CODE4_BODY.size
+    vla_extension = (
+        json.loads(data[vla_offset : vla_offset + vla_length]) if vla_length else None
+    )
+    vc = VehicleControlDTO(
+        throttle=throttle,
+        brake=brake,
+        steering=steering,
+        gear=gear,
+        left_blinker_on=bool(flags & 1),
+        right_blinker_on=bool(flags & 2),
+        hazard_lights_on=bool(flags & 4),
+        headlights_on=bool(flags & 8),
+        move_to_start=move_to_start,
+        move_to_end=move_to_end,
+    )
+    return vc, vla_extension
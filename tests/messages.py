@@ -0,0 +1,58 @@
+"""测试中使用的消息样例。"""
+
+import json
+
+
+def _vector(x, y, z=0.0):
+    return {"x": x, "y": y, "z": z}
+
+
+def code3_json(obstacles: int = 3) -> bytes:
+    pose = dict.fromkeys(
+        ("posX", "posY", "posZ", "velX", "velY", "velZ", "oriX", "oriY", "oriZ"), 0.0
+    )
+    message = {
+        "code": 3,
+        "SimCarMsg": {
+            "Trajectory": [_vector(float(d), 0.5 * d) for d in range(10)],
+            "PoseGnss": {**pose, "posX": 1.0, "velX": 10.0},
+            "DataMainVehicle": {
+                "mainVehicleId": 0,
+                "speed": 10.0,
+                "gear": 1,
+                "throttle": 0.3,
+                "brake": 0,
+                "steering": 0,
+                "length": 4.6,
+                "width": 1.9,
+                "height": 1.5,
+                "Signal_Light_LeftBlinker": False,
+                "Signal_Light_RightBlinker": False,
+                "Signal_Light_DoubleFlash": False,
+                "Signal_Light_BrakeLight": False,
+                "Signal_Light_FrontLight": False,
+            },
+            "Sensor": {"egoRGBCams": [], "v2xCams": []},
+            "ObstacleEntryList": [
+                {
+                    **pose,
+                    "id": idx + 1,
+                    "type": 6,
+                    "posX": 10.0 + idx,
+                    "length": 4.5,
+                    "width": 1.8,
+                    "height": 1.5,
+                    "RedundantValue": "SpeedLimit|30" if idx == 1 else None,
+                }
+                for idx in range(obstacles)
+            ],
+            "TrafficLightStateLists": [],
+            "SceneStatus": {
+                "SubSceneName": "test",
+                "UsedTime": 1.0,
+                "TimeLimit": 600,
+                "EndPoint": None,
+            },
+        },
+    }
+    return json.dumps(message).encode("utf-8")
@@ -0,0 +1,81 @@
+import math
+import numpy as np
+from metacar.bev import BEVRasterizer
+from metacar.models import Code3, SceneStaticData
+from metacar.obb import OrientedBoxes
+from messages import code3_json
+
+
+def _rasterizer(**kwargs) -> BEVRasterizer:
+    # 沿 X 轴的一条路线，Y = 0.25 使路线落在像素中心上
+    static_data = SceneStaticData.model_validate(
+        {
+            "route": [{"x": float(x), "y": 0.25, "z": 0.0} for x in range(-40, 41, 5)],
+            "roads": [],
+            "sub_scenes": [],
+            "vla_extension": None,
+        }
+    )
+    return BEVRasterizer(static_data, size=(64, 64), resolution=0.5, **kwargs)
+
+
+def _box(mask):
+    """返回掩码中像素的 (中心行, 中心列, 行数, 列数)。"""
+    rows, cols = np.nonzero(mask)
+    return (
+        (rows.min() + rows.max()) / 2,
+        (cols.min() + cols.max()) / 2,
+        rows.max() - rows.min() + 1,
+        cols.max() - cols.min() + 1,
+    )
+
+
+def _assert_box(mask, row, col, height, width):
+    """像素中心恰好落在边上时 cv2 的取舍不固定，允许半个像素的偏差。"""
+    center_row, center_col, rows, cols = _box(mask)
+    assert abs(center_row - row) <= 0.5 and abs(center_col - col) <= 0.5
+    assert height <= rows <= height + 1 and width <= cols <= width + 1
+
+
+def _render(bev, yaw, obstacles):
+    x, y, ori_z, length, width = np.array(obstacles, dtype=np.float64).T
+    boxes = OrientedBoxes.from_arrays(x, y, ori_z, length, width)
+    return bev.render_arrays(0.0, 0.0, yaw, boxes, np.empty((0, 2)), (4.0, 2.0))
+
+
+def test_obstacle_is_drawn_at_its_position_relative_to_ego():
+    bev = _rasterizer()
+    # 前方 10 米、长 4 米宽 2 米，以及左侧 6 米的障碍物
+    image = _render(bev, 0.0, [(10, 0, 0, 4, 2), (0, 6, 0, 4, 2)])
+    obstacles = image[bev.channel("obstacles")]
+    # 主车位于 (31.5, 31.5)，前方 10 米为第 11.5 行，长边沿竖直方向
+    _assert_box(obstacles[:, 25:40], 11.5, 31.5 - 25, 8, 4)
+    # 左侧 6 米为第 19.5 列
+    _assert_box(obstacles[:, :25], 31.5, 19.5, 8, 4)
+    ego = image[bev.channel("ego")]
+    assert ego[31, 31] == 255 and ego[25, 31] == 0
+    route = image[bev.channel("route")]
+    assert route[:, 31].all() and route.sum() == route[:, 31].sum()
+    assert set(np.unique(image)) <= {0, 255}
+
+
+def test_render_follows_ego_heading():
+    bev = _rasterizer()
+    # 主车朝向 Y 轴正方向时，Y 轴上的障碍物位于正前方，沿 X 轴的路线变为水平方向
+    image = _render(bev, math.pi / 2, [(0, 10, -90, 4, 2)])
+    _assert_box(image[bev.channel("obstacles")], 11.5, 31.5, 8, 4)
+    # 路线位于主车前方 0.25 米，即第 31 行
+    route = image[bev.channel("route")]
+    assert route[31].all() and route.sum() == route[31].sum()
+
+
+def test_render_reads_message_state():
+    bev = _rasterizer(ego_row=0.75)
+    msg = Code3.model_validate_json(code3_json(1)).sim_car_msg
+    image = bev.render(msg)
+    assert image.shape == bev.shape == (10, 64, 64)
+    # 主车位于 X = 1，障碍物位于 X = 10，主车在第 47.5 行
+    _assert_box(image[bev.channel("obstacles")], 47.5 - 9 / 0.5, 31.5, 9, 4)
+    # 推荐轨迹从主车后方开始向左前方延伸
+    trajectory = image[bev.channel("trajectory")]
+    assert trajectory[:47].any() and not trajectory[:, 33:].any()
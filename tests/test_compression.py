@@ -0,0 +1,39 @@
+import zlib
+import pytest
+from metacar.compression import Lz4Codec, ZlibCodec
+
+
+def test_zlib_round_trip():
+    codec = ZlibCodec()
+    data = b"metacar " * 1000
+    compressed = codec.compress(data)
+    assert codec.decompress(memoryview(compressed), len(data)) == data
+
+
+def test_zlib_rejects_payload_larger_than_declared():
+    codec = ZlibCodec()
+    data = b"metacar " * 1000
+    with pytest.raises(ValueError):
+        codec.decompress(memoryview(codec.compress(data)), len(data) - 1)
+
+
+def test_zlib_rejects_truncated_payload():
+    codec = ZlibCodec()
+    data = bytes(range(256)) * 64
+    compressed = zlib.compress(data)
+    with pytest.raises(ValueError):
+        codec.decompress(memoryview(compressed[: len(compressed) // 2]), len(data))
+
+
+def test_lz4_rejects_corrupt_payload():
+    pytest.importorskip("lz4")
+    codec = Lz4Codec()
+    data = bytes(range(256)) * 64
+    compressed = codec.compress(data)
+    assert codec.decompress(memoryview(compressed), len(data)) == data
+    with pytest.raises(ValueError):
+        codec.decompress(memoryview(compressed), len(data) - 1)
+    with pytest.raises(ValueError):
+        codec.decompress(memoryview(compressed[: len(compressed) // 2]), len(data))
+    with pytest.raises(ValueError):
+        codec.decompress(memoryview(b"\xff" * 32), len(data))
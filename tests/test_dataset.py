@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+from metacar.dataset import DatasetReader, DatasetWriter, export
+from metacar.models import CameraFrame, Code3, VehicleControl
+from metacar.wire import state_arrays
+from messages import code3_json
+
+
+def _msg(obstacles):
+    return Code3.model_validate_json(code3_json(obstacles)).sim_car_msg
+
+
+def _jpeg(value):
+    image = np.full((8, 8, 3), value, np.uint8)
+    return image, cv2.imencode(".jpg", image)[1].tobytes()
+
+
+def test_shard_round_trip_keeps_jpeg_blobs(tmp_path):
+    msgs = [_msg(obstacles) for obstacles in (2, 0, 3)]
+    blobs = []
+    with DatasetWriter(tmp_path, shard_size=2, workers=0) as writer:
+        for idx, msg in enumerate(msgs):
+            image, blob = _jpeg(40 * idx)
+            blobs.append(blob)
+            frames = [
+                CameraFrame(id="front", frame=image, raw=memoryview(blob)),
+                # 没有编码数据的图像在写入时编码
+                CameraFrame(id="rear", frame=image),
+            ]
+            writer.add(msg, frames, VehicleControl(throttle=0.1 * idx))
+    reader = DatasetReader(tmp_path)
+    assert len(reader) == 3 and [len(shard) for shard in reader.shards] == [2, 1]
+    assert reader.cameras == ["front", "rear"]
+    assert isinstance(reader.shards[0].obstacles, np.memmap)
+    np.testing.assert_allclose(reader.ticks()["control_throttle"], [0.0, 0.1, 0.2])
+    for idx, msg in enumerate(msgs):
+        arrays = state_arrays(msg)
+        np.testing.assert_array_equal(reader.obstacles(idx), arrays.obstacles)
+        np.testing.assert_array_equal(reader.trajectory(idx), arrays.trajectory)
+        assert bytes(reader.frame(idx, "front", decode=False)) == blobs[idx]
+        rear = reader.frame(idx, "rear")
+        assert rear.shape == (8, 8, 3) and abs(int(rear.mean()) - 40 * idx) <= 2
+
+
+def test_export_accepts_control_triples(tmp_path):
+    msg = _msg(1)
+    export([(msg, []), (msg, [], VehicleControl(brake=1.0))], tmp_path, workers=0)
+    ticks = DatasetReader(tmp_path).ticks()
+    assert np.isnan(ticks["control_brake"][0]) and ticks["control_brake"][1] == 1.0
+    assert ticks["control_gear"][0] == -1
@@ -0,0 +1,63 @@
+import threading
+from metacar.metrics import Counter, Histogram, MetricsRegistry
+
+
+def _samples(registry: MetricsRegistry) -> dict[str, float]:
+    lines = registry.render().splitlines()
+    assert lines[-1] == "# EOF"
+    return {
+        name: float(value)
+        for name, value in (
+            line.rsplit(" ", 1) for line in lines if not line.startswith("#")
+        )
+    }
+
+
+def test_render_sums_all_threads():
+    registry = MetricsRegistry()
+    ticks = registry.counter("ticks", "帧数", ("channel",))
+    seconds = registry.histogram("seconds", "耗时", buckets=(0.1, 1.0))
+    ticks.inc(2, ("model",))
+    seconds.observe(0.05)
+    thread = threading.Thread(
+        target=lambda: (ticks.inc(3, ("model",)), seconds.observe(0.5))
+    )
+    thread.start()
+    thread.join()
+    samples = _samples(registry)
+    assert samples['ticks_total{channel="model"}'] == 5.0
+    assert samples['seconds_bucket{le="0.1"}'] == 1
+    assert samples['seconds_bucket{le="1.0"}'] == 2
+    assert samples['seconds_bucket{le="+Inf"}'] == 2
+    assert samples["seconds_sum"] == 0.55
+    assert samples["seconds_count"] == 2
+
+
+def test_shards_of_finished_threads_are_merged():
+    counter = Counter("ticks", "帧数")
+    histogram = Histogram("seconds", "耗时", buckets=(1.0,))
+
+    def work():
+        counter.inc()
+        histogram.observe(2.0)
+
+    for _ in range(50):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    assert counter._shards == [] and histogram._shards == []
+    assert counter.value() == 50 and histogram.count() == 50
+    assert 'seconds_bucket{le="+Inf"} 50' in histogram.render()
+
+
+def test_histogram_render_is_consistent_during_observe():
+    histogram = Histogram("seconds", "耗时", buckets=(0.5,))
+    histogram.observe(0.1)
+    # 模拟导出时另一个线程的 observe 只增加了桶的计数，还没有增加总数
+    histogram._shard()[()][0][0] += 1
+    assert histogram.render()[2:] == [
+        'seconds_bucket{le="0.5"} 1',
+        'seconds_bucket{le="+Inf"} 1',
+        "seconds_sum 0.1",
+        "seconds_count 1",
+    ]
@@ -0,0 +1,30 @@
+import numpy as np
+from metacar.obb import OrientedBoxes, min_distance
+
+
+def _random_boxes(rng, count, extent):
+    return OrientedBoxes.from_arrays(
+        rng.uniform(-extent, extent, count),
+        rng.uniform(-extent, extent, count),
+        rng.uniform(0, 360, count),
+        rng.uniform(1, 6, count),
+        rng.uniform(1, 3, count),
+    )
+
+
+def test_min_distance_cutoff_matches_full_computation():
+    rng = np.random.default_rng(0)
+    a = _random_boxes(rng, 3, 10)
+    b = _random_boxes(rng, 200, 40)
+    full = min_distance(a, b)
+    assert (full == 0).any() and (full > 10).any()
+    cut = min_distance(a, b, max_distance=10.0)
+    np.testing.assert_array_equal(cut, np.where(full <= 10.0, full, np.inf))
+
+
+def test_min_distance_of_touching_and_separate_boxes():
+    a = OrientedBoxes.from_arrays([0.0], [0.0], [0.0], [4.0], [2.0])
+    b = OrientedBoxes.from_arrays(
+        [3.0, 10.0], [0.0, 0.0], [0.0, 90.0], [2.0, 4.0], [2.0, 2.0]
+    )
+    np.testing.assert_allclose(min_distance(a, b), [[0.0, 7.0]])
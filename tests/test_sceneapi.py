@@ -0,0 +1,18 @@
+import time
+from metacar.sceneapi import _LatestTickReader
+
+
+def test_latest_tick_reader_delivers_last_tick_before_end():
+    ticks = iter([(idx, []) for idx in range(30)] + [None])
+    reader = _LatestTickReader(lambda: next(ticks))
+    delivered, skipped = [], 0
+    while True:
+        tick, count = reader.take()
+        skipped += count
+        if tick is None:
+            break
+        delivered.append(tick[0])
+        time.sleep(0.01)
+    reader.join()
+    assert delivered[-1] == 29
+    assert len(delivered) + skipped == 30
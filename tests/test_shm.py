@@ -0,0 +1,54 @@
+import subprocess
+import sys
+import numpy as np
+import pytest
+from metacar.shm import FrameRing, FrameRingReader, StaleFrameError
+
+# 在新的解释器中运行，resource_tracker 的错误只会在进程退出时输出到 stderr
+_SAME_PROCESS = """
+import numpy as np
+from metacar.shm import FrameRing, FrameRingReader
+ring = FrameRing(16 * 16 * 3, 2)
+reader = FrameRingReader()
+assert reader.read(ring.write(np.ones((16, 16, 3), np.uint8))).sum() == 16 * 16 * 3
+reader.close()
+ring.close()
+"""
+
+
+def test_read_raw_frame():
+    ring = FrameRing(8 * 8 * 3, 2)
+    reader = FrameRingReader()
+    try:
+        image = np.arange(8 * 8 * 3, dtype=np.uint8).reshape(8, 8, 3)
+        np.testing.assert_array_equal(reader.read(ring.write(image)), image)
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_slot_being_overwritten_is_stale():
+    ring = FrameRing(8 * 8 * 3, 1)
+    reader = FrameRingReader()
+    try:
+        image = np.ones((8, 8, 3), np.uint8)
+        descriptor = ring.write(image)
+        np.testing.assert_array_equal(reader.read(descriptor, copy=True), image)
+        # 覆盖时先把代数置为 0，写入期间的读取不会得到写了一半的图像
+        ring._shm.buf[:8] = bytes(8)
+        with pytest.raises(StaleFrameError):
+            reader.read(descriptor)
+        ring.write(image * 2)
+        with pytest.raises(StaleFrameError):
+            reader.read(descriptor, copy=True)
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_reader_and_ring_in_one_process_exit_cleanly():
+    result = subprocess.run(
+        [sys.executable, "-c", _SAME_PROCESS], capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert "KeyError" not in result.stderr
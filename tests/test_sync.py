@@ -0,0 +1,77 @@
+import queue
+import threading
+import time
+from metacar.sockets import ConnectionClosedError
+from metacar.sync import FrameSynchronizer
+
+
+class _FakeStreamingSocket:
+    def __init__(self):
+        self.frames = queue.Queue()
+
+    def send(self, seq, *camera_ids):
+        for camera_id in camera_ids:
+            self.frames.put((seq, camera_id, memoryview(b"image")))
+
+    def recv_tagged(self):
+        frame = self.frames.get()
+        if frame is None:
+            raise ConnectionClosedError("连接已关闭")
+        return frame
+
+
+def _collect_timed(synchronizer, seq, camera_ids):
+    start_time = time.perf_counter()
+    frames = synchronizer.collect(seq, camera_ids)
+    return sorted(frames), time.perf_counter() - start_time
+
+
+def test_seq_restart_is_realigned():
+    streaming_socket = _FakeStreamingSocket()
+    synchronizer = FrameSynchronizer(streaming_socket, timeout=1.0, max_pending=8)
+    for seq in range(100, 110):
+        streaming_socket.send(seq, "a", "b")
+        assert _collect_timed(synchronizer, seq, ["a", "b"])[0] == ["a", "b"]
+    streaming_socket.send(0, "a", "b")
+    camera_ids, elapsed = _collect_timed(synchronizer, 0, ["a", "b"])
+    assert camera_ids == ["a", "b"] and elapsed < 0.5
+    streaming_socket.frames.put(None)
+    synchronizer.join()
+
+
+def test_small_seq_restart_is_realigned():
+    # 重新计数的帧序号只比之前小几十，小于 max_pending
+    streaming_socket = _FakeStreamingSocket()
+    synchronizer = FrameSynchronizer(streaming_socket, timeout=1.0)
+    for seq in range(30):
+        streaming_socket.send(seq, "a", "b")
+        assert _collect_timed(synchronizer, seq, ["a", "b"])[0] == ["a", "b"]
+    for seq in range(5):
+        # 图像晚于状态消息到达
+        threading.Timer(0.05, streaming_socket.send, (seq, "a", "b")).start()
+        camera_ids, elapsed = _collect_timed(synchronizer, seq, ["a", "b"])
+        assert camera_ids == ["a", "b"] and elapsed < 0.5
+    assert synchronizer.desync_count == 0
+    streaming_socket.frames.put(None)
+    synchronizer.join()
+
+
+def test_silent_camera_times_out_once():
+    streaming_socket = _FakeStreamingSocket()
+    synchronizer = FrameSynchronizer(streaming_socket, timeout=0.3)
+    streaming_socket.send(0, "a", "b")
+    assert _collect_timed(synchronizer, 0, ["a", "b"])[0] == ["a", "b"]
+    elapsed = []
+    for seq in range(1, 6):
+        streaming_socket.send(seq, "a")
+        camera_ids, seconds = _collect_timed(synchronizer, seq, ["a", "b"])
+        assert camera_ids == ["a"]
+        elapsed.append(seconds)
+    assert elapsed[0] >= 0.3 and max(elapsed[1:]) < 0.2
+    # 摄像头恢复发送后重新等待
+    streaming_socket.send(6, "a", "b")
+    time.sleep(0.1)
+    assert _collect_timed(synchronizer, 6, ["a", "b"])[0] == ["a", "b"]
+    assert synchronizer.desync_count == 5
+    streaming_socket.frames.put(None)
+    synchronizer.join()
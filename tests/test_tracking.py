@@ -0,0 +1,80 @@
+import json
+import math
+import numpy as np
+from metacar.models import Code3
+from metacar.tracking import ObstacleTracker
+from messages import code3_json
+
+
+def _msg(*obstacles):
+    """每个障碍物为 (id, posX, posY, velX, velY, yaw)，yaw 为逆时针为正的弧度。"""
+    message = json.loads(code3_json(1))
+    template = message["SimCarMsg"]["ObstacleEntryList"][0]
+    message["SimCarMsg"]["ObstacleEntryList"] = [
+        {
+            **template,
+            "id": obstacle_id,
+            "posX": x,
+            "posY": y,
+            "velX": vx,
+            "velY": vy,
+            "oriZ": -math.degrees(yaw),
+        }
+        for obstacle_id, x, y, vx, vy, yaw in obstacles
+    ]
+    return Code3.model_validate_json(json.dumps(message)).sim_car_msg
+
+
+def test_slot_is_released_after_max_age_and_reused():
+    tracker = ObstacleTracker(capacity=2, max_age=1.0)
+    tracker.update(_msg((1, 0, 0, 0, 0, 0), (2, 5, 0, 0, 0, 0)), timestamp=0.0)
+    tracker.update(_msg((1, 0, 0, 0, 0, 0)), timestamp=0.5)
+    tracks = tracker.tracks()
+    assert tracks.ids.tolist() == [1, 2] and tracks.missing.tolist() == [False, True]
+    tracker.update(_msg((1, 0, 0, 0, 0, 0)), timestamp=1.6)
+    assert len(tracker) == 1 and 2 not in tracker
+    # 新的 ID 占用释放的槽，历史从头开始
+    tracker.update(_msg((1, 0, 0, 0, 0, 0), (3, 8, 0, 0, 0, 0)), timestamp=1.7)
+    tracks = tracker.tracks()
+    assert tracks.ids.tolist() == [1, 3] and not tracks.missing.any()
+    times, positions, _ = tracker.history(3)
+    assert times.tolist() == [1.7] and positions.tolist() == [[8.0, 0.0]]
+    assert tracks.age.tolist() == [1.7, 0.0]
+
+
+def test_velocity_smoothing_follows_time_constant():
+    tracker = ObstacleTracker(time_constant=0.3)
+    tracker.update(_msg((1, 0, 0, 10, 0, 0)), timestamp=0.0)
+    # 第一次出现时直接采用观测值
+    np.testing.assert_allclose(tracker.tracks().velocity, [[10.0, 0.0]])
+    tracker.update(_msg((1, 1, 0, 0, 0, 0)), timestamp=0.1)
+    alpha = 1 - math.exp(-0.1 / 0.3)
+    np.testing.assert_allclose(tracker.tracks().velocity, [[10.0 * (1 - alpha), 0.0]])
+    # 同一时间的重复帧不改变状态
+    tracker.update(_msg((1, 1, 0, 0, 0, 0)), timestamp=0.1)
+    np.testing.assert_allclose(tracker.tracks().velocity, [[10.0 * (1 - alpha), 0.0]])
+
+
+def test_ctrv_prediction_stays_on_turning_circle():
+    omega, speed = 0.2, 5.0
+    tracker = ObstacleTracker(time_constant=0.0)
+    tracker.update(_msg((1, 0, 0, speed, 0, 0)), timestamp=0.0)
+    heading = omega * 1.0
+    vx, vy = speed * math.cos(heading), speed * math.sin(heading)
+    tracker.update(_msg((1, 3, 1, vx, vy, heading)), timestamp=1.0)
+    tracks = tracker.tracks()
+    np.testing.assert_allclose(tracks.yaw_rate, [omega])
+    times = np.linspace(0.5, 10.0, 20)
+    ctrv = tracker.predict(times, model="ctrv")[0]
+    radius = speed / omega
+    center = np.array([3.0, 1.0]) + radius * np.array(
+        [-math.sin(heading), math.cos(heading)]
+    )
+    np.testing.assert_allclose(np.hypot(*(ctrv - center).T), radius)
+    # 转过的角度等于角速度乘以时间
+    angles = np.unwrap(np.arctan2(*(ctrv - center).T[::-1]))
+    np.testing.assert_allclose(
+        angles - angles[0], omega * (times - times[0]), atol=1e-9
+    )
+    cv = tracker.predict(times, model="cv")[0]
+    np.testing.assert_allclose(cv, [3.0, 1.0] + np.outer(times, [vx, vy]))
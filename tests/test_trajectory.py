@@ -0,0 +1,50 @@
+import json
+from metacar.models import Code3
+from metacar.trajectory import TrajectoryCache
+from messages import code3_json
+
+
+def _decode(cache, raw_message):
+    stripped_message, stripped = cache.strip_json(raw_message)
+    code3 = Code3.model_validate_json(stripped_message)
+    if not cache.restore(code3.sim_car_msg, stripped):
+        code3 = Code3.model_validate_json(raw_message)
+    return stripped_message, stripped, code3.sim_car_msg
+
+
+def test_unchanged_trajectory_is_reused():
+    cache = TrajectoryCache()
+    raw_message = code3_json()
+    _, stripped, first = _decode(cache, raw_message)
+    assert not stripped
+    _, stripped, second = _decode(cache, raw_message)
+    assert stripped
+    assert second.trajectory is first.trajectory
+
+
+def test_key_outside_sim_car_msg_is_ignored():
+    message = json.loads(code3_json())
+    decoy = [{"x": 9.0, "y": 9.0, "z": 9.0}]
+    message = {"code": 3, "Trajectory": decoy, "SimCarMsg": message["SimCarMsg"]}
+    raw_message = json.dumps(message).encode("utf-8")
+    cache = TrajectoryCache()
+    _, _, first = _decode(cache, raw_message)
+    stripped_message, stripped, second = _decode(cache, raw_message)
+    assert stripped
+    assert json.loads(stripped_message)["Trajectory"] == decoy
+    assert second.trajectory == first.trajectory and len(second.trajectory) == 10
+
+
+def test_nested_key_before_trajectory_falls_back_to_full_parse():
+    message = json.loads(code3_json())
+    sim_car_msg = message["SimCarMsg"]
+    message["SimCarMsg"] = {
+        "Extra": {"Trajectory": [{"x": 9.0, "y": 9.0, "z": 9.0}]},
+        **sim_car_msg,
+    }
+    raw_message = json.dumps(message).encode("utf-8")
+    cache = TrajectoryCache()
+    for _ in range(3):
+        _, _, msg = _decode(cache, raw_message)
+        assert len(msg.trajectory) == 10
+    assert cache.strip_json(raw_message) == (raw_message, False)
@@ -0,0 +1,93 @@
+import contextlib
+import sys
+import threading
+from pathlib import Path
+import numpy as np
+import pytest
+from metacar.models import Code3, VehicleControl
+from metacar.vecenv import (
+    EGO_FIELDS,
+    VectorSceneEnv,
+    _layout,
+    _map_arrays,
+    _ObservationWriter,
+)
+from metacar.wire import state_arrays
+from messages import code3_json
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "examples"))
+from fake_simulator import FakeSimulator  # noqa: E402
+
+
+def _arrays(num_envs=2, max_obstacles=2, max_trajectory_points=4):
+    layout, size = _layout(num_envs, max_obstacles, max_trajectory_points, 0, (8, 8))
+    return _map_arrays(bytearray(size), layout)
+
+
+def test_writer_keeps_nearest_obstacles_and_clears_stale_rows():
+    arrays = _arrays()
+    writer = _ObservationWriter(arrays, 1)
+    msg = Code3.model_validate_json(code3_json(5)).sim_car_msg
+    writer.write(msg, [])
+    # 主车位于 posX = 1，最近的两个障碍物位于 posX = 10、11
+    assert arrays["obstacle_counts"].tolist() == [0, 2]
+    assert arrays["obstacles"][1]["pos_x"].tolist() == [10.0, 11.0]
+    assert arrays["trajectory_counts"].tolist() == [0, 4]
+    np.testing.assert_array_equal(
+        arrays["trajectory"][1], state_arrays(msg).trajectory[:4]
+    )
+    assert arrays["ego"][1, EGO_FIELDS.index("speed")] == 10.0
+    assert not arrays["obstacles"][0]["pos_x"].any() and not arrays["ego"][0].any()
+    writer.write(Code3.model_validate_json(code3_json(1)).sim_car_msg, [])
+    assert arrays["obstacle_counts"][1] == 1
+    assert arrays["obstacles"][1]["id"].tolist() == [1, 0]
+    assert arrays["obstacles"][1]["pos_x"].tolist() == [10.0, 0.0]
+
+
+def _run(simulator: FakeSimulator, ticks: int):
+    # 环境关闭时仿真端仍在等待最后一帧的控制命令
+    with contextlib.suppress(ConnectionError):
+        simulator.run(ticks)
+
+
+def test_invalid_arguments_are_rejected_before_starting_workers():
+    with pytest.raises(ValueError):
+        VectorSceneEnv(2, ports=[(6061, 6063)])
+    with pytest.raises(ValueError):
+        VectorSceneEnv(1, auto_reset="restart")
+
+
+def test_vector_env_steps_all_simulators():
+    ports = [(6161 + 10 * idx, 6163 + 10 * idx) for idx in range(2)]
+    simulators = [
+        FakeSimulator(
+            model_port=model_port,
+            streaming_port=streaming_port,
+            cameras=0,
+            obstacles=3 + idx,
+        )
+        for idx, (model_port, streaming_port) in enumerate(ports)
+    ]
+    threads = [
+        threading.Thread(target=_run, args=(simulator, 4), daemon=True)
+        for simulator in simulators
+    ]
+    with VectorSceneEnv(2, ports=ports, max_obstacles=8) as env:
+        for thread in threads:
+            thread.start()
+        observation = env.reset()
+        assert observation.dones.all()
+        assert observation.obstacle_counts.tolist() == [3, 4]
+        assert observation.ego.shape == (2, len(EGO_FIELDS))
+        assert observation.frames.shape[:2] == (2, 0)
+        used_time = EGO_FIELDS.index("used_time")
+        for step in range(1, 4):
+            observation = env.step([VehicleControl(throttle=0.5)] * 2)
+            assert not observation.dones.any()
+            np.testing.assert_allclose(observation.ego[:, used_time], 0.05 * step)
+        assert observation.obstacle_mask.sum(axis=1).tolist() == [3, 4]
+        with pytest.raises(ValueError):
+            env.step([VehicleControl()])
+    for thread, simulator in zip(threads, simulators):
+        thread.join(timeout=5)
+        assert simulator.last_control["throttle"] == 0.5
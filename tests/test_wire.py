@@ -0,0 +1,53 @@
+import copy
+import pickle
+import timeit
+import pytest
+from metacar import wire
+from metacar.models import Code3
+from messages import code3_json
+
+
+def _json_msg():
+    return Code3.model_validate_json(code3_json()).sim_car_msg
+
+
+def _binary_msg():
+    code3 = Code3.model_validate_json(code3_json())
+    return wire.decode_code3(wire.encode_code3(code3)).sim_car_msg
+
+
+@pytest.mark.parametrize("decode", [_json_msg, _binary_msg])
+def test_message_pickle_copy_and_equality(decode):
+    msg = decode()
+    wire.state_arrays(msg)
+    assert msg == _json_msg()
+    restored = pickle.loads(pickle.dumps(msg))
+    assert restored == msg
+    for copied in (msg.model_copy(), copy.deepcopy(msg)):
+        assert copied.trajectory == msg.trajectory
+        assert copied == msg
+    assert msg.obstacles[1].extra_info == "SpeedLimit|30"
+
+
+def test_binary_state_arrays_are_cached_per_message():
+    msg = _binary_msg()
+    arrays = wire.cached_state_arrays(msg)
+    assert arrays is not None
+    assert wire.state_arrays(msg) is arrays
+    assert wire.cached_state_arrays(msg.model_copy()) is None
+    assert wire.cached_state_arrays(_json_msg()) is None
+
+
+def test_binary_decode_skips_per_obstacle_models():
+    raw = code3_json(obstacles=500)
+    data = wire.encode_code3(Code3.model_validate_json(raw))
+    json_time = min(
+        timeit.repeat(lambda: Code3.model_validate_json(raw), number=20, repeat=5)
+    )
+    binary_time = min(
+        timeit.repeat(lambda: wire.decode_code3(data), number=20, repeat=5)
+    )
+    assert binary_time < json_time / 5
+    msg = wire.decode_code3(data).sim_car_msg
+    assert len(msg.obstacles) == 500
+    assert msg == Code3.model_validate_json(raw).sim_car_msg